@@ -60,6 +60,43 @@ def create_app():
     else:
         app.config['DEBUG'] = os.getenv('FLASK_DEBUG', 'False').lower() == 'true'
 
+    # Hardware ingestion (see ingestion/)
+    app.config["HARDWARE_ASYNC_INGEST"] = os.getenv('HARDWARE_ASYNC_INGEST', 'False').lower() == 'true'
+    app.config["HARDWARE_INGEST_QUEUE_SIZE"] = int(os.getenv('HARDWARE_INGEST_QUEUE_SIZE', '1000'))
+    app.config["HARDWARE_INGEST_BATCH_SIZE"] = int(os.getenv('HARDWARE_INGEST_BATCH_SIZE', '100'))
+    app.config["HARDWARE_INGEST_FLUSH_INTERVAL"] = float(os.getenv('HARDWARE_INGEST_FLUSH_INTERVAL', '0.05'))
+    app.config["HARDWARE_GROUP_COMMIT"] = os.getenv('HARDWARE_GROUP_COMMIT', 'False').lower() == 'true'
+    app.config["HARDWARE_GROUP_COMMIT_WINDOW_MS"] = float(os.getenv('HARDWARE_GROUP_COMMIT_WINDOW_MS', '5'))
+    app.config["HARDWARE_GROUP_COMMIT_MAX_SIZE"] = int(os.getenv('HARDWARE_GROUP_COMMIT_MAX_SIZE', '50'))
+    app.config["HARDWARE_DEADBAND_GRAMS"] = float(os.getenv('HARDWARE_DEADBAND_GRAMS', '0'))
+    app.config["HARDWARE_DEADBAND_PERCENT"] = float(os.getenv('HARDWARE_DEADBAND_PERCENT', '0'))
+    app.config["HARDWARE_DEADBAND_LOG_EVERY"] = int(os.getenv('HARDWARE_DEADBAND_LOG_EVERY', '10'))
+    app.config["HARDWARE_INGEST_CORE"] = os.getenv('HARDWARE_INGEST_CORE', 'False').lower() == 'true'
+    app.config["HARDWARE_REGISTRY_TTL"] = float(os.getenv('HARDWARE_REGISTRY_TTL', '60'))
+    app.config["HARDWARE_REGISTRY_SYNC_FILE"] = os.getenv('HARDWARE_REGISTRY_SYNC_FILE')
+    app.config["HARDWARE_REGISTRY_NEGATIVE_TTL"] = float(os.getenv('HARDWARE_REGISTRY_NEGATIVE_TTL', '60'))
+    app.config["HARDWARE_UNKNOWN_LOG_INTERVAL"] = float(os.getenv('HARDWARE_UNKNOWN_LOG_INTERVAL', '60'))
+    app.config["HARDWARE_MAX_DECOMPRESSED_BYTES"] = int(os.getenv('HARDWARE_MAX_DECOMPRESSED_BYTES', str(2 * 1024 * 1024)))
+    app.config["HARDWARE_REPORT_INTERVAL"] = float(os.getenv('HARDWARE_REPORT_INTERVAL', '60'))
+    app.config["HARDWARE_REPORT_INTERVAL_MIN"] = float(os.getenv('HARDWARE_REPORT_INTERVAL_MIN', '15'))
+    app.config["HARDWARE_REPORT_INTERVAL_MAX"] = float(os.getenv('HARDWARE_REPORT_INTERVAL_MAX', '900'))
+    app.config["HARDWARE_REPORT_TARGET_RATE"] = float(os.getenv('HARDWARE_REPORT_TARGET_RATE', '20'))
+    app.config["HARDWARE_LINE_HOST"] = os.getenv('HARDWARE_LINE_HOST', '0.0.0.0')
+    app.config["HARDWARE_LINE_TCP_PORT"] = int(os.getenv('HARDWARE_LINE_TCP_PORT', '8094'))
+    app.config["HARDWARE_LINE_UDP_PORT"] = int(os.getenv('HARDWARE_LINE_UDP_PORT', '8094'))
+    app.config["HARDWARE_GATEWAY_THREADS"] = int(os.getenv('HARDWARE_GATEWAY_THREADS', '4'))
+    app.config["HARDWARE_GATEWAY_MAX_PENDING"] = int(os.getenv('HARDWARE_GATEWAY_MAX_PENDING', '1000'))
+    app.config["HARDWARE_GATEWAY_BODY_TIMEOUT"] = float(os.getenv('HARDWARE_GATEWAY_BODY_TIMEOUT', '30'))
+    app.config["HARDWARE_SPOOL_DIR"] = os.getenv('HARDWARE_SPOOL_DIR')
+    app.config["HARDWARE_SPOOL_SEGMENT_BYTES"] = int(os.getenv('HARDWARE_SPOOL_SEGMENT_BYTES', str(16 * 1024 * 1024)))
+    app.config["HARDWARE_SPOOL_LATENCY_BUDGET_MS"] = float(os.getenv('HARDWARE_SPOOL_LATENCY_BUDGET_MS', '1000'))
+    app.config["HARDWARE_SPOOL_REPLAY_BATCH"] = int(os.getenv('HARDWARE_SPOOL_REPLAY_BATCH', '100'))
+    app.config["HARDWARE_SPOOL_RETRY_INTERVAL"] = float(os.getenv('HARDWARE_SPOOL_RETRY_INTERVAL', '5'))
+    app.config["HARDWARE_IDEMPOTENCY_CACHE_SIZE"] = int(os.getenv('HARDWARE_IDEMPOTENCY_CACHE_SIZE', '16'))
+    app.config["HARDWARE_LOG_PARTITIONS"] = os.getenv('HARDWARE_LOG_PARTITIONS', 'False').lower() == 'true'
+    app.config["HARDWARE_LOG_PARTITIONS_AHEAD"] = int(os.getenv('HARDWARE_LOG_PARTITIONS_AHEAD', '2'))
+    app.config["HARDWARE_LOG_RETENTION_MONTHS"] = int(os.getenv('HARDWARE_LOG_RETENTION_MONTHS', '0'))
+
     # 2) Authentication setup
     login_manager.init_app(app)
 
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Benchmark: /api/hardware/sensor_data with and without group commit.
+
+Many threads post kit payloads concurrently (like a threaded gunicorn worker)
+and we count COMMITs issued to the database. Uses a temporary SQLite file by
+default; pass --database-url (and --yes-drop: every table is dropped) to run
+against a scratch MySQL database.
+
+    python bench_group_commit.py --threads 16 --requests 50
+"""
+
+import argparse
+import threading
+import time
+
+from sqlalchemy import event
+
+from bench_support import add_database_arguments, bench_database, build_app, dispose
+
+
+def run(app, threads, requests_per_thread, compartments):
+    from db import db
+
+    with app.test_client() as client:
+        for t in range(threads):
+            client.post("/api/hardware/register_hardware", json={
+                "hardware_id": f"BENCH_{t}",
+                "name": f"Bench kit {t}",
+                "compartments": compartments
+            })
+
+    commits = []
+    with app.app_context():
+        engine = db.engine
+    listener = lambda conn: commits.append(1)
+    event.listen(engine, "commit", listener)
+
+    failures = []
+    barrier = threading.Barrier(threads)
+
+    def worker(t):
+        client = app.test_client()
+        barrier.wait()
+        for i in range(requests_per_thread):
+            response = client.post("/api/hardware/sensor_data", json={
+                "hardware_id": f"BENCH_{t}",
+                "sensor_type": "weight",
+                "compartments": [
+                    {"compartment": c, "weight": 100.0 - i * 0.1, "unit": "grams"}
+                    for c in range(1, compartments + 1)
+                ]
+            })
+            if response.status_code != 200:
+                failures.append(response.status_code)
+
+    workers = [threading.Thread(target=worker, args=(t,)) for t in range(threads)]
+    started = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - started
+    event.remove(engine, "commit", listener)
+
+    total = threads * requests_per_thread
+    return {
+        "payloads": total,
+        "failures": len(failures),
+        "commits": len(commits),
+        "seconds": elapsed,
+        "payloads_per_sec": total / elapsed,
+        "commits_per_sec": len(commits) / elapsed
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_database_arguments(parser)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=50, help="Requests per thread")
+    parser.add_argument("--compartments", type=int, default=8)
+    parser.add_argument("--window-ms", type=float, default=5)
+    args = parser.parse_args()
+
+    print(f"⚡ Group commit benchmark: {args.threads} threads x {args.requests} requests, "
+          f"{args.compartments} compartments")
+    print("=" * 60)
+
+    for group_commit in (False, True):
+        with bench_database(args) as url:
+            app = build_app(url, HARDWARE_GROUP_COMMIT="true" if group_commit else "false",
+                            HARDWARE_GROUP_COMMIT_WINDOW_MS=args.window_ms)
+            stats = run(app, args.threads, args.requests, args.compartments)
+            dispose(app)
+
+        label = "group commit" if group_commit else "per-request"
+        print(f"{label:>13}: {stats['payloads_per_sec']:8.1f} payloads/s  "
+              f"{stats['commits']:5d} commits ({stats['commits_per_sec']:7.1f}/s)  "
+              f"{stats['seconds']:.2f}s  failures={stats['failures']}")
+
+
+if __name__ == "__main__":
+    main()
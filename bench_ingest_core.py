@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark: per-payload latency of the ORM and Core ingestion paths.
+
+Posts the same sequence of kit payloads to /api/hardware/sensor_data with
+HARDWARE_INGEST_CORE off and on, with the device registry disabled
+(HARDWARE_REGISTRY_TTL=0) so both runs load their kits, and also times the pipeline alone
+(apply_sensor_batch + COMMIT, no HTTP/Flask routing). Uses a temporary
+SQLite file by default; pass --database-url (and --yes-drop: every table is
+dropped) to run against a scratch MySQL database.
+
+    python bench_ingest_core.py --payloads 500 --compartments 16
+"""
+
+import argparse
+import statistics
+import time
+
+from bench_support import add_database_arguments, bench_database, build_app, dispose
+
+
+def payload(kit, compartments, i):
+    return {
+        "hardware_id": f"BENCH_{kit}",
+        "sensor_type": "weight",
+        "compartments": [
+            {"compartment": c, "weight": 100.0 - (i % 50) - c * 0.5, "unit": "grams"}
+            for c in range(1, compartments + 1)
+        ]
+    }
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    return {
+        "mean": statistics.mean(samples),
+        "p50": samples[len(samples) // 2],
+        "p95": samples[int(len(samples) * 0.95) - 1]
+    }
+
+
+def run(app, payloads, compartments, kits):
+    from db import db
+    from ingestion.pipeline import apply_sensor_batch
+
+    endpoint, pipeline = [], []
+    with app.test_client() as client:
+        for k in range(kits):
+            client.post("/api/hardware/register_hardware", json={
+                "hardware_id": f"BENCH_{k}", "name": f"Bench kit {k}", "compartments": compartments
+            })
+            # Create the compartments so both runs time the update path
+            client.post("/api/hardware/sensor_data", json=payload(k, compartments, 0))
+
+        for i in range(payloads):
+            started = time.perf_counter()
+            response = client.post("/api/hardware/sensor_data", json=payload(i % kits, compartments, i + 1))
+            endpoint.append((time.perf_counter() - started) * 1000)
+            assert response.status_code == 200, response.get_json()
+
+    with app.app_context():
+        for i in range(payloads):
+            started = time.perf_counter()
+            apply_sensor_batch([payload(i % kits, compartments, i + 2)])
+            pipeline.append((time.perf_counter() - started) * 1000)
+        db.session.remove()
+        db.engine.dispose()
+
+    return summarize(endpoint), summarize(pipeline)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_database_arguments(parser)
+    parser.add_argument("--payloads", type=int, default=300)
+    parser.add_argument("--compartments", type=int, default=16)
+    parser.add_argument("--kits", type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"⚡ ORM vs Core ingestion: {args.payloads} payloads, {args.compartments} compartments, {args.kits} kits")
+    print("=" * 60)
+
+    for core in (False, True):
+        with bench_database(args) as url:
+            app = build_app(url, HARDWARE_INGEST_CORE="true" if core else "false", HARDWARE_REGISTRY_TTL="0")
+            endpoint, pipeline = run(app, args.payloads, args.compartments, args.kits)
+            dispose(app)
+
+        label = "core" if core else "orm"
+        print(f"{label:>4} endpoint: mean {endpoint['mean']:6.2f}ms  p50 {endpoint['p50']:6.2f}ms  p95 {endpoint['p95']:6.2f}ms")
+        print(f"{label:>4} pipeline: mean {pipeline['mean']:6.2f}ms  p50 {pipeline['p50']:6.2f}ms  p95 {pipeline['p95']:6.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
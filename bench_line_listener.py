@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Load test: line-protocol listener (ingestion/line_listener.py).
+
+Starts the listener on free local ports, registers --kits kits and lets
+--senders processes fire protocol lines at it over TCP or UDP for
+--seconds, paced to --rate lines per second overall (0 = as fast as they
+can). Each line carries --compartments readings, so the reading rate is
+lines/s x compartments. Reports what was sent, accepted, dropped (UDP with
+a full queue) and written by the batching writer, plus the time to drain.
+Uses a temporary SQLite file by default; pass --database-url (and --yes-drop:
+every table is dropped) for a scratch MySQL database.
+
+    python bench_line_listener.py --transport udp --rate 10000 --compartments 4
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import socket
+import time
+
+from bench_support import add_database_arguments, bench_database, build_app, dispose
+
+
+def sender(transport, port, kits, compartments, seconds, rate, sender_index, sent):
+    """One sending process: paced lines for `seconds`, counted into `sent`."""
+    if transport == "tcp":
+        sock = socket.create_connection(("127.0.0.1", port))
+    else:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    # Lines go out in small bursts so pacing costs little per line
+    burst = 50
+    interval = burst / rate if rate else 0
+    count = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        lines = []
+        for _ in range(burst):
+            kit = (sender_index + count) % kits
+            weight = 100.0 - (count % 1000) * 0.05
+            readings = ",".join(f"{c}={weight:.2f}" for c in range(1, compartments + 1))
+            lines.append(f"LINE_{kit} {readings} {int(time.time())}\n")
+            count += 1
+        if transport == "tcp":
+            sock.sendall("".join(lines).encode("utf-8"))
+        else:
+            for line in lines:
+                sock.sendto(line.encode("utf-8"), ("127.0.0.1", port))
+        if interval:
+            delay = started + (count / burst) * interval - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+    sock.close()
+    with sent.get_lock():
+        sent.value += count
+
+
+async def run(app, args):
+    from ingestion.line_listener import LineProtocolListener
+
+    with app.test_client() as client:
+        for k in range(args.kits):
+            client.post("/api/hardware/register_hardware", json={
+                "hardware_id": f"LINE_{k}",
+                "name": f"Line kit {k}",
+                "compartments": args.compartments
+            })
+
+    listener = LineProtocolListener(app)
+    tcp_port, udp_port = await listener.start(
+        "127.0.0.1",
+        0 if args.transport == "tcp" else None,
+        0 if args.transport == "udp" else None
+    )
+    port = tcp_port or udp_port
+
+    sent = multiprocessing.Value("l", 0)
+    per_sender_rate = args.rate / args.senders if args.rate else 0
+    processes = [
+        multiprocessing.Process(target=sender, args=(
+            args.transport, port, args.kits, args.compartments, args.seconds, per_sender_rate, i, sent
+        ))
+        for i in range(args.senders)
+    ]
+    started = time.perf_counter()
+    for p in processes:
+        p.start()
+    loop = asyncio.get_running_loop()
+    while any(p.is_alive() for p in processes):
+        await asyncio.sleep(0.05)
+    send_seconds = time.perf_counter() - started
+    # Let the loop read what is still in the socket buffers
+    await asyncio.sleep(0.5)
+
+    await loop.run_in_executor(None, listener.writer.drain, 3600.0)
+    total_seconds = time.perf_counter() - started
+    stats = listener.stats()
+    await listener.stop()
+    return sent.value, send_seconds, total_seconds, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_database_arguments(parser)
+    parser.add_argument("--transport", choices=("tcp", "udp"), default="tcp")
+    parser.add_argument("--kits", type=int, default=100)
+    parser.add_argument("--compartments", type=int, default=4)
+    parser.add_argument("--senders", type=int, default=4, help="Sending processes (TCP: one connection each)")
+    parser.add_argument("--rate", type=int, default=10000, help="Lines per second overall, 0 = unpaced")
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--batch-size", type=int, default=500, help="Writer batch size")
+    parser.add_argument("--queue-size", type=int, default=100000)
+    args = parser.parse_args()
+
+    print(f"⚡ Line protocol load test: {args.transport}, {args.senders} senders, "
+          f"{args.rate or 'unpaced'} lines/s x {args.compartments} readings for {args.seconds:g}s")
+    print("=" * 60)
+
+    with bench_database(args) as url:
+        app = build_app(url, HARDWARE_INGEST_BATCH_SIZE=args.batch_size, HARDWARE_INGEST_QUEUE_SIZE=args.queue_size)
+        sent, send_seconds, total_seconds, stats = asyncio.run(run(app, args))
+        dispose(app)
+
+    writer = stats["writer"]
+    readings = args.compartments
+    print(f"   sent: {sent:8d} lines  {sent / send_seconds:9.0f} lines/s  {sent * readings / send_seconds:9.0f} readings/s")
+    print(f"   received: {stats['lines']:4d} lines  accepted {stats['accepted']}  invalid {stats['invalid']}  "
+          f"dropped {stats['dropped']}")
+    print(f"   written: {writer['processed']:5d} payloads ({writer['failed']} failed) in {writer['batches']} batches "
+          f"(avg {writer['avg_batch_size'] or 0:.0f}, avg flush {writer['avg_flush_ms'] or 0:.1f}ms)")
+    print(f"   end to end: {total_seconds:.2f}s  {writer['processed'] / total_seconds:9.0f} lines/s  "
+          f"{writer['processed'] * readings / total_seconds:9.0f} readings/s written")
+
+
+if __name__ == "__main__":
+    main()
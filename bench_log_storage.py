@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Storage benchmark: hardware log layout before and after compressed payloads.
+
+Posts --payloads sensor_data reports from --kits kits through the app, so
+rows are written exactly as ingestion writes them: one compressed payload
+row in hardware_logs plus one compartment_readings row per reading. The
+same reports are also written in the previous layout (the payload's JSON
+on its row and every compartment's JSON again on a row of its own) into a
+scratch copy of hardware_logs, and both are compared on:
+
+- insert bytes: bytes of the bound INSERT parameters sent to the database
+- table size: pages used by the tables (SQLite dbstat, or
+  information_schema on MySQL)
+
+Uses a temporary SQLite file by default; pass --database-url (and --yes-drop:
+every table is dropped) for a scratch MySQL database.
+
+    python bench_log_storage.py --payloads 2000 --compartments 4 16
+"""
+
+import argparse
+import json
+from datetime import datetime
+
+from bench_support import add_database_arguments, bench_database, build_app, dispose
+
+
+def payload(kit, compartments, n):
+    return {
+        "hardware_id": f"STORE_{kit}",
+        "sensor_type": "weight",
+        "timestamp": datetime.utcnow().replace(microsecond=0).isoformat(),
+        "compartments": [
+            {"compartment": c, "weight": round(100.0 - (n % 500) * 0.17 - c * 1.3, 2), "unit": "grams"}
+            for c in range(1, compartments + 1)
+        ]
+    }
+
+
+def parameter_bytes(parameters):
+    """Rough size of bound parameters: text/bytes by length, numbers and dates by their storage size."""
+    rows = parameters if isinstance(parameters, (list, tuple)) and parameters and \
+        isinstance(parameters[0], (list, tuple, dict)) else [parameters]
+    total = 0
+    for row in rows:
+        for value in (row.values() if isinstance(row, dict) else row):
+            if isinstance(value, (str, bytes)):
+                total += len(value.encode("utf-8") if isinstance(value, str) else value)
+            elif value is not None:
+                total += 8
+    return total
+
+
+def table_bytes(db, names):
+    dialect = db.engine.dialect.name
+    with db.engine.connect() as conn:
+        if dialect == "sqlite":
+            # Tables with their indexes
+            rows = conn.exec_driver_sql(
+                "SELECT m.tbl_name, SUM(s.pgsize) FROM dbstat s JOIN sqlite_master m ON m.name = s.name "
+                "GROUP BY m.tbl_name"
+            ).all()
+            sizes = dict(rows)
+            return {name: sizes.get(name) for name in names}
+        if dialect == "mysql":
+            rows = conn.exec_driver_sql(
+                "SELECT table_name, data_length + index_length FROM information_schema.tables "
+                "WHERE table_schema = DATABASE()"
+            ).all()
+            sizes = dict(rows)
+            return {name: sizes.get(name) for name in names}
+    return {name: None for name in names}
+
+
+def legacy_table():
+    """hardware_logs as it was before compartment_readings and compressed payloads."""
+    from sqlalchemy import Boolean, Column, DateTime, Float, Integer, MetaData, String, Table, Text
+
+    return Table(
+        "legacy_hardware_logs", MetaData(),
+        Column("id", Integer, primary_key=True),
+        Column("botiquin_id", Integer, index=True),
+        Column("compartment_number", Integer),
+        Column("weight_reading", Float),
+        Column("sensor_type", String(30)),
+        Column("raw_data", Text),
+        Column("processed", Boolean),
+        Column("error_message", Text),
+        Column("occurrences", Integer, nullable=False),
+        Column("created_at", DateTime, nullable=False)
+    )
+
+
+def run(app, args, compartments):
+    from sqlalchemy import event
+    from db import db
+
+    with app.app_context():
+        for table in ("compartment_readings", "hardware_logs"):
+            db.session.execute(db.table(table).delete())
+        db.session.commit()
+        legacy = legacy_table()
+        legacy.drop(db.engine, checkfirst=True)
+        legacy.create(db.engine)
+        engine = db.engine
+
+    inserted = {"hardware_logs": 0, "compartment_readings": 0, "legacy_hardware_logs": 0}
+
+    def count_insert(conn, cursor, statement, parameters, context, executemany):
+        for table in inserted:
+            if statement.startswith(f"INSERT INTO {table} "):
+                inserted[table] += parameter_bytes(parameters)
+
+    reports = [payload(n % args.kits, compartments, n) for n in range(args.payloads)]
+
+    event.listen(engine, "before_cursor_execute", count_insert)
+    try:
+        with app.test_client() as client:
+            for kit in range(args.kits):
+                client.post("/api/hardware/register_hardware", json={
+                    "hardware_id": f"STORE_{kit}", "name": f"Storage kit {kit}", "compartments": compartments
+                })
+            for report in reports:
+                client.post("/api/hardware/sensor_data", json=report)
+
+        # The same reports in the previous layout: payload JSON on its row and
+        # each compartment's JSON again on its own row, all as text
+        with app.app_context():
+            for kit_id, report in enumerate(reports):
+                row = {"botiquin_id": kit_id % args.kits + 1, "sensor_type": "weight", "processed": True,
+                       "error_message": None, "occurrences": 1, "created_at": datetime.utcnow()}
+                rows = [{**row, "compartment_number": comp["compartment"], "weight_reading": comp["weight"],
+                         "raw_data": json.dumps(comp)}
+                        for comp in report["compartments"]]
+                rows.append({**row, "compartment_number": None, "weight_reading": None,
+                             "raw_data": json.dumps(report)})
+                db.session.execute(legacy.insert(), rows)
+            db.session.commit()
+    finally:
+        event.remove(engine, "before_cursor_execute", count_insert)
+
+    with app.app_context():
+        sizes = table_bytes(db, list(inserted))
+        legacy.drop(db.engine)
+    return inserted, sizes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_database_arguments(parser)
+    parser.add_argument("--payloads", type=int, default=2000)
+    parser.add_argument("--kits", type=int, default=20)
+    parser.add_argument("--compartments", type=int, nargs="+", default=[4, 16])
+    args = parser.parse_args()
+
+    print(f"⚡ Hardware log storage: {args.payloads} payloads from {args.kits} kits")
+    print("=" * 60)
+
+    with bench_database(args) as url:
+        app = build_app(url)
+        for compartments in args.compartments:
+            inserted, sizes = run(app, args, compartments)
+            before_insert = inserted["legacy_hardware_logs"]
+            after_insert = inserted["hardware_logs"] + inserted["compartment_readings"]
+            print(f"{compartments:3d} compartments:")
+            print(f"   insert bytes: before {before_insert / args.payloads:8.0f} B/payload  "
+                  f"after {after_insert / args.payloads:8.0f} B/payload  "
+                  f"({before_insert / after_insert:.1f}x less)")
+            if None not in sizes.values():
+                before_size = sizes["legacy_hardware_logs"]
+                after_size = sizes["hardware_logs"] + sizes["compartment_readings"]
+                print(f"   table size:   before {before_size / 1024:8.0f} KiB  "
+                      f"after {after_size / 1024:8.0f} KiB "
+                      f"(hardware_logs {sizes['hardware_logs'] / 1024:.0f}, "
+                      f"compartment_readings {sizes['compartment_readings'] / 1024:.0f})  "
+                      f"({before_size / after_size:.1f}x smaller)")
+        dispose(app)
+
+
+if __name__ == "__main__":
+    main()
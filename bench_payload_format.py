@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark: size and decode cost of JSON vs binary sensor payloads.
+
+Encodes the same kit payload as the JSON the ESP32 firmware sends today and
+as the binary frame from ingestion/codec.py, then times decoding each body
+into the payload dict /api/hardware/sensor_data works on. No database or
+HTTP involved.
+
+    python bench_payload_format.py --compartments 4 16 32
+"""
+
+import argparse
+import json
+import time
+
+
+def payload(compartments):
+    return {
+        "hardware_id": "BOT001",
+        "timestamp": "2025-09-23T10:30:00",
+        "sensor_type": "weight",
+        "compartments": [
+            {"compartment": c, "weight": round(100.0 - c * 1.37, 2), "unit": "grams"}
+            for c in range(1, compartments + 1)
+        ]
+    }
+
+
+def per_call_us(fn, body, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        fn(body)
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--compartments", type=int, nargs="+", default=[4, 16, 32])
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    from ingestion.codec import decode_sensor_frame, encode_sensor_frame
+
+    print(f"⚡ JSON vs binary sensor payloads ({args.iterations} decodes each)")
+    print("=" * 60)
+
+    for compartments in args.compartments:
+        data = payload(compartments)
+        json_body = json.dumps(data).encode("utf-8")
+        binary_body = encode_sensor_frame(data)
+        assert decode_sensor_frame(binary_body) == data
+
+        json_us = per_call_us(json.loads, json_body, args.iterations)
+        binary_us = per_call_us(decode_sensor_frame, binary_body, args.iterations)
+
+        print(f"{compartments:3d} compartments: "
+              f"json {len(json_body):5d} B {json_us:7.2f}us  "
+              f"binary {len(binary_body):4d} B {binary_us:7.2f}us  "
+              f"({len(json_body) / len(binary_body):.1f}x smaller)")
+
+
+if __name__ == "__main__":
+    main()
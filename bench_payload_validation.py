@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark: parse + validate cost per sensor_data payload.
+
+"before" replays what the handler used to do by hand: json.loads, the
+required-field check, the unit_payload float() try/except and the
+per-compartment .get()/int() normalization. "after" is the precompiled
+msgspec decoder from ingestion/schema.py, which does all of it in one pass
+from the request bytes. No database or HTTP involved.
+
+    python bench_payload_validation.py --compartments 4 16 32
+"""
+
+import argparse
+import json
+import time
+
+
+def payload(compartments):
+    return {
+        "hardware_id": "BOT001",
+        "timestamp": "2025-09-23T10:30:00",
+        "sensor_type": "weight",
+        "unit_payload": {"average_weight": 0.5},
+        "compartments": [
+            {"compartment": c, "weight": round(100.0 - c * 1.37, 2), "unit": "grams"}
+            for c in range(1, compartments + 1)
+        ]
+    }
+
+
+def hand_validated(body):
+    data = json.loads(body)
+    missing = [f for f in ["hardware_id", "compartments"] if f not in data]
+    if missing:
+        raise ValueError(missing)
+
+    payload_section = data.get("unit_payload", {})
+    average_weight = payload_section.get("average_weight", payload_section.get("unit_weight"))
+    if average_weight is not None:
+        try:
+            average_weight = float(average_weight)
+        except (TypeError, ValueError):
+            average_weight = None
+
+    readings = []
+    for comp in data["compartments"]:
+        number = comp.get("compartment")
+        weight = comp.get("weight")
+        comp.get("medicine_name")
+        comp.get("average_weight", comp.get("unit_weight"))
+        if number is None or weight is None or isinstance(number, bool):
+            continue
+        try:
+            readings.append((int(number), float(weight)))
+        except (TypeError, ValueError):
+            continue
+    return data, readings
+
+
+def per_call_us(fn, body, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        fn(body)
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--compartments", type=int, nargs="+", default=[4, 16, 32])
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    from ingestion.schema import decode_sensor_payload
+
+    print(f"⚡ Sensor payload parse + validate ({args.iterations} payloads each)")
+    print("=" * 60)
+
+    for compartments in args.compartments:
+        body = json.dumps(payload(compartments)).encode("utf-8")
+        before = per_call_us(hand_validated, body, args.iterations)
+        after = per_call_us(decode_sensor_payload, body, args.iterations)
+        print(f"{compartments:3d} compartments: before {before:7.2f}us  after {after:7.2f}us  "
+              f"({before / after:.1f}x faster)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Shared setup of the benchmark scripts (bench_*.py): a scratch database and
+an app bound to it.
+
+Benchmarks drop and recreate every table, so they only run against a
+temporary SQLite database unless --yes-drop confirms that the given
+--database-url may be wiped.
+"""
+
+import os
+import tempfile
+from contextlib import contextmanager
+
+from sqlalchemy.engine import make_url
+
+
+def add_database_arguments(parser):
+    parser.add_argument("--database-url", help="Defaults to a temporary SQLite file per run")
+    parser.add_argument("--yes-drop", action="store_true",
+                        help="Allow dropping every table of a --database-url that is not a temporary SQLite file")
+
+
+def scratch_database(database_url) -> bool:
+    """Whether a URL is an in-memory SQLite database or a SQLite file in the temp directory."""
+    url = make_url(database_url)
+    if url.get_backend_name() != "sqlite":
+        return False
+    if not url.database or url.database == ":memory:":
+        return True
+    temp = os.path.realpath(tempfile.gettempdir())
+    return os.path.realpath(url.database).startswith(temp + os.sep)
+
+
+@contextmanager
+def bench_database(args):
+    """The database URL of one run: --database-url, or a temporary SQLite file removed afterwards."""
+    with tempfile.TemporaryDirectory() as tmp:
+        url = args.database_url or f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        if not args.yes_drop and not scratch_database(url):
+            raise SystemExit(
+                f"Refusing to drop every table of {make_url(url).render_as_string()}: "
+                "pass --yes-drop if it is a scratch database"
+            )
+        yield url
+
+
+def build_app(database_url, **environ):
+    """App bound to `database_url` with all tables dropped and recreated; `environ` sets config variables first."""
+    os.environ["DATABASE_URL"] = database_url
+    os.environ.update((name, str(value)) for name, value in environ.items())
+    from app import create_app
+    from db import db
+
+    app = create_app()
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+    return app
+
+
+def dispose(app):
+    """Close the app's connections (before its temporary database is removed)."""
+    from db import db
+
+    with app.app_context():
+        db.engine.dispose()
@@ -8,6 +8,8 @@ Database bootstrap for the MVP.
 import os
 from dotenv import load_dotenv
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 
 # Load variables from a local .env when running outside Docker
 load_dotenv()
@@ -46,4 +48,23 @@ def init_db(app) -> None:
         "pool_recycle": 280,     # Recycle connections regularly (in seconds)
     })
 
-    db.init_app(app)
\ No newline at end of file
+    db.init_app(app)
+
+# SQLite files (development): pysqlite only opens a transaction before DML,
+# so a SAVEPOINT issued first opens one itself and releasing it commits.
+# Let SQLAlchemy emit BEGIN so per-kit savepoints nest like on MySQL;
+# IMMEDIATE so concurrent writers wait for the lock (busy timeout) instead
+# of failing to upgrade it. Not for in-memory databases, whose one
+# connection is shared by every thread.
+@event.listens_for(Engine, "connect")
+def _sqlite_connect(dbapi_connection, connection_record):
+    if type(dbapi_connection).__module__.startswith("sqlite3"):
+        file = dbapi_connection.execute("PRAGMA database_list").fetchone()[2]
+        if file:
+            dbapi_connection.isolation_level = None
+
+
+@event.listens_for(Engine, "begin")
+def _sqlite_begin(conn):
+    if conn.dialect.name == "sqlite" and conn.connection.driver_connection.isolation_level is None:
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
@@ -0,0 +1,5 @@
+# backend/ingestion/__init__.py
+"""
+Hardware ingestion pipeline: payload processing and background writers
+used by the /api/hardware routes.
+"""
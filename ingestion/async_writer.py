@@ -0,0 +1,259 @@
+"""
+Asynchronous ingestion for /api/hardware/sensor_data.
+
+- The endpoint validates a payload, puts it on a bounded in-process queue
+  and answers 202 Accepted with a receipt id
+- A background writer thread drains the queue and applies payloads in
+  batches (one transaction per batch, see pipeline.apply_sensor_batch)
+- Receipts and queue metrics live in the worker process that accepted the
+  payload; with several gunicorn workers a receipt is only visible there
+"""
+
+import atexit
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+
+from db import db
+from ingestion.pipeline import apply_sensor_alone, apply_sensor_batch, counter_undo
+
+EXTENSION_KEY = "hardware_ingest_writer"
+
+_writer_lock = threading.Lock()
+
+
+class AsyncIngestWriter:
+    """
+    Bounded queue plus a single background thread that commits payloads in batches.
+    """
+
+    def __init__(self, app, max_queue_size=1000, batch_size=100, flush_interval=0.05,
+                 max_receipts=10000):
+        self.app = app
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval = max(0.0, float(flush_interval))
+        self.max_receipts = max_receipts
+
+        self._queue = queue.Queue(maxsize=max(1, int(max_queue_size)))
+        self._receipts = OrderedDict()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._stopping = threading.Event()
+
+        # Metrics
+        self._enqueued = 0
+        self._rejected = 0
+        self._processed = 0
+        self._failed = 0
+        self._batches = 0
+        self._fallbacks = 0
+        self._last_batch_size = 0
+        self._total_batch_items = 0
+        self._last_flush_ms = None
+        self._total_flush_ms = 0.0
+        self._max_flush_ms = 0.0
+
+    # --- Producer side ---
+
+    def submit(self, payload, receipt=True):
+        """
+        Enqueue a validated SensorPayload and return its receipt id (None
+        with receipt=False, for senders that never look the outcome up).
+        Raises queue.Full when the queue is at capacity.
+        """
+        self._ensure_running()
+        if not receipt:
+            with self._lock:
+                try:
+                    self._queue.put_nowait((None, payload))
+                except queue.Full:
+                    self._rejected += 1
+                    raise
+                self._enqueued += 1
+            return None
+
+        receipt_id = uuid.uuid4().hex
+        receipt = {
+            "receipt_id": receipt_id,
+            "hardware_id": payload.hardware_id,
+            "status": "queued",
+            "queued_at": datetime.utcnow().isoformat(),
+            "processed_at": None
+        }
+        with self._lock:
+            try:
+                self._queue.put_nowait((receipt_id, payload))
+            except queue.Full:
+                self._rejected += 1
+                raise
+            self._enqueued += 1
+            self._remember(receipt_id, receipt)
+        return receipt_id
+
+    def receipt(self, receipt_id):
+        """Return a copy of the receipt, or None if unknown/expired."""
+        with self._lock:
+            receipt = self._receipts.get(receipt_id)
+            return dict(receipt) if receipt else None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "running": self._thread is not None and self._thread.is_alive(),
+                "queue_depth": self._queue.qsize(),
+                "queue_capacity": self._queue.maxsize,
+                "batch_size": self.batch_size,
+                "flush_interval_ms": self.flush_interval * 1000,
+                "enqueued": self._enqueued,
+                "rejected": self._rejected,
+                "processed": self._processed,
+                "failed": self._failed,
+                "batches": self._batches,
+                "fallbacks": self._fallbacks,
+                "last_batch_size": self._last_batch_size,
+                "avg_batch_size": (self._total_batch_items / self._batches) if self._batches else None,
+                "last_flush_ms": self._last_flush_ms,
+                "avg_flush_ms": (self._total_flush_ms / self._batches) if self._batches else None,
+                "max_flush_ms": self._max_flush_ms
+            }
+
+    def drain(self, timeout=5.0) -> bool:
+        """Block until every queued payload has been written. Returns False on timeout."""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def stop(self, timeout=5.0):
+        """Flush what is queued and stop the writer thread."""
+        self.drain(timeout)
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    # --- Writer side ---
+
+    def _ensure_running(self):
+        # Threads do not survive fork(); restart lazily in each gunicorn worker
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._stopping.clear()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(
+                target=self._run, name="hardware-ingest-writer", daemon=True
+            )
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                first = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+
+            # Collect more payloads until the batch is full or the flush window closes
+            batch = [first]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    if remaining > 0:
+                        batch.append(self._queue.get(timeout=remaining))
+                    else:
+                        batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            try:
+                self._flush(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _flush(self, batch):
+        started = time.perf_counter()
+        fallback = False
+        with self.app.app_context(), counter_undo() as undo:
+            try:
+                # Nobody reads the full response of payloads without a receipt
+                kit_results = apply_sensor_batch(
+                    [payload for _, payload in batch],
+                    [receipt_id is None for receipt_id, _ in batch]
+                )
+            except Exception:
+                # Every payload was already answered 202: retry each in its own
+                # transaction so one bad payload does not lose the batch
+                db.session.rollback()
+                undo.restore()
+                fallback = True
+                kit_results = [
+                    apply_sensor_alone(payload, receipt_id is None) for receipt_id, payload in batch
+                ]
+            finally:
+                db.session.remove()
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+        processed_at = datetime.utcnow().isoformat()
+        with self._lock:
+            for (receipt_id, _), kit_result in zip(batch, kit_results):
+                ok = kit_result.get("status_code") == 200
+                if ok:
+                    self._processed += 1
+                else:
+                    self._failed += 1
+                receipt = self._receipts.get(receipt_id)
+                if receipt is None:
+                    continue
+                receipt.update({
+                    "status": "processed" if ok else "failed",
+                    "status_code": kit_result.get("status_code"),
+                    "processed_at": processed_at,
+                    "error": kit_result.get("error"),
+                    "code": kit_result.get("code"),
+                    "errors": kit_result.get("errors"),
+                    "alerts": kit_result.get("alerts")
+                })
+
+            self._batches += 1
+            self._fallbacks += int(fallback)
+            self._last_batch_size = len(batch)
+            self._total_batch_items += len(batch)
+            self._last_flush_ms = elapsed_ms
+            self._total_flush_ms += elapsed_ms
+            self._max_flush_ms = max(self._max_flush_ms, elapsed_ms)
+
+    def _remember(self, receipt_id, receipt):
+        self._receipts[receipt_id] = receipt
+        while len(self._receipts) > self.max_receipts:
+            self._receipts.popitem(last=False)
+
+
+def get_writer(app) -> AsyncIngestWriter:
+    """Return the app's writer, creating it from app.config on first use."""
+    writer = app.extensions.get(EXTENSION_KEY)
+    if writer is not None:
+        return writer
+    with _writer_lock:
+        writer = app.extensions.get(EXTENSION_KEY)
+        if writer is not None:
+            return writer
+        writer = AsyncIngestWriter(
+            app,
+            max_queue_size=app.config.get("HARDWARE_INGEST_QUEUE_SIZE", 1000),
+            batch_size=app.config.get("HARDWARE_INGEST_BATCH_SIZE", 100),
+            flush_interval=app.config.get("HARDWARE_INGEST_FLUSH_INTERVAL", 0.05)
+        )
+        app.extensions[EXTENSION_KEY] = writer
+        # Do not drop accepted readings on a clean shutdown
+        atexit.register(writer.stop)
+    return writer
@@ -0,0 +1,130 @@
+"""
+Backfill of readings a kit buffered while it was offline.
+
+A kit that loses Wi-Fi keeps measuring and, once reconnected, uploads the
+buffered reports in one /api/hardware/backfill request instead of
+replaying them through sensor_data (which stamps everything with the
+server clock). Every reading keeps the kit's own timestamp:
+
+- history: each compartment reading becomes a compartment_readings row
+  stamped with the device timestamp, inserted in time order with one
+  multi-row INSERT (readings that cannot be applied go to hardware_logs)
+- current state: each compartment's Medicine row is written once, from its
+  newest reading, and only if that reading is newer than the row's
+  last_scan_at; older (out-of-order) readings are kept as history only
+"""
+
+from datetime import datetime, timedelta, timezone
+from models.models import stock_status
+from ingestion.pipeline import (
+    compartment_row,
+    hardware_log_row,
+    load_compartment_medicines,
+    mark_synced,
+    reading_range_error,
+    reading_row,
+    upsert_compartments,
+)
+
+# Readings stamped further ahead of the server clock are rejected
+MAX_CLOCK_SKEW = timedelta(minutes=5)
+
+
+def reading_time(timestamp):
+    """Device timestamp as naive UTC, the way every DateTime column is stored."""
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return timestamp
+
+
+def apply_backfill(data, botiquin, logs, history):
+    """
+    Apply a BackfillPayload for a resolved kit.
+
+    compartment_readings rows are appended to `history` in time order and
+    readings that cannot be applied to `logs`; the caller writes both. Returns (summary, errors) where summary is
+    {"readings", "from", "to", "updated": [...], "skipped": [...]}.
+    """
+    now = datetime.utcnow()
+    # Stable sort: readings with the same timestamp keep their request order
+    readings = sorted(((reading_time(r.timestamp), r) for r in data.readings), key=lambda item: item[0])
+
+    errors = []
+    applied = []
+    newest = {}        # compartment -> (timestamp, weight) of its newest reading
+    first_weight = {}  # compartment -> weight of its oldest reading
+    names = {}         # compartment -> latest medicine_name sent
+    for timestamp, reading in readings:
+        if timestamp > now + MAX_CLOCK_SKEW:
+            errors.append({"timestamp": timestamp.isoformat(), "error": "Timestamp is in the future"})
+            continue
+        applied.append(timestamp)
+        sensor_type = reading.sensor_type or data.sensor_type or "unknown"
+
+        for comp in reading.compartments:
+            if comp.compartment is None or comp.weight is None:
+                error = "Missing compartment or weight data"
+            else:
+                error = reading_range_error(comp.compartment, comp.weight)
+            if error:
+                logs.append(hardware_log_row(
+                    botiquin_id=botiquin.id,
+                    compartment_number=comp.compartment,
+                    weight_reading=comp.weight,
+                    sensor_type=sensor_type,
+                    error_message=error,
+                    created_at=timestamp
+                ))
+                errors.append({"compartment": comp.compartment, "timestamp": timestamp.isoformat(), "error": error})
+                continue
+
+            history.append(reading_row(botiquin.id, comp.compartment, comp.weight, timestamp))
+            first_weight.setdefault(comp.compartment, comp.weight)
+            newest[comp.compartment] = (timestamp, comp.weight)
+            if comp.medicine_name:
+                names[comp.compartment] = comp.medicine_name
+
+    # Current state: one write per compartment, from its newest reading
+    medicines = load_compartment_medicines([botiquin.id], set(newest))
+    writes = []
+    updated = []
+    skipped = []
+    for number, (timestamp, weight) in sorted(newest.items()):
+        medicine = medicines.get((botiquin.id, number))
+        if medicine is not None and medicine.last_scan_at is not None and timestamp <= medicine.last_scan_at:
+            skipped.append({
+                "compartment": number,
+                "timestamp": timestamp.isoformat(),
+                "last_scan_at": medicine.last_scan_at.isoformat(),
+                "reason": "Older than the compartment's current reading"
+            })
+            continue
+
+        # As with live reports, the first reading sets the initial weight
+        initial_weight = first_weight[number]
+        if medicine is not None and medicine.initial_weight is not None:
+            initial_weight = medicine.initial_weight
+        row = compartment_row(botiquin.id, number, names.get(number), initial_weight, weight, now)
+        row["last_scan_at"] = timestamp
+        writes.append(row)
+
+        updated.append({
+            "compartment": number,
+            "medicine": names.get(number) or (medicine.medicine_name if medicine else None) or "No asignado",
+            "old_weight": medicine.current_weight if medicine else None,
+            "new_weight": weight,
+            "status": stock_status(weight, initial_weight, medicine.expiry_date if medicine else None),
+            "timestamp": timestamp.isoformat()
+        })
+
+    upsert_compartments(writes)
+    mark_synced(botiquin, now)
+
+    summary = {
+        "readings": len(applied),
+        "from": applied[0].isoformat() if applied else None,
+        "to": applied[-1].isoformat() if applied else None,
+        "updated": updated,
+        "skipped": skipped
+    }
+    return summary, errors
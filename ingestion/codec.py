@@ -0,0 +1,252 @@
+"""
+Request body decoding for the hardware endpoints.
+
+- inflate(): streaming gzip/deflate decompression of request bodies with a
+  hard cap on the decompressed size (Content-Encoding on /api/hardware/*)
+- decode_sensor_frame(): the compact binary sensor_data payload
+- decode_sensor_line(): one reading of the line protocol spoken by the
+  standalone TCP/UDP listener (ingestion/line_listener.py)
+
+Binary sensor_data frames: kits send them with `Content-Type: application/vnd.vitalstock.sensor`
+instead of JSON. It is a fixed little-endian struct layout (what the ESP32
+firmware can fill straight from a C struct), decoded into the same dict
+the JSON path produces, so everything after decoding is shared:
+
+    offset  type         field
+    0       uint8        version (1)
+    1       uint8        flags (bit 0: unit_payload.average_weight present,
+                         bit 1: seq present, bit 2: base_seq present,
+                         bit 3: boot_id present)
+    2       uint8        sensor type (0 unknown, 1 weight, 2 door, 3 infrared)
+    3       uint8        hardware_id length N
+    4       N bytes      hardware_id (UTF-8)
+    4+N     uint32       timestamp, unix seconds UTC (0 = not sent)
+    ...     uint32       seq (only with flag bit 1)
+    ...     uint32       base_seq, delta payloads (only with flag bit 2)
+    ...     uint32       boot_id, changes when seq restarts (only with flag bit 3)
+    ...     int32        average_weight in milligrams (only with flag bit 0)
+    ...     uint8        compartment count C
+    ...     C x (uint8 compartment, int32 weight in milligrams)
+
+Weights travel as integer milligrams so they decode to the same decimal
+grams the firmware measured (no float32 rounding).
+"""
+
+import math
+import struct
+import zlib
+from datetime import datetime, timezone
+
+BINARY_CONTENT_TYPE = "application/vnd.vitalstock.sensor"
+
+FORMAT_VERSION = 1
+FLAG_AVERAGE_WEIGHT = 0x01
+FLAG_SEQ = 0x02
+FLAG_BASE_SEQ = 0x04
+FLAG_BOOT_ID = 0x08
+SENSOR_TYPES = ("unknown", "weight", "door", "infrared")
+
+_HEADER = struct.Struct("<BBBB")
+_TIMESTAMP = struct.Struct("<I")
+_SEQ = struct.Struct("<I")
+_MILLIGRAMS = struct.Struct("<i")
+_COUNT = struct.Struct("<B")
+_COMPARTMENT = struct.Struct("<Bi")
+
+# uint32 fields after the timestamp, in frame order
+_SEQUENCE_FIELDS = ((FLAG_SEQ, "seq"), (FLAG_BASE_SEQ, "base_seq"), (FLAG_BOOT_ID, "boot_id"))
+
+
+# zlib wbits per Content-Encoding; "deflate" is zlib-wrapped per RFC 9110
+# but some clients send a raw stream, see inflate()
+CONTENT_ENCODINGS = {
+    "gzip": 16 + zlib.MAX_WBITS,
+    "x-gzip": 16 + zlib.MAX_WBITS,
+    "deflate": zlib.MAX_WBITS
+}
+
+_INFLATE_CHUNK = 64 * 1024
+
+
+class PayloadDecodeError(ValueError):
+    """The body is not a valid binary sensor frame, protocol line or compressed stream."""
+
+
+class PayloadTooLargeError(PayloadDecodeError):
+    """The body decompresses to more than the allowed size."""
+
+
+def inflate(stream, encoding, limit) -> bytes:
+    """
+    Decompress a gzip/deflate body read from a file-like stream in chunks.
+    Never inflates more than `limit` bytes, so a small zip bomb cannot
+    exhaust memory: raises PayloadTooLargeError as soon as the output
+    would exceed it, PayloadDecodeError for corrupt or truncated input.
+    """
+    wbits = CONTENT_ENCODINGS[encoding]
+    inflater = None
+    out = bytearray()
+    while True:
+        chunk = stream.read(_INFLATE_CHUNK)
+        if not chunk:
+            break
+        if inflater is None:
+            zlib_header = len(chunk) >= 2 and chunk[0] & 0x0F == 8 and (chunk[0] * 256 + chunk[1]) % 31 == 0
+            if wbits == zlib.MAX_WBITS and not zlib_header:
+                wbits = -zlib.MAX_WBITS  # No zlib header: raw deflate
+            inflater = zlib.decompressobj(wbits)
+        data = chunk
+        try:
+            while data and not inflater.eof:
+                out += inflater.decompress(data, limit + 1 - len(out))
+                if len(out) > limit:
+                    raise PayloadTooLargeError(f"Decompressed body exceeds {limit} bytes")
+                data = inflater.unconsumed_tail
+        except zlib.error as e:
+            raise PayloadDecodeError(f"Invalid {encoding} body: {e}") from None
+        if inflater.eof:
+            break
+    if inflater is None or not inflater.eof:
+        raise PayloadDecodeError(f"Truncated {encoding} body")
+    return bytes(out)
+
+
+def decode_sensor_frame(body: bytes) -> dict:
+    """
+    Decode a binary frame into a sensor_data payload dict:
+    {"hardware_id", "sensor_type", "compartments": [{"compartment", "weight", "unit"}],
+     plus "timestamp", "unit_payload", "seq", "base_seq" and "boot_id"
+     when the frame carries them}.
+    Raises PayloadDecodeError on malformed input.
+    """
+    view = memoryview(body)
+    try:
+        version, flags, sensor_code, id_length = _HEADER.unpack_from(view, 0)
+        if version != FORMAT_VERSION:
+            raise PayloadDecodeError(f"Unsupported frame version {version}")
+        offset = _HEADER.size
+
+        hardware_id = bytes(view[offset:offset + id_length]).decode("utf-8")
+        if len(hardware_id.encode("utf-8")) != id_length or not hardware_id:
+            raise PayloadDecodeError("Truncated or empty hardware_id")
+        offset += id_length
+
+        (timestamp,) = _TIMESTAMP.unpack_from(view, offset)
+        offset += _TIMESTAMP.size
+
+        sequence = {}
+        for flag, name in _SEQUENCE_FIELDS:
+            if flags & flag:
+                (sequence[name],) = _SEQ.unpack_from(view, offset)
+                offset += _SEQ.size
+
+        average_weight = None
+        if flags & FLAG_AVERAGE_WEIGHT:
+            (average_weight,) = _MILLIGRAMS.unpack_from(view, offset)
+            offset += _MILLIGRAMS.size
+
+        (count,) = _COUNT.unpack_from(view, offset)
+        offset += _COUNT.size
+        if len(view) != offset + count * _COMPARTMENT.size:
+            raise PayloadDecodeError(
+                f"Expected {count} compartments ({offset + count * _COMPARTMENT.size} bytes), got {len(view)} bytes"
+            )
+        compartments = [
+            {"compartment": number, "weight": milligrams / 1000, "unit": "grams"}
+            for number, milligrams in _COMPARTMENT.iter_unpack(view[offset:])
+        ]
+    except (struct.error, UnicodeDecodeError) as e:
+        raise PayloadDecodeError(f"Malformed frame: {e}") from None
+
+    data = {
+        "hardware_id": hardware_id,
+        "sensor_type": SENSOR_TYPES[sensor_code] if sensor_code < len(SENSOR_TYPES) else "unknown",
+        "compartments": compartments
+    }
+    if timestamp:
+        data["timestamp"] = datetime.fromtimestamp(timestamp, timezone.utc).replace(tzinfo=None).isoformat()
+    if average_weight is not None:
+        data["unit_payload"] = {"average_weight": average_weight / 1000}
+    data.update(sequence)
+    return data
+
+
+def encode_sensor_frame(data: dict) -> bytes:
+    """
+    Encode a sensor_data payload dict as a binary frame (reference for the
+    firmware, tests and benchmarks). Per-compartment medicine names and
+    average weights have no place in the frame and are dropped.
+    """
+    hardware_id = data["hardware_id"].encode("utf-8")
+    sensor_type = data.get("sensor_type", "unknown")
+    sensor_code = SENSOR_TYPES.index(sensor_type) if sensor_type in SENSOR_TYPES else 0
+
+    timestamp = 0
+    if data.get("timestamp"):
+        timestamp = int(datetime.fromisoformat(data["timestamp"]).replace(tzinfo=timezone.utc).timestamp())
+
+    average_weight = (data.get("unit_payload") or {}).get("average_weight")
+    flags = FLAG_AVERAGE_WEIGHT if average_weight is not None else 0
+    sequence = []
+    for flag, name in _SEQUENCE_FIELDS:
+        if data.get(name) is not None:
+            flags |= flag
+            sequence.append(_SEQ.pack(data[name]))
+
+    parts = [
+        _HEADER.pack(FORMAT_VERSION, flags, sensor_code, len(hardware_id)),
+        hardware_id,
+        _TIMESTAMP.pack(timestamp),
+        *sequence
+    ]
+    if average_weight is not None:
+        parts.append(_MILLIGRAMS.pack(round(average_weight * 1000)))
+    parts.append(_COUNT.pack(len(data["compartments"])))
+    parts.extend(
+        _COMPARTMENT.pack(int(comp["compartment"]), round(float(comp["weight"]) * 1000))
+        for comp in data["compartments"]
+    )
+    return b"".join(parts)
+
+
+def decode_sensor_line(line) -> dict:
+    """
+    Decode one line-protocol reading (bytes or str) into a sensor_data
+    payload dict:
+
+        <hardware_id> <compartment>=<grams>[,<compartment>=<grams>...] [<unix seconds>]
+        BOT001 1=45.5,2=30.2,3=0 1758623400
+
+    The timestamp is optional (0 = not sent). Raises PayloadDecodeError on
+    malformed input.
+    """
+    if isinstance(line, (bytes, bytearray)):
+        try:
+            line = line.decode("utf-8")
+        except UnicodeDecodeError as e:
+            raise PayloadDecodeError(f"Malformed line: {e}") from None
+
+    fields = line.split()
+    if len(fields) not in (2, 3):
+        raise PayloadDecodeError("Expected `<hardware_id> <compartment>=<weight>,... [<timestamp>]`")
+
+    compartments = []
+    for reading in fields[1].split(","):
+        number, _, weight = reading.partition("=")
+        try:
+            compartment = {"compartment": int(number), "weight": float(weight), "unit": "grams"}
+        except ValueError:
+            raise PayloadDecodeError(f"Invalid reading `{reading}`") from None
+        if not math.isfinite(compartment["weight"]):
+            raise PayloadDecodeError(f"Invalid reading `{reading}`")
+        compartments.append(compartment)
+
+    data = {"hardware_id": fields[0], "sensor_type": "weight", "compartments": compartments}
+    if len(fields) == 3:
+        try:
+            timestamp = int(fields[2])
+            if timestamp:
+                data["timestamp"] = datetime.fromtimestamp(timestamp, timezone.utc).replace(tzinfo=None).isoformat()
+        except (ValueError, OverflowError, OSError):
+            raise PayloadDecodeError(f"Invalid timestamp `{fields[2]}`") from None
+    return data
@@ -0,0 +1,238 @@
+"""
+ASGI ingestion gateway for hardware traffic.
+
+    uvicorn --factory ingestion.gateway:create_gateway --host 0.0.0.0 --port 8000
+
+Gunicorn sync workers hold one thread per connection for as long as a kit
+takes to send its request, so a few ESP32s on weak Wi-Fi can tie up every
+worker. The gateway is a separate process that only serves the device
+endpoints:
+
+    POST /api/hardware/sensor_data
+    POST /api/hardware/test_connection
+    POST /api/hardware/register_hardware
+    GET  /health  (gateway metrics)
+
+Connections and request bodies are handled on the asyncio event loop, so
+a slow kit costs a coroutine and a buffer, not a thread. Once a body is
+complete the request runs through the regular Flask views (same
+contracts, models, decoding and ingestion options as the main app) on a
+small thread pool of HARDWARE_GATEWAY_THREADS threads, which bounds the
+database connections the gateway uses. Requests waiting for a thread are
+capped at HARDWARE_GATEWAY_MAX_PENDING; beyond that the gateway answers
+503 with Retry-After instead of queueing without limit.
+
+The Flask app keeps serving the admin API and the SPA.
+"""
+
+import asyncio
+import json
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+# Paths served by the gateway; everything else is the main app's job
+GATEWAY_ROUTES = {
+    ("POST", "/api/hardware/sensor_data"),
+    ("POST", "/api/hardware/test_connection"),
+    ("POST", "/api/hardware/register_hardware"),
+}
+
+
+class _ClientDisconnected(Exception):
+    pass
+
+
+class IngestionGateway:
+    """ASGI application running the hardware routes of a Flask app on a bounded thread pool."""
+
+    def __init__(self, flask_app, threads=4, max_pending=1000, body_timeout=30.0, max_body_bytes=2 * 1024 * 1024):
+        self.flask_app = flask_app
+        self.threads = max(1, int(threads))
+        self.max_pending = max(0, int(max_pending))
+        self.body_timeout = body_timeout
+        self.max_body_bytes = max_body_bytes
+        self._executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="hardware-gateway")
+        self._lock = threading.Lock()
+
+        # Metrics
+        self.connections = 0
+        self.pending = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self._http(scope, receive, send)
+
+    # --- HTTP ---
+
+    async def _http(self, scope, receive, send):
+        method, path = scope["method"], scope["path"]
+        if method == "GET" and path == "/health":
+            return await _respond(send, 200, {"status": "ok", **self.stats()})
+        if (method, path) not in GATEWAY_ROUTES:
+            return await _respond(send, 404, {"error": f"{method} {path} is not served by the ingestion gateway"})
+
+        self.connections += 1
+        try:
+            try:
+                body = await asyncio.wait_for(self._read_body(scope, receive), self.body_timeout)
+            except asyncio.TimeoutError:
+                self.timed_out += 1
+                return await _respond(send, 408, {"error": "Request body not received in time"})
+            except _ClientDisconnected:
+                return
+            if body is None:
+                return await _respond(send, 413, {"error": f"Request body exceeds {self.max_body_bytes} bytes"})
+
+            if self.pending >= self.max_pending + self.threads:
+                self.rejected += 1
+                return await _respond(send, 503, {"error": "Ingestion gateway is busy, retry later"},
+                                      [(b"retry-after", b"1")])
+
+            self.pending += 1
+            try:
+                loop = asyncio.get_running_loop()
+                status, headers, content = await loop.run_in_executor(
+                    self._executor, self._call_flask, _wsgi_environ(scope, body)
+                )
+            finally:
+                self.pending -= 1
+            self.completed += 1
+            await send({"type": "http.response.start", "status": status, "headers": headers})
+            await send({"type": "http.response.body", "body": content})
+        finally:
+            self.connections -= 1
+
+    async def _read_body(self, scope, receive):
+        """The whole request body, or None when it exceeds max_body_bytes."""
+        for name, value in scope["headers"]:
+            if name == b"content-length" and value.isdigit() and int(value) > self.max_body_bytes:
+                return None
+        body = bytearray()
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                raise _ClientDisconnected()
+            body += message.get("body", b"")
+            if len(body) > self.max_body_bytes:
+                return None
+            if not message.get("more_body"):
+                return bytes(body)
+
+    def _call_flask(self, environ):
+        """Run one request through the Flask app (on a pool thread)."""
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            response = {}
+
+            def start_response(status, headers, exc_info=None):
+                response["status"] = int(status.split(" ", 1)[0])
+                response["headers"] = [
+                    (name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers
+                ]
+                return lambda data: None
+
+            result = self.flask_app(environ, start_response)
+            try:
+                content = b"".join(result)
+            finally:
+                if hasattr(result, "close"):
+                    result.close()
+            return response["status"], response["headers"], content
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    # --- Lifespan ---
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                # Let requests that already have a thread finish their commit
+                await asyncio.get_running_loop().run_in_executor(None, self._executor.shutdown)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    def stats(self) -> dict:
+        return {
+            "threads": self.threads,
+            "max_pending": self.max_pending,
+            "connections": self.connections,
+            "pending": self.pending,
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out
+        }
+
+
+def _wsgi_environ(scope, body):
+    """WSGI environ for an ASGI HTTP scope whose body has been read completely."""
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", ""),
+        "PATH_INFO": scope["path"],
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0],
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False
+    }
+    for name, value in scope["headers"]:
+        key = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        # The body is complete and de-chunked: its length is known
+        if key in ("CONTENT_LENGTH", "TRANSFER_ENCODING"):
+            continue
+        if key != "CONTENT_TYPE":
+            key = f"HTTP_{key}"
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+async def _respond(send, status, body, headers=()):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), *headers]
+    })
+    await send({"type": "http.response.body", "body": json.dumps(body).encode("utf-8")})
+
+
+def create_gateway(flask_app=None) -> IngestionGateway:
+    """Build the gateway around a Flask app (a new one from create_app() by default)."""
+    if flask_app is None:
+        from app import create_app
+        flask_app = create_app()
+    config = flask_app.config
+    return IngestionGateway(
+        flask_app,
+        threads=config.get("HARDWARE_GATEWAY_THREADS", 4),
+        max_pending=config.get("HARDWARE_GATEWAY_MAX_PENDING", 1000),
+        body_timeout=config.get("HARDWARE_GATEWAY_BODY_TIMEOUT", 30.0),
+        max_body_bytes=config.get("HARDWARE_MAX_DECOMPRESSED_BYTES", 2 * 1024 * 1024)
+    )
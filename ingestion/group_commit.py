@@ -0,0 +1,147 @@
+"""
+Leader/follower group commit for /api/hardware/sensor_data.
+
+Concurrent ingestion requests in the same worker that arrive within a short
+window are applied in one transaction and one COMMIT (one fsync on MySQL):
+
+- The first request to arrive becomes the leader of a new group
+- Requests arriving while the group is open join it as followers and wait
+- After the window (or when the group is full) the leader applies every
+  payload with pipeline.apply_sensor_batch and hands each follower its result
+
+Each kit still runs in its own SAVEPOINT, and if the shared commit fails the
+leader retries every payload in its own transaction, so one bad kit never
+fails another; the in-memory counters the failed attempt moved (dead-band
+samples, unknown-device folding) are reverted first (pipeline.counter_undo).
+
+Only useful with threaded workers (gunicorn --threads).
+"""
+
+import threading
+
+from db import db
+from ingestion.pipeline import apply_sensor_alone, apply_sensor_batch, counter_undo
+
+EXTENSION_KEY = "hardware_group_commit"
+
+_coordinator_lock = threading.Lock()
+
+
+class _Group:
+    def __init__(self):
+        self.payloads = []
+        self.acks = []
+        self.results = None
+        self.full = threading.Event()
+        self.done = threading.Event()
+
+
+class GroupCommitCoordinator:
+    """
+    Collects concurrent payloads into groups that share a single transaction.
+    """
+
+    def __init__(self, window=0.005, max_group_size=50, wait_timeout=30.0):
+        self.window = max(0.0, float(window))
+        self.max_group_size = max(1, int(max_group_size))
+        self.wait_timeout = wait_timeout
+
+        self._lock = threading.Lock()
+        self._open = None
+
+        # Metrics
+        self._groups = 0
+        self._payloads = 0
+        self._commits = 0
+        self._fallbacks = 0
+        self._largest_group = 0
+
+    def submit(self, payload, ack=False) -> dict:
+        """
+        Apply a payload as part of a group and block until its group committed.
+        Returns the per-kit result from apply_sensor_batch (status_code + body,
+        a minimal acknowledgement with ack=True).
+        Must be called inside an app context; the leader uses its db.session.
+        """
+        with self._lock:
+            group = self._open
+            leader = group is None
+            if leader:
+                group = self._open = _Group()
+            index = len(group.payloads)
+            group.payloads.append(payload)
+            group.acks.append(ack)
+            if len(group.payloads) >= self.max_group_size:
+                # Close the group so later arrivals start a new one
+                self._open = None
+                group.full.set()
+
+        if leader:
+            group.full.wait(self.window)
+            with self._lock:
+                if self._open is group:
+                    self._open = None
+            self._commit(group)
+        elif not group.done.wait(self.wait_timeout):
+            return {"status_code": 504, "error": "Timed out waiting for group commit"}
+
+        return group.results[index]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "window_ms": self.window * 1000,
+                "max_group_size": self.max_group_size,
+                "groups": self._groups,
+                "payloads": self._payloads,
+                "commits": self._commits,
+                "fallbacks": self._fallbacks,
+                "avg_group_size": (self._payloads / self._groups) if self._groups else None,
+                "largest_group": self._largest_group
+            }
+
+    def _commit(self, group):
+        payloads = group.payloads
+        results = None
+        fallback = False
+        try:
+            with counter_undo() as undo:
+                try:
+                    results = apply_sensor_batch(payloads, group.acks)
+                except Exception:
+                    db.session.rollback()
+                    undo.restore()
+                    raise
+        except Exception:
+            # The shared commit failed: isolate every payload in its own transaction
+            fallback = True
+            results = [apply_sensor_alone(payload, ack) for payload, ack in zip(payloads, group.acks)]
+        finally:
+            # Never leave followers waiting, even if something escaped above
+            if results is None:
+                results = [{"status_code": 500, "error": "Group commit aborted"} for _ in payloads]
+            group.results = results
+            group.done.set()
+
+        with self._lock:
+            self._groups += 1
+            self._payloads += len(payloads)
+            self._commits += len(payloads) if fallback else 1
+            self._fallbacks += int(fallback)
+            self._largest_group = max(self._largest_group, len(payloads))
+
+
+def get_coordinator(app) -> GroupCommitCoordinator:
+    """Return the app's coordinator, creating it from app.config on first use."""
+    coordinator = app.extensions.get(EXTENSION_KEY)
+    if coordinator is not None:
+        return coordinator
+    with _coordinator_lock:
+        coordinator = app.extensions.get(EXTENSION_KEY)
+        if coordinator is None:
+            coordinator = GroupCommitCoordinator(
+                window=app.config.get("HARDWARE_GROUP_COMMIT_WINDOW_MS", 5) / 1000,
+                max_group_size=app.config.get("HARDWARE_GROUP_COMMIT_MAX_SIZE", 50)
+            )
+            app.extensions[EXTENSION_KEY] = coordinator
+    return coordinator
@@ -0,0 +1,121 @@
+"""
+Replay cache for retried sensor_data submissions.
+
+Kits on flaky links retry a report when the answer is lost, even though the
+server already applied it. A report that carries a sequence number ("seq")
+or an idempotency key ("idempotency_key" in the body, or the
+Idempotency-Key header) is only applied once:
+
+- this worker keeps the last HARDWARE_IDEMPOTENCY_CACHE_SIZE responses of
+  each kit; a retry found there is answered with the stored response
+  without touching the database (header Idempotent-Replayed: true)
+- otherwise (another worker applied it, or the entry was evicted) the
+  high-water marks on the kit (last_report_seq, last_idempotency_key, see
+  ingestion.pipeline.claim_report) reject it and the answer is a 200 with
+  "duplicate": true
+
+Only the newest key of a kit is persisted, so key-only kits are protected
+against retries of their last report; numbered kits against any report up
+(with a boot_id) in their current boot, or (without one) against retries
+of their newest report; a lower seq without a boot_id is a restarted
+counter and applied again.
+"""
+
+import threading
+from collections import OrderedDict
+
+EXTENSION_KEY = "hardware_response_cache"
+
+_cache_lock = threading.Lock()
+
+
+def idempotency_key(data):
+    """What identifies a report across retries: ("key", k), ("seq", (boot_id, n)), or None."""
+    if data.idempotency_key is not None:
+        return ("key", data.idempotency_key)
+    if data.seq is not None:
+        return ("seq", (data.boot_id, data.seq))
+    return None
+
+
+class ResponseCache:
+    """
+    Last responses per kit, keyed by idempotency_key() and the response form
+    (ack or full), shared by the threads of one worker. Kits are evicted
+    least recently used beyond max_kits.
+    """
+
+    def __init__(self, per_kit=16, max_kits=10000):
+        self.per_kit = max(0, int(per_kit))
+        self.max_kits = max(1, int(max_kits))
+        self._lock = threading.Lock()
+        self._kits = OrderedDict()  # hardware_id -> OrderedDict(key -> (status, body))
+
+        # Metrics
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, hardware_id, key):
+        """The stored (status, body) for a kit's report, or None."""
+        with self._lock:
+            responses = self._kits.get(hardware_id)
+            entry = responses.get(key) if responses is not None else None
+            if entry is None:
+                self._misses += 1
+                return None
+            self._kits.move_to_end(hardware_id)
+            self._hits += 1
+            return entry
+
+    def put(self, hardware_id, key, status, body):
+        if not self.per_kit:
+            return
+        with self._lock:
+            responses = self._kits.get(hardware_id)
+            if responses is None:
+                responses = self._kits[hardware_id] = OrderedDict()
+                while len(self._kits) > self.max_kits:
+                    self._kits.popitem(last=False)
+            else:
+                self._kits.move_to_end(hardware_id)
+
+            (kind, value), _ = key
+            if kind == "seq":
+                # Only reports of the kit's current boot can be retried, and
+                # without a boot_id only its newest report (see claim_report):
+                # older answers no longer belong to these numbers
+                boot_id = value[0]
+                for stale in [
+                    k for k in responses
+                    if k[0][0] == "seq" and k[0][1] != value and (boot_id is None or k[0][1][0] != boot_id)
+                ]:
+                    del responses[stale]
+            responses[key] = (status, body)
+            responses.move_to_end(key)
+            while len(responses) > self.per_kit:
+                responses.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._kits.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "kits": len(self._kits),
+                "per_kit": self.per_kit,
+                "hits": self._hits,
+                "misses": self._misses
+            }
+
+
+def get_response_cache(app) -> ResponseCache:
+    cache = app.extensions.get(EXTENSION_KEY)
+    if cache is None:
+        with _cache_lock:
+            cache = app.extensions.get(EXTENSION_KEY)
+            if cache is None:
+                cache = app.extensions[EXTENSION_KEY] = ResponseCache(
+                    per_kit=app.config.get("HARDWARE_IDEMPOTENCY_CACHE_SIZE", 16)
+                )
+    return cache
@@ -0,0 +1,209 @@
+"""
+Standalone TCP/UDP listener for kits that cannot afford HTTP + JSON.
+
+    python -m ingestion.line_listener [--host 0.0.0.0] [--tcp-port 8094] [--udp-port 8094]
+
+Kits send one reading per line (see decode_sensor_line in ingestion/codec.py):
+
+    BOT001 1=45.5,2=30.2,3=0 1758623400
+
+over TCP (newline separated, on a connection kept open) or UDP (one or
+more lines per datagram). Lines are decoded on the asyncio event loop and
+handed to the background writer of ingestion/async_writer.py, which applies
+them in batches with apply_sensor_batch: the same logic, logs and kit
+lookups as /api/hardware/sensor_data, without HTTP, Flask routing or JSON.
+
+TCP clients only get a line back when one of theirs was rejected:
+`ERR <message>`. While the writer queue is full, TCP connections are not
+read (the kernel's receive window pushes back on the kits) and UDP
+datagrams are dropped and counted.
+"""
+
+import argparse
+import asyncio
+import queue
+import signal
+import time
+
+# The app module comes first: models/__init__ imports it (see app.create_app)
+from app import create_app
+from ingestion.async_writer import get_writer
+from ingestion.codec import PayloadDecodeError, decode_sensor_line
+from ingestion.schema import PayloadValidationError, convert_sensor_payload
+
+# Longest accepted line; a kit with 32 compartments needs well under 1 KiB
+MAX_LINE_BYTES = 4096
+
+# How long a TCP connection waits before retrying a full writer queue
+_BACKPRESSURE_DELAY = 0.005
+
+
+class LineProtocolListener:
+    """Decodes protocol lines and feeds them to the app's ingestion writer."""
+
+    def __init__(self, app):
+        self.app = app
+        self.writer = get_writer(app)
+        self._servers = []
+        self._transports = []
+
+        # Metrics
+        self.connections = 0
+        self.lines = 0
+        self.accepted = 0
+        self.invalid = 0
+        self.dropped = 0
+
+    def decode(self, line):
+        """Decode and validate one line. Raises PayloadDecodeError/PayloadValidationError."""
+        self.lines += 1
+        try:
+            return convert_sensor_payload(decode_sensor_line(line))
+        except (PayloadDecodeError, PayloadValidationError):
+            self.invalid += 1
+            raise
+
+    def submit(self, payload) -> bool:
+        """Queue a payload for the writer; False when the queue is full."""
+        try:
+            self.writer.submit(payload, receipt=False)
+        except queue.Full:
+            return False
+        self.accepted += 1
+        return True
+
+    # --- TCP ---
+
+    async def _handle_tcp(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except (asyncio.LimitOverrunError, ValueError):
+                    writer.write(f"ERR Line exceeds {MAX_LINE_BYTES} bytes\n".encode("utf-8"))
+                    break
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                try:
+                    payload = self.decode(line)
+                except (PayloadDecodeError, PayloadValidationError) as e:
+                    writer.write(f"ERR {e}\n".encode("utf-8"))
+                    continue
+                while not self.submit(payload):
+                    await asyncio.sleep(_BACKPRESSURE_DELAY)
+        except ConnectionError:
+            pass
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    # --- UDP ---
+
+    def datagram_received(self, data, addr):
+        for line in data.splitlines():
+            if not line.strip():
+                continue
+            try:
+                payload = self.decode(line)
+            except (PayloadDecodeError, PayloadValidationError):
+                continue
+            if not self.submit(payload):
+                self.dropped += 1
+
+    # --- Lifecycle ---
+
+    async def start(self, host, tcp_port=0, udp_port=0):
+        """
+        Start listening; a port of None (or 0 from the config) disables
+        that transport. Returns the bound (tcp_port, udp_port).
+        """
+        loop = asyncio.get_running_loop()
+        bound_tcp = bound_udp = None
+        if tcp_port is not None:
+            server = await asyncio.start_server(self._handle_tcp, host, tcp_port, limit=MAX_LINE_BYTES)
+            self._servers.append(server)
+            bound_tcp = server.sockets[0].getsockname()[1]
+        if udp_port is not None:
+            transport, _ = await loop.create_datagram_endpoint(
+                lambda: _DatagramProtocol(self), local_addr=(host, udp_port)
+            )
+            self._transports.append(transport)
+            bound_udp = transport.get_extra_info("sockname")[1]
+        return bound_tcp, bound_udp
+
+    async def stop(self):
+        """Stop listening and flush what the writer still has queued."""
+        for server in self._servers:
+            server.close()
+            await server.wait_closed()
+        for transport in self._transports:
+            transport.close()
+        self._servers, self._transports = [], []
+        await asyncio.get_running_loop().run_in_executor(None, self.writer.stop)
+
+    def stats(self) -> dict:
+        return {
+            "connections": self.connections,
+            "lines": self.lines,
+            "accepted": self.accepted,
+            "invalid": self.invalid,
+            "dropped": self.dropped,
+            "writer": self.writer.stats()
+        }
+
+
+class _DatagramProtocol(asyncio.DatagramProtocol):
+    def __init__(self, listener):
+        self.listener = listener
+
+    def datagram_received(self, data, addr):
+        self.listener.datagram_received(data, addr)
+
+
+async def serve(app, host, tcp_port, udp_port, stats_interval=10.0):
+    """Run the listener until SIGINT/SIGTERM, printing throughput every stats_interval seconds."""
+    listener = LineProtocolListener(app)
+    bound_tcp, bound_udp = await listener.start(host, tcp_port, udp_port)
+    print(f"📡 Line protocol listener on {host} (tcp: {bound_tcp or 'off'}, udp: {bound_udp or 'off'})")
+
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stopping.set)
+
+    last_lines, last_time = 0, time.monotonic()
+    while not stopping.is_set():
+        try:
+            await asyncio.wait_for(stopping.wait(), stats_interval)
+        except asyncio.TimeoutError:
+            now = time.monotonic()
+            stats = listener.stats()
+            rate = (stats["lines"] - last_lines) / (now - last_time)
+            last_lines, last_time = stats["lines"], now
+            print(f"   {rate:8.0f} lines/s  accepted {stats['accepted']}  invalid {stats['invalid']}  "
+                  f"dropped {stats['dropped']}  queued {stats['writer']['queue_depth']}  "
+                  f"written {stats['writer']['processed']}")
+
+    print("🛑 Stopping, flushing queued readings...")
+    await listener.stop()
+
+
+def main():
+    app = create_app()
+    config = app.config
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=config["HARDWARE_LINE_HOST"])
+    parser.add_argument("--tcp-port", type=int, default=config["HARDWARE_LINE_TCP_PORT"], help="0 = off")
+    parser.add_argument("--udp-port", type=int, default=config["HARDWARE_LINE_UDP_PORT"], help="0 = off")
+    parser.add_argument("--stats-interval", type=float, default=10.0)
+    args = parser.parse_args()
+
+    asyncio.run(serve(app, args.host, args.tcp_port or None, args.udp_port or None, args.stats_interval))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,424 @@
+"""
+Monthly partitions of hardware_logs, and retention by dropping them.
+
+hardware_logs gets an audit row per report and nothing else deletes it.
+With HARDWARE_LOG_PARTITIONS=true the table is split by month of created_at:
+
+- MySQL: native RANGE partitioning on TO_DAYS(created_at), one partition
+  per month (p202610) plus p_future for anything later, so an insert never
+  fails because its month has no partition yet. An existing table is
+  converted once with --init (after the migration in DEPLOYMENT.md).
+- SQLite (development and tests): one table per month (hardware_logs_202610)
+  with the columns of hardware_logs, created by the first write of the
+  month. Each month numbers its ids from YYYYMM * 10**9 (seeded through
+  sqlite_sequence), so ids stay unique across months and name the month
+  of their row.
+- Other databases are not supported: partitioned reads, writes and
+  maintenance raise instead of numbering month tables from 1.
+
+Maintenance, e.g. daily from cron:
+
+    python -m ingestion.log_partitions [--init]
+
+adds the partitions of the current and next HARDWARE_LOG_PARTITIONS_AHEAD
+months and drops the months older than HARDWARE_LOG_RETENTION_MONTHS, a
+whole partition (ALTER TABLE ... DROP PARTITION) or table (DROP TABLE) at
+a time: old logs are never removed with a row-by-row DELETE.
+
+/api/hardware/logs reads month by month from the newest month of the
+requested range and stops once the page is full; every query is bounded
+to one partition (MySQL prunes the others) or table.
+"""
+
+import argparse
+import re
+import sys
+import threading
+from collections import namedtuple
+from datetime import date, datetime
+
+from flask import current_app
+from sqlalchemy import MetaData, func, select, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+from db import db
+from models.models import HardwareLog, hardware_log_dict
+
+# Per app: names of the month tables known to exist
+EXTENSION_KEY = "hardware_log_month_tables"
+
+FUTURE_PARTITION = "p_future"
+
+# Ids of a month table start at YYYYMM * MONTH_ID_BASE
+MONTH_ID_BASE = 10 ** 9
+
+_MONTH_TABLE = re.compile(r"^hardware_logs_(\d{4})(\d{2})$")
+
+_month_metadata = MetaData()
+_month_lock = threading.Lock()
+
+# A slice of hardware_logs: [start, end) in created_at (None = unbounded) and the table holding it
+LogPartition = namedtuple("LogPartition", "name start end table")
+
+
+def partitioning_enabled():
+    return bool(current_app.config.get("HARDWARE_LOG_PARTITIONS"))
+
+
+def _check_dialect(dialect):
+    # Month tables only get month-unique ids through sqlite_sequence
+    if dialect.name not in ("mysql", "sqlite"):
+        raise RuntimeError(f"HARDWARE_LOG_PARTITIONS supports MySQL and SQLite, not {dialect.name}")
+
+
+def month_start(ts):
+    return ts.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+
+def month_table(month):
+    """The Table of a month's logs (per-month tables); not created here."""
+    name = f"hardware_logs_{month:%Y%m}"
+    with _month_lock:
+        table = _month_metadata.tables.get(name)
+        if table is None:
+            table = HardwareLog.__table__.to_metadata(_month_metadata, name=name)
+            table.dialect_kwargs["sqlite_autoincrement"] = True
+            # Index names are per database on SQLite
+            for index in table.indexes:
+                index.name = index.name.replace(HardwareLog.__tablename__, name, 1)
+    return table
+
+
+def _create_month_table(conn, month):
+    """
+    Create a month's table unless it exists. Workers may create the same
+    month at once, so the DDL says IF NOT EXISTS (a database that still
+    reports "already exists" for a concurrent create is ignored too) and
+    the id sequence is only seeded when nobody has seeded it yet.
+    """
+    table = month_table(month)
+    try:
+        with conn.begin_nested():
+            conn.execute(CreateTable(table, if_not_exists=True))
+            for index in table.indexes:
+                conn.execute(CreateIndex(index, if_not_exists=True))
+    except DBAPIError as e:
+        if "already exists" not in str(e.orig).lower():
+            raise
+    if conn.dialect.name == "sqlite":
+        conn.execute(
+            text(
+                "INSERT INTO sqlite_sequence (name, seq) SELECT :name, :seq "
+                "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = :name)"
+            ),
+            {"name": table.name, "seq": int(f"{month:%Y%m}") * MONTH_ID_BASE}
+        )
+    return table
+
+
+def _month_of_id(log_id):
+    """Month whose table holds a log id, or None for rows of hardware_logs itself."""
+    if log_id < MONTH_ID_BASE:
+        return None
+    year_month = log_id // MONTH_ID_BASE
+    return datetime(year_month // 100, year_month % 100, 1)
+
+
+def log_tables(rows):
+    """
+    Group hardware_logs rows (dicts) by the table they are inserted into:
+    hardware_logs itself (unpartitioned, or partitioned by MySQL), or the
+    table of the month of their created_at, created on first use.
+    """
+    if not partitioning_enabled() or db.engine.dialect.name == "mysql":
+        return [(HardwareLog.__table__, rows)]
+    _check_dialect(db.engine.dialect)
+
+    groups = {}
+    for row in rows:
+        groups.setdefault(month_start(row["created_at"]), []).append(row)
+
+    known = current_app.extensions.setdefault(EXTENSION_KEY, set())
+    # Retention never drops the current or previous month, so only those are remembered
+    recent = add_months(month_start(datetime.utcnow()), -1)
+    tables = []
+    for month, group in groups.items():
+        table = month_table(month)
+        if table.name not in known:
+            _create_month_table(db.session.connection(), month)
+            if month >= recent:
+                known.add(table.name)
+        tables.append((table, group))
+    return tables
+
+
+def _from_days(days):
+    """Inverse of MySQL TO_DAYS()."""
+    day = date.fromordinal(days - 365)
+    return datetime(day.year, day.month, day.day)
+
+
+def _partition_definition(month):
+    return f"PARTITION p{month:%Y%m} VALUES LESS THAN (TO_DAYS('{add_months(month, 1):%Y-%m-%d}'))"
+
+
+def _native_partitions(conn):
+    rows = conn.execute(text(
+        "SELECT PARTITION_NAME, PARTITION_DESCRIPTION FROM information_schema.PARTITIONS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table AND PARTITION_NAME IS NOT NULL "
+        "ORDER BY PARTITION_ORDINAL_POSITION"
+    ), {"table": HardwareLog.__tablename__}).all()
+    partitions = []
+    start = None
+    for name, description in rows:
+        end = None if description == "MAXVALUE" else _from_days(int(description))
+        partitions.append(LogPartition(name, start, end, HardwareLog.__table__))
+        start = end
+    return partitions
+
+
+def _month_partitions(conn):
+    partitions = []
+    for name in db.inspect(conn).get_table_names():
+        match = _MONTH_TABLE.match(name)
+        if match:
+            month = datetime(int(match[1]), int(match[2]), 1)
+            partitions.append(LogPartition(name, month, add_months(month, 1), month_table(month)))
+    return sorted(partitions, key=lambda partition: partition.start)
+
+
+def log_partitions(conn):
+    """
+    The slices of hardware_logs, oldest first. Unpartitioned: the table
+    itself. Per-month tables: hardware_logs (rows written before
+    partitioning was enabled), then the months.
+    """
+    base = LogPartition(HardwareLog.__tablename__, None, None, HardwareLog.__table__)
+    if not partitioning_enabled():
+        return [base]
+    _check_dialect(conn.dialect)
+    if conn.dialect.name == "mysql":
+        return _native_partitions(conn) or [base]
+    return [base] + _month_partitions(conn)
+
+
+def query_logs(botiquin_id=None, processed=None, since=None, until=None, limit=100):
+    """
+    Newest hardware_logs rows first, as HardwareLog.to_dict() dicts.
+
+    Slices are read newest first, skipping those outside [since, until),
+    until `limit` rows are found, each with a created_at range of its own so
+    MySQL prunes the query to one partition. Payload rows that rejected
+    readings point at are fetched from the slice holding them.
+    """
+    conn = db.session.connection()
+    partitions = log_partitions(conn)
+    found = []
+    for partition in reversed(partitions):
+        if len(found) >= limit:
+            break
+        if since is not None and partition.end is not None and partition.end <= since:
+            continue
+        if until is not None and partition.start is not None and partition.start >= until:
+            continue
+
+        columns = partition.table.c
+        conditions = []
+        if botiquin_id is not None:
+            conditions.append(columns.botiquin_id == botiquin_id)
+        if processed is not None:
+            conditions.append(columns.processed == processed)
+        for lower in (since, partition.start):
+            if lower is not None:
+                conditions.append(columns.created_at >= lower)
+        for upper in (until, partition.end):
+            if upper is not None:
+                conditions.append(columns.created_at < upper)
+        found.extend(conn.execute(
+            select(partition.table).where(*conditions)
+            .order_by(columns.created_at.desc()).limit(limit - len(found))
+        ).all())
+
+    by_id = {row.id: row for row in found}
+    missing = {row.payload_log_id for row in found if row.payload_log_id is not None} - by_id.keys()
+    if missing:
+        if conn.dialect.name == "mysql" or not partitioning_enabled():
+            groups = {HardwareLog.__table__: missing}
+        else:
+            existing = {partition.name for partition in partitions}
+            groups = {}
+            for log_id in missing:
+                month = _month_of_id(log_id)
+                table = HardwareLog.__table__ if month is None else month_table(month)
+                if table.name in existing:
+                    groups.setdefault(table, []).append(log_id)
+        for table, ids in groups.items():
+            by_id.update((row.id, row) for row in conn.execute(select(table).where(table.c.id.in_(ids))))
+
+    return [
+        hardware_log_dict(row, None if row.payload_log_id is None else by_id.get(row.payload_log_id))
+        for row in found
+    ]
+
+
+def count_logs():
+    conn = db.session.connection()
+    tables = {partition.table for partition in log_partitions(conn)}
+    return sum(conn.execute(select(func.count()).select_from(table)).scalar() for table in tables)
+
+
+def clear_logs() -> bool:
+    """
+    Empty hardware_logs and every month table within the current
+    transaction (DELETE without WHERE, which SQLite carries out by emptying
+    the table instead of deleting rows one by one).
+
+    A MySQL table partitioned by month is left alone: returns True and the
+    caller runs truncate_logs() once its transaction is committed, as
+    TRUNCATE commits implicitly.
+    """
+    conn = db.session.connection()
+    if conn.dialect.name == "mysql" and partitioning_enabled():
+        return True
+    conn.execute(HardwareLog.__table__.delete())
+    if conn.dialect.name != "mysql":
+        for partition in _month_partitions(conn):
+            conn.execute(partition.table.delete())
+    return False
+
+
+def truncate_logs():
+    """Empty a partitioned MySQL hardware_logs (keeping its partitions) on a connection of its own."""
+    with db.engine.begin() as conn:
+        conn.execute(text(f"TRUNCATE TABLE {HardwareLog.__tablename__}"))
+
+
+def maintain(now=None):
+    """
+    Add the partitions (or month tables) of the current and the next
+    HARDWARE_LOG_PARTITIONS_AHEAD months and drop the months that ended
+    more than HARDWARE_LOG_RETENTION_MONTHS months before the current one
+    (0 = keep everything). Runs on its own connection, outside any request.
+    Returns {"created": [...], "dropped": [...]} with partition/table names.
+    """
+    config = current_app.config
+    current = month_start(now or datetime.utcnow())
+    last = add_months(current, max(0, config.get("HARDWARE_LOG_PARTITIONS_AHEAD", 2)))
+    retention = config.get("HARDWARE_LOG_RETENTION_MONTHS", 0)
+    cutoff = add_months(current, -retention) if retention > 0 else None
+
+    with db.engine.begin() as conn:
+        _check_dialect(conn.dialect)
+        if conn.dialect.name == "mysql":
+            return _maintain_native(conn, current, last, cutoff)
+        return _maintain_tables(conn, current, last, cutoff)
+
+
+def _maintain_native(conn, current, last, cutoff):
+    partitions = _native_partitions(conn)
+    if not partitions:
+        raise RuntimeError(
+            "hardware_logs is not partitioned: run python -m ingestion.log_partitions --init"
+        )
+
+    created = []
+    bounded = [partition.end for partition in partitions if partition.end is not None]
+    month = max(bounded) if bounded else current
+    while month <= last:
+        created.append(month)
+        month = add_months(month, 1)
+    if created:
+        # Splits p_future; rows already in it (maintenance did not run in time) move to their month
+        definitions = ", ".join(_partition_definition(month) for month in created)
+        conn.execute(text(
+            f"ALTER TABLE {HardwareLog.__tablename__} REORGANIZE PARTITION {FUTURE_PARTITION} INTO "
+            f"({definitions}, PARTITION {FUTURE_PARTITION} VALUES LESS THAN MAXVALUE)"
+        ))
+
+    dropped = [
+        partition.name for partition in partitions
+        if cutoff is not None and partition.end is not None and partition.end <= cutoff
+    ]
+    if dropped:
+        conn.execute(text(f"ALTER TABLE {HardwareLog.__tablename__} DROP PARTITION {', '.join(dropped)}"))
+
+    return {"created": [f"p{month:%Y%m}" for month in created], "dropped": dropped}
+
+
+def _maintain_tables(conn, current, last, cutoff):
+    existing = {partition.name: partition for partition in _month_partitions(conn)}
+
+    created = []
+    month = current
+    while month <= last:
+        if month_table(month).name not in existing:
+            created.append(_create_month_table(conn, month).name)
+        month = add_months(month, 1)
+
+    dropped = []
+    for name, partition in existing.items():
+        if cutoff is not None and partition.end <= cutoff:
+            partition.table.drop(conn)
+            dropped.append(name)
+    current_app.extensions.get(EXTENSION_KEY, set()).difference_update(dropped)
+
+    return {"created": created, "dropped": dropped}
+
+
+def init_partitions(now=None):
+    """
+    Partition an existing MySQL hardware_logs table by month, from the
+    month of its oldest row to HARDWARE_LOG_PARTITIONS_AHEAD months ahead.
+    Rebuilds the table; run it once, in a maintenance window.
+    """
+    current = month_start(now or datetime.utcnow())
+    last = add_months(current, max(0, current_app.config.get("HARDWARE_LOG_PARTITIONS_AHEAD", 2)))
+    with db.engine.begin() as conn:
+        if conn.dialect.name != "mysql":
+            raise RuntimeError("Native partitioning needs MySQL; other databases use month tables")
+        if _native_partitions(conn):
+            return []
+        oldest = conn.execute(select(func.min(HardwareLog.__table__.c.created_at))).scalar()
+        month = min(month_start(oldest), current) if oldest is not None else current
+        months = []
+        while month <= last:
+            months.append(month)
+            month = add_months(month, 1)
+        definitions = ", ".join(_partition_definition(month) for month in months)
+        conn.execute(text(
+            f"ALTER TABLE {HardwareLog.__tablename__} PARTITION BY RANGE (TO_DAYS(created_at)) "
+            f"({definitions}, PARTITION {FUTURE_PARTITION} VALUES LESS THAN MAXVALUE)"
+        ))
+    return [f"p{month:%Y%m}" for month in months]
+
+
+def main():
+    # Imported here: the app imports this module (through the ingestion pipeline) while it loads
+    from app import create_app
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--init", action="store_true",
+                        help="Partition an existing MySQL hardware_logs table first (rebuilds the table)")
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        if not partitioning_enabled():
+            print("HARDWARE_LOG_PARTITIONS is not enabled")
+            return 1
+        if args.init:
+            print(f"Partitioned: {', '.join(init_partitions()) or 'already partitioned'}")
+        result = maintain()
+    print(f"Created: {', '.join(result['created']) or '-'}")
+    print(f"Dropped: {', '.join(result['dropped']) or '-'}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,1090 @@
+"""
+Sensor payload processing shared by the hardware endpoints and the
+background ingestion writer.
+
+- Validates payloads against the typed schema (ingestion/schema.py)
+- Resolves kits through the device registry (ingestion/registry.py) and
+  compartments with set-based queries
+- Applies compartment readings to Medicine rows with one upsert per payload
+- Writes applied readings to the compartment_readings time series and
+  payload audit rows and errors to hardware_logs, with multi-row INSERTs,
+  and keeps the hourly/daily rollups current (ingestion/rollups.py)
+- Drops load-cell noise inside the configured dead-band
+- Collapses repeated errors from unregistered devices into periodic rows
+- Applies delta payloads (only changed compartments) when their base
+  sequence number matches the kit's last applied report
+- Tells each kit when to report next (ingestion/schedule.py)
+
+HARDWARE_INGEST_CORE selects how compartments are loaded and written. By
+default they are Medicine objects, updated through the session's unit of
+work; with the flag they are plain SQLAlchemy Core rows (no identity-map
+tracking or attribute instrumentation) written with one upsert. New
+compartments are created by the upsert on both paths. Kits
+without the device registry (HARDWARE_REGISTRY_TTL=0) are loaded the same
+way; with it they come from the registry either way. Log, readings and
+sync writes are Core statements on both paths, and both produce the same
+responses and rows.
+"""
+
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime
+import atexit
+import math
+import os
+import threading
+import time
+from flask import current_app
+from sqlalchemy import func, or_, select, update
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.orm.attributes import set_committed_value
+from db import db
+from models.models import (
+    Botiquin, CompartmentReading, Medicine, compress_payload, reading_in_deadband, stock_status
+)
+from ingestion.log_partitions import log_tables
+from ingestion.registry import get_registry, registry_enabled
+from ingestion.rollups import update_rollups
+from ingestion.schedule import ReportActivity, next_report
+from ingestion.schema import PayloadValidationError, SensorPayload, convert_sensor_payload, encode_json
+
+
+# Dead-band readings seen per (botiquin_id, compartment) since the last logged one
+_unchanged_readings = {}
+_unchanged_lock = threading.Lock()
+
+# Changes the current thread makes to the in-memory counters, see counter_undo()
+_counter_undo = threading.local()
+_MISSING = object()
+
+
+class CounterUndo:
+    """Changes one thread made to in-memory ingestion counters, revertible with restore()."""
+
+    def __init__(self):
+        self.changes = []
+
+    def restore(self):
+        for store, lock, key, old, new in reversed(self.changes):
+            with lock:
+                # Keys another thread changed since are left alone
+                if store.get(key, _MISSING) is not new:
+                    continue
+                if old is _MISSING:
+                    store.pop(key, None)
+                else:
+                    store[key] = old
+        self.changes.clear()
+
+
+@contextmanager
+def counter_undo():
+    """
+    Record the in-memory counters (dead-band samples, unknown-device folding)
+    that payloads applied in this block change. When their transaction
+    fails and the payloads are applied again, restore() reverts the
+    changes first so nothing is counted twice.
+    """
+    undo = CounterUndo()
+    previous = getattr(_counter_undo, "log", None)
+    _counter_undo.log = undo
+    try:
+        yield undo
+    finally:
+        _counter_undo.log = previous
+
+
+def _set_counter(store, lock, key, value):
+    """Set a counter (remove it with value=_MISSING), recorded for counter_undo(); the caller holds `lock`."""
+    old = store.get(key, _MISSING)
+    if value is _MISSING:
+        store.pop(key, None)
+    else:
+        store[key] = value
+    undo = getattr(_counter_undo, "log", None)
+    if undo is not None:
+        undo.changes.append((store, lock, key, old, value))
+
+
+def kit_deadband(botiquin):
+    """
+    (grams, percent) dead-band for a kit: its own override when set,
+    otherwise HARDWARE_DEADBAND_GRAMS / HARDWARE_DEADBAND_PERCENT.
+    """
+    config = current_app.config
+    grams = botiquin.deadband_grams
+    if grams is None:
+        grams = config.get("HARDWARE_DEADBAND_GRAMS", 0)
+    percent = botiquin.deadband_percent
+    if percent is None:
+        percent = config.get("HARDWARE_DEADBAND_PERCENT", 0)
+    return grams, percent
+
+
+def _sample_unchanged_reading(key):
+    """
+    Count a dead-band reading for a compartment. Returns True for every Nth
+    one (HARDWARE_DEADBAND_LOG_EVERY) so the readings history keeps a sample.
+    """
+    every = current_app.config.get("HARDWARE_DEADBAND_LOG_EVERY", 10)
+    if every <= 1:
+        return True
+    with _unchanged_lock:
+        count = _unchanged_readings.get(key, 0) + 1
+        if count >= every:
+            _set_counter(_unchanged_readings, _unchanged_lock, key, _MISSING)
+            return True
+        _set_counter(_unchanged_readings, _unchanged_lock, key, count)
+        return False
+
+
+def _reset_unchanged_readings(key):
+    with _unchanged_lock:
+        if key in _unchanged_readings:
+            _set_counter(_unchanged_readings, _unchanged_lock, key, _MISSING)
+
+
+def hardware_log_row(raw_data=None, **values):
+    """
+    Build a plain dict for a hardware_logs row.
+    Every row carries the same keys so a payload's rows can be written
+    with a single executemany INSERT. `raw_data` (the payload's text) is
+    stored compressed in raw_payload.
+    """
+    row = {
+        "botiquin_id": None,
+        "compartment_number": None,
+        "weight_reading": None,
+        "sensor_type": None,
+        "raw_payload": None if raw_data is None else compress_payload(raw_data),
+        "payload_log_id": None,
+        "processed": False,
+        "error_message": None,
+        "occurrences": 1,
+        "created_at": datetime.utcnow()
+    }
+    row.update(values)
+    return row
+
+
+# Per app: unregistered hardware_id -> (requests not logged yet, monotonic time of the last row)
+UNKNOWN_DEVICES_KEY = "hardware_unknown_devices"
+# Per app: requests not logged yet of devices evicted from UNKNOWN_DEVICES_KEY
+UNKNOWN_EVICTED_KEY = "hardware_unknown_devices_evicted"
+# Per app: (thread or None once stopped, pid) of the thread writing the folded requests of quiet devices
+UNKNOWN_FLUSHER_KEY = "hardware_unknown_devices_flusher"
+_unknown_devices_lock = threading.Lock()
+_MAX_UNKNOWN_DEVICES = 10000
+
+
+def _unknown_device_message(hardware_id, requests=1):
+    message = f"Botiquin with hardware_id '{hardware_id}' not found"
+    if requests > 1:
+        message += f" ({requests} requests since the last logged one)"
+    return message
+
+
+def unknown_device_log(log_entry, hardware_id):
+    """
+    Fill in the "not found" error of a payload from an unregistered kit.
+
+    Returns the row to write, or None when the request is folded into the
+    device's next row: at most one row per HARDWARE_UNKNOWN_LOG_INTERVAL
+    seconds and hardware_id, carrying in `occurrences` how many requests
+    it stands for. A device that stops sending gets its folded requests
+    written by a background thread instead (flush_unknown_devices). With
+    an interval of 0 every request gets its own row.
+    """
+    interval = current_app.config.get("HARDWARE_UNKNOWN_LOG_INTERVAL", 60)
+    skipped = 0
+    if interval > 0:
+        now = time.monotonic()
+        with _unknown_devices_lock:
+            unknown_devices = current_app.extensions.setdefault(UNKNOWN_DEVICES_KEY, {})
+            state = unknown_devices.get(hardware_id)
+            if state is not None and now - state[1] < interval:
+                _set_counter(unknown_devices, _unknown_devices_lock, hardware_id, (state[0] + 1, state[1]))
+                _start_unknown_flusher(current_app._get_current_object(), interval)
+                return None
+            skipped = state[0] if state is not None else 0
+            # Re-inserted at the end: the oldest devices are evicted first
+            _set_counter(unknown_devices, _unknown_devices_lock, hardware_id, _MISSING)
+            _set_counter(unknown_devices, _unknown_devices_lock, hardware_id, (0, now))
+            evicted = current_app.extensions.setdefault(UNKNOWN_EVICTED_KEY, {})
+            while len(unknown_devices) > _MAX_UNKNOWN_DEVICES:
+                oldest = next(iter(unknown_devices))
+                pending = unknown_devices[oldest][0]
+                if pending:
+                    _set_counter(evicted, _unknown_devices_lock, oldest, evicted.get(oldest, 0) + pending)
+                _set_counter(unknown_devices, _unknown_devices_lock, oldest, _MISSING)
+        if skipped:
+            log_entry["occurrences"] = skipped + 1
+    log_entry["error_message"] = _unknown_device_message(hardware_id, skipped + 1)
+    return log_entry
+
+
+def flush_unknown_devices(app, everything=False) -> int:
+    """
+    Write the requests folded by unknown_device_log that no later request
+    will carry: those of devices silent for two intervals since their last
+    row (so the count is at most one interval late) or evicted from the
+    cache, and with everything=True (shutdown) all of them. One row per
+    device; counts that fail to write are kept for the next flush.
+    Returns the number of rows written.
+    """
+    interval = app.config.get("HARDWARE_UNKNOWN_LOG_INTERVAL", 60)
+    now = time.monotonic()
+    with _unknown_devices_lock:
+        unknown_devices = app.extensions.get(UNKNOWN_DEVICES_KEY, {})
+        evicted = app.extensions.get(UNKNOWN_EVICTED_KEY, {})
+        counts = dict(evicted)
+        evicted.clear()
+        quiet = [
+            hardware_id for hardware_id, (pending, last_row) in unknown_devices.items()
+            if pending and (everything or now - last_row >= 2 * interval)
+        ]
+        for hardware_id in quiet:
+            counts[hardware_id] = counts.get(hardware_id, 0) + unknown_devices.pop(hardware_id)[0]
+    if not counts:
+        return 0
+
+    rows = [
+        hardware_log_row(error_message=_unknown_device_message(hardware_id, requests), occurrences=requests)
+        for hardware_id, requests in counts.items()
+    ]
+    with app.app_context():
+        try:
+            write_hardware_logs(rows)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            with _unknown_devices_lock:
+                evicted = app.extensions.setdefault(UNKNOWN_EVICTED_KEY, {})
+                for hardware_id, requests in counts.items():
+                    evicted[hardware_id] = evicted.get(hardware_id, 0) + requests
+            return 0
+        finally:
+            db.session.remove()
+    return len(rows)
+
+
+def _start_unknown_flusher(app, interval):
+    """Start the app's flusher thread unless it runs in this process; the caller holds _unknown_devices_lock."""
+    running = app.extensions.get(UNKNOWN_FLUSHER_KEY)
+    if running is not None and running[1] == os.getpid() and running[0] is not None and running[0].is_alive():
+        return
+    thread = threading.Thread(
+        target=_run_unknown_flusher, args=(app, interval), name="hardware-unknown-devices", daemon=True
+    )
+    app.extensions[UNKNOWN_FLUSHER_KEY] = (thread, os.getpid())
+    thread.start()
+    if running is None:
+        # Folded requests are not lost on a clean shutdown either
+        atexit.register(flush_unknown_devices, app, everything=True)
+
+
+def _run_unknown_flusher(app, interval):
+    # Runs while requests are folded; the next folded request starts it again
+    while True:
+        time.sleep(interval)
+        flush_unknown_devices(app)
+        with _unknown_devices_lock:
+            if not app.extensions.get(UNKNOWN_EVICTED_KEY) and not any(
+                pending for pending, _ in app.extensions.get(UNKNOWN_DEVICES_KEY, {}).values()
+            ):
+                # Marked stopped while the lock is held, so no folded request is left without a thread
+                app.extensions[UNKNOWN_FLUSHER_KEY] = (None, os.getpid())
+                return
+
+
+def write_hardware_logs(rows):
+    """
+    Insert hardware_logs rows (dicts) with one multi-row INSERT, bypassing
+    the unit of work (one per month with per-month tables, see
+    ingestion/log_partitions.py).
+    """
+    if rows:
+        for table, group in log_tables(rows):
+            db.session.execute(table.insert(), group)
+
+
+def write_payload_logs(entries):
+    """
+    Insert payload rows together with the rows of their rejected readings,
+    which point at them through payload_log_id instead of repeating the
+    payload. `entries` is a list of (payload_row, reading_rows).
+
+    Payload rows without rejected readings go in one multi-row INSERT; the
+    others (a payload with bad compartments, rare) are inserted one by one
+    to learn their id, then every reading row in one more INSERT.
+    """
+    write_hardware_logs([row for row, readings in entries if not readings])
+    linked = []
+    for row, readings in entries:
+        if readings:
+            [(table, _)] = log_tables([row])
+            payload_log_id = db.session.execute(table.insert(), row).inserted_primary_key[0]
+            for reading in readings:
+                reading["payload_log_id"] = payload_log_id
+            linked.extend(readings)
+    write_hardware_logs(linked)
+
+
+# compartment_readings stores the compartment as SMALLINT and the weight as INT milligrams
+_COMPARTMENT_RANGE = (-32768, 32767)
+_MAX_MILLIGRAMS = 2 ** 31 - 1
+
+
+def reading_row(botiquin_id, compartment, weight, ts):
+    """Build a compartment_readings row (dict); the weight is stored in integer milligrams."""
+    return {"botiquin_id": botiquin_id, "compartment": compartment, "ts": ts, "weight_mg": round(weight * 1000)}
+
+
+def reading_range_error(compartment, weight):
+    """Why a reading cannot be stored in compartment_readings, or None."""
+    if not _COMPARTMENT_RANGE[0] <= compartment <= _COMPARTMENT_RANGE[1]:
+        return "Compartment number out of range"
+    if not math.isfinite(weight) or abs(weight) * 1000 > _MAX_MILLIGRAMS:
+        return "Weight out of range"
+    return None
+
+
+_reading_inserts = {}
+
+
+def _reading_insert(dialect):
+    """
+    INSERT into compartment_readings, built once per dialect: a second
+    reading of a compartment at the same instant replaces the first instead
+    of failing the payload on the primary key.
+    """
+    stmt = _reading_inserts.get(dialect)
+    if stmt is not None:
+        return stmt
+
+    table = CompartmentReading.__table__
+    if dialect == "mysql":
+        stmt = mysql.insert(table)
+        stmt = stmt.on_duplicate_key_update(weight_mg=stmt.inserted.weight_mg)
+    elif dialect in ("sqlite", "postgresql"):
+        stmt = (sqlite if dialect == "sqlite" else postgresql).insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.botiquin_id, table.c.compartment, table.c.ts],
+            set_={"weight_mg": stmt.excluded.weight_mg}
+        )
+    else:
+        raise NotImplementedError(f"Reading insert is not supported on {dialect}")
+    _reading_inserts[dialect] = stmt
+    return stmt
+
+
+def write_compartment_readings(rows, rejected=()):
+    """
+    Insert compartment_readings rows (dicts) with one executemany statement
+    (the last duplicate wins) and merge them, with the hardware_logs rows of
+    `rejected` readings, into the hourly and daily rollups.
+    """
+    unique = list({(row["botiquin_id"], row["compartment"], row["ts"]): row for row in rows}.values())
+    if unique:
+        db.session.execute(_reading_insert(db.engine.dialect.name), unique)
+    update_rollups(unique, rejected)
+
+
+def core_ingest_enabled():
+    return bool(current_app.config.get("HARDWARE_INGEST_CORE"))
+
+
+# Columns the ingestion path reads; Core rows expose them as attributes like ORM objects
+_KIT_COLUMNS = [
+    Botiquin.__table__.c[name]
+    for name in ("id", "hardware_id", "name", "deadband_grams", "deadband_percent")
+]
+_COMPARTMENT_COLUMNS = [
+    Medicine.__table__.c[name]
+    for name in ("id", "botiquin_id", "compartment_number", "medicine_name",
+                 "initial_weight", "current_weight", "quantity", "expiry_date", "last_scan_at")
+]
+
+
+# What the ingestion path knows about a compartment after writing it in this
+# batch (see applied_compartment); same attributes as Medicine and Core rows
+CompartmentState = namedtuple("CompartmentState", [column.name for column in _COMPARTMENT_COLUMNS])
+
+
+def find_kits(hardware_ids):
+    """
+    Resolve hardware_ids with at most one query. Returns {hardware_id: kit},
+    where a kit is a registry KitEntry, a Botiquin (ORM path) or a Core row,
+    all with the same attributes.
+    """
+    if not hardware_ids:
+        return {}
+    if registry_enabled():
+        return get_registry(current_app).get_many(hardware_ids)
+    if core_ingest_enabled():
+        rows = db.session.execute(
+            select(*_KIT_COLUMNS).where(Botiquin.__table__.c.hardware_id.in_(hardware_ids))
+        ).all()
+    else:
+        rows = Botiquin.query.filter(Botiquin.hardware_id.in_(hardware_ids)).all()
+    return {kit.hardware_id: kit for kit in rows}
+
+
+def load_compartment_medicines(botiquin_ids, compartment_numbers):
+    """
+    Load the medicines of the given kits/compartments with a single IN (...) query.
+    Returns a dict keyed by (botiquin_id, compartment_number); the oldest row wins.
+    Values are Medicine objects, or Core rows when HARDWARE_INGEST_CORE is set.
+    """
+    medicines = {}
+    if not botiquin_ids or not compartment_numbers:
+        return medicines
+
+    if core_ingest_enabled():
+        table = Medicine.__table__
+        existing = db.session.execute(
+            select(*_COMPARTMENT_COLUMNS).where(
+                table.c.botiquin_id.in_(botiquin_ids),
+                table.c.compartment_number.in_(compartment_numbers)
+            ).order_by(table.c.id.asc())
+        ).all()
+    else:
+        # populate_existing: rows may have been upserted since they were loaded
+        existing = Medicine.query.filter(
+            Medicine.botiquin_id.in_(botiquin_ids),
+            Medicine.compartment_number.in_(compartment_numbers)
+        ).order_by(Medicine.id.asc()).execution_options(populate_existing=True).all()
+    for medicine in existing:
+        medicines.setdefault((medicine.botiquin_id, medicine.compartment_number), medicine)
+    return medicines
+
+
+def mark_synced(botiquin, now) -> int:
+    """
+    Stamp last_sync_at on a kit and advance its server_seq with one UPDATE.
+    Returns the new server_seq, read back by the UPDATE itself (RETURNING,
+    or LAST_INSERT_ID(expr) on MySQL) so concurrent workers each get their own.
+    """
+    table = Botiquin.__table__
+    statement = update(table).where(table.c.id == botiquin.id)
+    dialect = db.session.get_bind().dialect
+    if dialect.update_returning:
+        server_seq = db.session.execute(
+            statement.values(last_sync_at=now, server_seq=table.c.server_seq + 1).returning(table.c.server_seq)
+        ).scalar_one()
+    elif dialect.name == "mysql":
+        server_seq = db.session.execute(
+            statement.values(last_sync_at=now, server_seq=func.last_insert_id(table.c.server_seq + 1))
+        ).lastrowid
+    else:
+        db.session.execute(statement.values(last_sync_at=now, server_seq=table.c.server_seq + 1))
+        server_seq = db.session.execute(select(table.c.server_seq).where(table.c.id == botiquin.id)).scalar_one()
+    if isinstance(botiquin, Botiquin):
+        # Keep the loaded object in step without flushing it again
+        set_committed_value(botiquin, "last_sync_at", now)
+        set_committed_value(botiquin, "server_seq", server_seq)
+    return server_seq
+
+
+# Response code telling a kit to send its next report with every compartment
+RESEND_FULL = "RESEND_FULL"
+
+
+class DeltaGapError(Exception):
+    """A delta payload's base_seq is not the kit's last applied report."""
+
+    def __init__(self, base_seq, expected_base_seq):
+        self.base_seq = base_seq
+        self.expected_base_seq = expected_base_seq
+        super().__init__(f"Delta base_seq {base_seq} does not follow the last applied report ({expected_base_seq})")
+
+    def response(self) -> dict:
+        return {"error": str(self), "code": RESEND_FULL, "expected_base_seq": self.expected_base_seq}
+
+
+class DuplicateReport(Exception):
+    """
+    The kit's report was already applied (same seq or idempotency key);
+    nothing is written. `server_seq` is the kit's current one.
+    """
+
+    def __init__(self, data, server_seq=None):
+        self.seq = data.seq
+        self.idempotency_key = data.idempotency_key
+        self.server_seq = server_seq
+        super().__init__(f"Report {data.seq if data.seq is not None else data.idempotency_key} was already applied")
+
+    def response(self) -> dict:
+        response = {"success": True, "duplicate": True, "message": str(self)}
+        if self.seq is not None:
+            response["seq"] = self.seq
+        if self.idempotency_key is not None:
+            response["idempotency_key"] = self.idempotency_key
+        return response
+
+    def ack(self) -> dict:
+        ack = {"ack": "duplicate", "server_seq": self.server_seq}
+        if self.seq is not None:
+            ack["seq"] = self.seq
+        return ack
+
+
+def claim_report(botiquin, data):
+    """
+    Record a report on its kit before applying it, with one conditional
+    UPDATE so concurrent workers and client retries cannot apply it twice:
+
+    - a delta moves last_report_seq from its base_seq to its seq, within
+      the same boot_id
+    - a full report with a boot_id is a retry when its boot is the kit's
+      last_boot_id and its seq is at or below the mark; a new boot_id
+      means the kit restarted its counter and the mark follows
+    - a full report with a seq but no boot_id is a retry only when its seq
+      is the mark; any other seq is applied (a lower one is a counter
+      reset), so kits with several reports in flight should send boot_id
+    - an idempotency key must differ from the kit's last_idempotency_key
+
+    Raises DuplicateReport for a report already applied and DeltaGapError
+    when a delta's base report was lost; in both cases nothing is applied.
+    """
+    table = Botiquin.__table__
+    conditions = [table.c.id == botiquin.id]
+    values = {}
+
+    mark = table.c.last_report_seq
+    boot = table.c.last_boot_id
+    if data.is_delta:
+        conditions.append(mark == data.base_seq)
+        if data.boot_id is not None:
+            conditions.append(boot == data.boot_id)
+        values["last_report_seq"] = data.seq
+    elif data.seq is not None:
+        if data.boot_id is not None:
+            conditions.append(or_(mark.is_(None), boot.is_(None), boot != data.boot_id, mark < data.seq))
+        else:
+            conditions.append(or_(mark.is_(None), mark != data.seq))
+        values["last_report_seq"] = data.seq
+        values["last_boot_id"] = data.boot_id
+    if data.idempotency_key is not None:
+        last_key = table.c.last_idempotency_key
+        conditions.append(or_(last_key.is_(None), last_key != data.idempotency_key))
+        values["last_idempotency_key"] = data.idempotency_key
+    if not values:
+        return
+
+    claimed = db.session.execute(update(table).where(*conditions).values(**values)).rowcount
+    if claimed:
+        return
+
+    current = db.session.execute(
+        select(mark, table.c.last_idempotency_key, table.c.server_seq).where(table.c.id == botiquin.id)
+    ).one()
+    if data.idempotency_key is not None and current.last_idempotency_key == data.idempotency_key:
+        raise DuplicateReport(data, current.server_seq)
+    if data.is_delta and current.last_report_seq != data.seq:
+        raise DeltaGapError(data.base_seq, current.last_report_seq)
+    raise DuplicateReport(data, current.server_seq)
+
+
+def compartment_row(botiquin_id, number, medicine_name, initial_weight, weight, now):
+    """Row for upsert_compartments; columns a reading never touches keep their defaults."""
+    return {
+        "botiquin_id": botiquin_id,
+        "compartment_number": number,
+        "medicine_name": medicine_name,
+        "initial_weight": initial_weight,
+        "current_weight": weight,
+        "quantity": 0,  # Will be calculated when unit_weight is set by admin
+        "reorder_level": 5,
+        "last_scan_at": now,
+        "created_at": now,
+        "updated_at": now
+    }
+
+
+# Compartment upsert statement per dialect name, see _compartment_upsert
+_compartment_upserts = {}
+
+
+def _compartment_upsert(dialect):
+    """
+    INSERT ... ON DUPLICATE KEY UPDATE (MySQL) / ON CONFLICT DO UPDATE
+    (SQLite/PostgreSQL) on medicines, built once per dialect. It carries no
+    literal VALUES, so it also compiles once; rows are bound through the
+    driver's executemany.
+    """
+    stmt = _compartment_upserts.get(dialect)
+    if stmt is not None:
+        return stmt
+
+    table = Medicine.__table__
+    if dialect == "mysql":
+        stmt = mysql.insert(table)
+        new = stmt.inserted
+    elif dialect in ("sqlite", "postgresql"):
+        stmt = (sqlite if dialect == "sqlite" else postgresql).insert(table)
+        new = stmt.excluded
+    else:
+        raise NotImplementedError(f"Compartment upsert is not supported on {dialect}")
+
+    values = {
+        "current_weight": new.current_weight,
+        "last_scan_at": new.last_scan_at,
+        "updated_at": new.updated_at,
+        "initial_weight": func.coalesce(table.c.initial_weight, new.initial_weight),
+        "medicine_name": func.coalesce(new.medicine_name, table.c.medicine_name)
+    }
+    if dialect == "mysql":
+        stmt = stmt.on_duplicate_key_update(**values)
+    else:
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.botiquin_id, table.c.compartment_number],
+            set_=values
+        )
+    _compartment_upserts[dialect] = stmt
+    return stmt
+
+
+def upsert_compartments(rows):
+    """
+    Create or update a payload's compartments in one statement keyed on the
+    unique (botiquin_id, compartment_number): INSERT ... ON DUPLICATE KEY
+    UPDATE on MySQL, INSERT ... ON CONFLICT DO UPDATE on SQLite/PostgreSQL.
+    Existing rows get the new reading; initial_weight is only filled when
+    missing and medicine_name only replaced when the hardware sent one.
+    """
+    if rows:
+        db.session.execute(_compartment_upsert(db.engine.dialect.name), rows)
+
+
+def write_compartments(rows, medicines):
+    """
+    Write a payload's compartment rows and return {(botiquin_id, number):
+    compartment} with what each compartment now holds. Loaded Medicine
+    objects (the ORM path) are updated through the session's unit of work,
+    following upsert_compartments' rules, and flushed; every other row (Core
+    path, new compartments) goes through one upsert_compartments.
+    """
+    written = {}
+    upserts = []
+    for row in rows:
+        key = (row["botiquin_id"], row["compartment_number"])
+        medicine = medicines.get(key)
+        if not isinstance(medicine, Medicine):
+            upserts.append(row)
+            written[key] = row
+            continue
+        medicine.current_weight = row["current_weight"]
+        medicine.last_scan_at = row["last_scan_at"]
+        medicine.updated_at = row["updated_at"]
+        if medicine.initial_weight is None:
+            medicine.initial_weight = row["initial_weight"]
+        if row["medicine_name"] is not None:
+            medicine.medicine_name = row["medicine_name"]
+        written[key] = medicine
+    if len(upserts) < len(rows):
+        db.session.flush()
+    upsert_compartments(upserts)
+    return written
+
+
+def applied_compartment(medicine, row):
+    """
+    State of a compartment after upsert_compartments wrote `row` over
+    `medicine` (None for a new compartment), following the upsert's rules.
+    Lets a batch apply a kit's next payload without reloading its rows.
+    """
+    if medicine is None:
+        return CompartmentState(
+            id=None, botiquin_id=row["botiquin_id"], compartment_number=row["compartment_number"],
+            medicine_name=row["medicine_name"], initial_weight=row["initial_weight"],
+            current_weight=row["current_weight"], quantity=row["quantity"], expiry_date=None,
+            last_scan_at=row["last_scan_at"]
+        )
+    return CompartmentState(
+        id=medicine.id, botiquin_id=medicine.botiquin_id, compartment_number=medicine.compartment_number,
+        medicine_name=row["medicine_name"] if row["medicine_name"] is not None else medicine.medicine_name,
+        initial_weight=medicine.initial_weight if medicine.initial_weight is not None else row["initial_weight"],
+        current_weight=row["current_weight"], quantity=medicine.quantity, expiry_date=medicine.expiry_date,
+        last_scan_at=row["last_scan_at"]
+    )
+
+
+def payload_compartment_numbers(data):
+    """Set of compartment numbers reported in a SensorPayload."""
+    return {comp.compartment for comp in data.compartments if comp.compartment is not None}
+
+
+def apply_sensor_payload(data, botiquin, medicines, comp_logs, readings, build_results=True, activity=None,
+                         written=None, received_at=None):
+    """
+    Apply one kit's compartment readings (a validated SensorPayload) to its
+    Medicine rows.
+
+    `medicines` is the (botiquin_id, compartment_number) map from
+    load_compartment_medicines. Applied readings are appended to `readings`
+    (compartment_readings rows) and readings that could not be applied to
+    `comp_logs` (hardware_logs rows); the caller writes both. Returns
+    (results, errors, server_seq), server_seq being the kit's count of
+    applied reports; with build_results=False (ack responses) results stay
+    empty. Weight movements are recorded in `activity` (a ReportActivity)
+    when given, and the compartments written in `written`
+    ({(botiquin_id, number): row}, Medicine objects on the ORM path).
+    Readings, scans and the sync time are stamped with `received_at` (when
+    the payload reached the server, e.g. journaled by the spool) or now.
+    """
+    results = []
+    errors = []
+
+    # Deltas only apply on top of the report they were computed from, and a
+    # numbered (or keyed) report only once
+    claim_report(botiquin, data)
+
+    # The schema already rejected non-numeric values
+    unit_payload = data.unit_payload
+    if unit_payload is not None:
+        payload_avg_weight = unit_payload.average_weight
+        if payload_avg_weight is None:
+            payload_avg_weight = unit_payload.unit_weight
+        if payload_avg_weight is not None and payload_avg_weight <= 0:
+            errors.append({"warning": "Payload average_weight must be greater than zero"})
+
+    # Every reported compartment becomes one row of a single upsert statement
+    writes = {}
+    now = received_at or datetime.utcnow()
+    deadband_grams, deadband_percent = kit_deadband(botiquin)
+    sensor_type = "unknown" if data.sensor_type is None else data.sensor_type
+
+    # Iterate through compartments
+    for comp in data.compartments:
+        compartment_number = comp.compartment
+        weight = comp.weight
+        medicine_name = comp.medicine_name  # New field from hardware
+        
+        if compartment_number is None or weight is None:
+            error = "Missing compartment or weight data"
+        else:
+            error = reading_range_error(compartment_number, weight)
+        if error:
+            # Readings that cannot be applied are kept in the audit log,
+            # pointing at the payload row (see write_payload_logs)
+            comp_logs.append(hardware_log_row(
+                botiquin_id=botiquin.id,
+                compartment_number=compartment_number,
+                weight_reading=weight,
+                sensor_type=sensor_type,
+                error_message=error,
+                created_at=now
+            ))
+            errors.append({"compartment": compartment_number, "error": error})
+            continue
+        reading = reading_row(botiquin.id, compartment_number, weight, now)
+
+        number = compartment_number
+        
+        # Find medicine in the compartment
+        medicine = medicines.get((botiquin.id, number))
+        
+        if not medicine:
+            # New medicine record for this compartment (first reading sets initial weight)
+            pending = writes.get(number)
+            initial_weight = pending["initial_weight"] if pending else weight
+            if pending and not medicine_name:
+                medicine_name = pending["medicine_name"]
+            writes[number] = compartment_row(botiquin.id, number, medicine_name, initial_weight, weight, now)
+            
+            readings.append(reading)
+            if activity is not None:
+                activity.observe(None, weight, initial_weight)
+            
+            if build_results:
+                results.append({
+                    "compartment": compartment_number,
+                    "medicine": medicine_name or "No asignado",
+                    "old_weight": None,
+                    "new_weight": weight,
+                    "old_quantity": 0,
+                    "new_quantity": 0,
+                    "quantity_change": 0,
+                    "status": "NEW_MEDICINE",
+                    "message": "New medicine record created"
+                })
+            continue
+        
+        # The schedule follows how fast weights move since the previous reading
+        elapsed = None if medicine.last_scan_at is None else (now - medicine.last_scan_at).total_seconds()
+        
+        # Load-cell noise: keep the row as is and only sample the time series
+        if (not medicine_name or medicine_name == medicine.medicine_name) and reading_in_deadband(
+                medicine.current_weight, medicine.initial_weight, medicine.expiry_date,
+                weight, deadband_grams, deadband_percent):
+            if _sample_unchanged_reading((botiquin.id, number)):
+                readings.append(reading)
+            if activity is not None:
+                activity.observe(medicine.current_weight, weight, medicine.initial_weight, elapsed)
+            
+            if build_results:
+                results.append({
+                    "compartment": compartment_number,
+                    "medicine": medicine.medicine_name or "No asignado",
+                    "old_weight": medicine.current_weight,
+                    "new_weight": medicine.current_weight,
+                    "old_quantity": medicine.quantity,
+                    "new_quantity": medicine.quantity,
+                    "quantity_change": 0,
+                    "status": stock_status(medicine.current_weight, medicine.initial_weight, medicine.expiry_date),
+                    "unchanged": True
+                })
+            continue
+        _reset_unchanged_readings((botiquin.id, number))
+        
+        # Note: unit_weight is not updated from hardware data
+        # It will be set by admin when assigning medicine names.
+        # Same rules as Medicine.update_from_sensor: initial weight is set on
+        # the first scan and the name only changes when hardware sends one.
+        initial_weight = medicine.initial_weight if medicine.initial_weight is not None else weight
+        writes[number] = compartment_row(botiquin.id, number, medicine_name, initial_weight, weight, now)
+        
+        readings.append(reading)
+        if activity is not None:
+            activity.observe(medicine.current_weight, weight, initial_weight, elapsed)
+        
+        if build_results:
+            results.append({
+                "compartment": compartment_number,
+                "medicine": medicine_name or medicine.medicine_name or "No asignado",
+                "old_weight": medicine.current_weight,
+                "new_weight": weight,
+                "old_quantity": medicine.quantity,
+                "new_quantity": medicine.quantity,
+                "quantity_change": 0,
+                "status": stock_status(weight, initial_weight, medicine.expiry_date)
+            })
+
+    # Create or update every reported compartment (one statement on the Core path)
+    compartments = write_compartments(list(writes.values()), medicines)
+    if written is not None:
+        written.update(compartments)
+    
+    # Update botiquin sync timestamp and server_seq (claim_report already advanced the kit's seq)
+    server_seq = mark_synced(botiquin, now)
+
+    return results, errors, server_seq
+
+
+def sensor_ack(data, errors, server_seq, schedule=None):
+    """
+    Minimal acknowledgement for kits that asked for one instead of
+    sensor_response: "ok" or "partial" (some compartments had errors), the
+    kit's server_seq after this report, the report's own sequence number
+    (the base for the kit's next delta) and, with a schedule, the seconds
+    until the next report.
+    """
+    ack = {"ack": "partial" if errors else "ok", "server_seq": server_seq}
+    if data.seq is not None:
+        ack["seq"] = data.seq
+    if schedule is not None:
+        ack["next"] = schedule["next_in"]
+    return ack
+
+
+def sensor_response(botiquin, results, errors, schedule=None):
+    """Build the JSON response body for an applied sensor payload."""
+    response = {
+        "success": len(errors) == 0,
+        "botiquin": {
+            "id": botiquin.id,
+            "name": botiquin.name,
+            "hardware_id": botiquin.hardware_id
+        },
+        "results": results,
+        "errors": errors if errors else None,
+        "timestamp": datetime.utcnow().isoformat()
+    }
+    if schedule is not None:
+        response["next_report"] = schedule
+    
+    # Add alerts if any medicine has critical or warning status
+    alerts = []
+    for res in results:
+        status = res.get("status")
+        if status in ["OUT_OF_STOCK", "EXPIRED"]:
+            alerts.append({
+                "type": "critical",
+                "message": f"{res.get('medicine')} is {status}"
+            })
+        elif status in ["LOW_STOCK", "EXPIRES_SOON"]:
+            alerts.append({
+                "type": "warning", 
+                "message": f"{res.get('medicine')} is {status}"
+            })
+    if alerts:
+        response["alerts"] = alerts
+    
+    return response
+
+
+def apply_sensor_batch(payloads, acks=None, received_at=None, raise_errors=False):
+    """
+    Apply many /sensor_data payloads in a single transaction.
+
+    Payloads may be SensorPayloads or parsed JSON dicts, which are validated
+    here so one malformed kit only fails its own entry (400 with per-field
+    errors). All hardware_ids are resolved with one query and all reported
+    compartments with one more. Every kit is applied inside its own
+    SAVEPOINT, so a failing kit is rolled back without affecting the
+    others. The log and readings rows of every kit are then written
+    together; when that (or the commit) fails, callers apply each payload
+    in its own transaction with apply_sensor_alone. Commits the transaction and returns one result per payload,
+    in order:
+    {"index": 0, "hardware_id": "BOT001", "status_code": 200, ...sensor_data response}
+    
+    `acks` optionally flags, per payload, kits that asked for a minimal
+    acknowledgement (sensor_ack) instead of the full response, and
+    `received_at` when each payload reached the server (None = now; see
+    apply_sensor_payload). With raise_errors=True a kit's unexpected error
+    is raised instead of answered with a 500 and the transaction is left
+    to the caller, which retries or sets the payload aside itself.
+    """
+    decoded = []
+    for payload in payloads:
+        try:
+            decoded.append(convert_sensor_payload(payload) if payload else None)
+        except PayloadValidationError as e:
+            decoded.append(e)
+    valid = [data for data in decoded if isinstance(data, SensorPayload)]
+    
+    # Resolve every kit and every reported compartment up front (one query each)
+    botiquines = find_kits({data.hardware_id for data in valid})
+    
+    compartment_numbers = set()
+    for data in valid:
+        if data.hardware_id in botiquines:
+            compartment_numbers |= payload_compartment_numbers(data)
+    medicines = load_compartment_medicines(
+        [b.id for b in botiquines.values()], compartment_numbers
+    )
+    
+    kit_results = []
+    logs = []  # (payload row, rejected reading rows), see write_payload_logs
+    readings = []
+    rejected = []
+    
+    for index, (payload, data) in enumerate(zip(payloads, decoded)):
+        ack = bool(acks and acks[index])
+        received = received_at[index] if received_at else None
+        if data is None:
+            kit_results.append({"index": index, "status_code": 400, "error": "No data provided"})
+            continue
+        
+        if isinstance(data, PayloadValidationError):
+            hardware_id = payload.get("hardware_id") if isinstance(payload, dict) else None
+            logs.append((hardware_log_row(
+                raw_data=encode_json(payload),
+                sensor_type="unknown",
+                error_message=f"Invalid payload: {data}"
+            ), []))
+            kit_results.append({
+                "index": index,
+                "hardware_id": hardware_id if isinstance(hardware_id, str) else None,
+                "status_code": 400,
+                "error": "Invalid sensor payload",
+                "errors": data.errors
+            })
+            continue
+        
+        hardware_id = data.hardware_id
+        log_entry = hardware_log_row(
+            raw_data=encode_json(data),
+            sensor_type="unknown" if data.sensor_type is None else data.sensor_type
+        )
+        if received is not None:
+            log_entry["created_at"] = received
+        
+        botiquin = botiquines.get(hardware_id)
+        if not botiquin:
+            if unknown_device_log(log_entry, hardware_id):
+                logs.append((log_entry, []))
+            kit_results.append({
+                "index": index,
+                "hardware_id": hardware_id,
+                "status_code": 404,
+                "error": f"Botiquin not found for hardware_id: {hardware_id}"
+            })
+            continue
+        
+        log_entry["botiquin_id"] = botiquin.id
+        
+        comp_logs = []
+        comp_readings = []
+        activity = ReportActivity()
+        written = {}
+        try:
+            with db.session.begin_nested():
+                results, errors, server_seq = apply_sensor_payload(
+                    data, botiquin, medicines, comp_logs, comp_readings, build_results=not ack,
+                    activity=activity, written=written, received_at=received
+                )
+        except DuplicateReport as e:
+            # A retry of an applied report: answered, but not written or logged again
+            kit_results.append({
+                "index": index, "hardware_id": hardware_id, "status_code": 200,
+                **(e.ack() if ack else e.response())
+            })
+            continue
+        except DeltaGapError as e:
+            log_entry["error_message"] = str(e)
+            logs.append((log_entry, []))
+            kit_results.append({"index": index, "hardware_id": hardware_id, "status_code": 409, **e.response()})
+            continue
+        except Exception as e:
+            if raise_errors:
+                raise
+            log_entry["error_message"] = str(e)
+            logs.append((log_entry, []))
+            kit_results.append({
+                "index": index,
+                "hardware_id": hardware_id,
+                "status_code": 500,
+                "error": f"Processing error: {str(e)}"
+            })
+            continue
+        
+        # A kit reported again later in the batch sees what this payload wrote
+        for key, compartment in written.items():
+            if not isinstance(compartment, Medicine):
+                compartment = applied_compartment(medicines.get(key), compartment)
+            medicines[key] = compartment
+        
+        log_entry["processed"] = True
+        logs.append((log_entry, comp_logs))
+        readings.extend(comp_readings)
+        rejected.extend(comp_logs)
+        
+        kit_result = {"index": index, "hardware_id": hardware_id, "status_code": 200}
+        schedule = next_report(hardware_id, activity)
+        kit_result.update(
+            sensor_ack(data, errors, server_seq, schedule) if ack else sensor_response(botiquin, results, errors, schedule)
+        )
+        kit_results.append(kit_result)
+    
+    write_payload_logs(logs)
+    write_compartment_readings(readings, rejected)
+    db.session.commit()
+    
+    return kit_results
+
+
+def apply_sensor_alone(payload, ack=False) -> dict:
+    """
+    Apply one payload in its own transaction (see apply_sensor_batch), for
+    callers whose shared transaction failed. Returns its result, a 500 if
+    even this fails, with the in-memory counters it moved reverted.
+    """
+    with counter_undo() as undo:
+        try:
+            return apply_sensor_batch([payload], [ack])[0]
+        except Exception as e:
+            db.session.rollback()
+            undo.restore()
+            return {"status_code": 500, "error": f"Processing error: {str(e)}"}
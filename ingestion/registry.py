@@ -0,0 +1,240 @@
+"""
+In-process registry of hardware kits for the hardware endpoints.
+
+Resolving a hardware_id is the first thing sensor_data, test_connection and
+register_hardware do, and kits ping constantly. The registry keeps a small
+hardware_id -> KitEntry map per worker so that traffic does not hit
+`botiquines` just to identify a device:
+
+- Entries are loaded lazily (one IN (...) query for all misses) and expire
+  after HARDWARE_REGISTRY_TTL seconds
+- hardware_ids that matched no kit are remembered too (a bounded TTL set,
+  HARDWARE_REGISTRY_NEGATIVE_TTL), so a misconfigured or decommissioned
+  device that keeps posting does not query the database on every request
+- Routes that create, update or delete kits call invalidate_kits()
+- Invalidation reaches the other gunicorn workers through a generation file
+  (HARDWARE_REGISTRY_SYNC_FILE): invalidating replaces the file and every
+  worker compares its inode/mtime with one stat() per lookup, dropping its
+  whole cache when it changed
+
+Workers on one host share the default file in the temp directory. With
+several hosts point HARDWARE_REGISTRY_SYNC_FILE at a shared volume, or rely
+on the TTL to bound how long another host serves a stale entry.
+"""
+
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict, namedtuple
+
+from flask import current_app
+from sqlalchemy import select
+
+from db import db
+from models.models import Botiquin
+
+EXTENSION_KEY = "hardware_registry"
+
+_registry_lock = threading.Lock()
+
+# What the hardware endpoints need to know about a kit; attribute names match Botiquin
+KitEntry = namedtuple("KitEntry", [
+    "id", "hardware_id", "name", "total_compartments", "active", "company_id",
+    "deadband_grams", "deadband_percent"
+])
+
+_ENTRY_COLUMNS = [Botiquin.__table__.c[name] for name in KitEntry._fields]
+
+
+def default_sync_file():
+    return os.path.join(tempfile.gettempdir(), "vitalstock-hardware-registry.gen")
+
+
+class DeviceRegistry:
+    """
+    TTL cache of KitEntry by hardware_id, shared by the threads of one worker.
+    """
+
+    def __init__(self, ttl=60.0, sync_file=None, negative_ttl=60.0, max_unknown=10000):
+        self.ttl = max(0.0, float(ttl))
+        self.sync_file = sync_file or default_sync_file()
+        self.negative_ttl = max(0.0, float(negative_ttl))
+        self.max_unknown = max(1, int(max_unknown))
+
+        self._lock = threading.Lock()
+        self._entries = {}  # hardware_id -> (KitEntry, expires_at)
+        self._unknown = OrderedDict()  # hardware_id -> expires_at, oldest first
+        self._epoch = 0  # Bumped on every invalidation seen by this worker
+        self._generation = self._read_generation()
+
+        # Metrics
+        self._hits = 0
+        self._negative_hits = 0
+        self._misses = 0
+        self._loads = 0
+        self._invalidations = 0
+
+    def get(self, hardware_id):
+        """Return the KitEntry for a hardware_id, or None if no kit uses it."""
+        return self.get_many([hardware_id]).get(hardware_id)
+
+    def get_many(self, hardware_ids) -> dict:
+        """
+        Resolve hardware_ids, querying only the ones not cached.
+        Returns {hardware_id: KitEntry} for the ids that belong to a kit.
+        Must be called inside an app context.
+        """
+        self._sync()
+        found = {}
+        missing = []
+        known_unknown = 0
+        now = time.monotonic()
+        with self._lock:
+            for hardware_id in hardware_ids:
+                cached = self._entries.get(hardware_id)
+                if cached is not None and cached[1] > now:
+                    found[hardware_id] = cached[0]
+                elif self._unknown.get(hardware_id, 0) > now:
+                    known_unknown += 1
+                else:
+                    missing.append(hardware_id)
+            self._hits += len(found)
+            self._negative_hits += known_unknown
+            self._misses += len(missing)
+            epoch = self._epoch
+
+        if missing:
+            rows = db.session.execute(
+                select(*_ENTRY_COLUMNS).where(Botiquin.__table__.c.hardware_id.in_(missing))
+            ).all()
+            loaded = {row.hardware_id: KitEntry(*row) for row in rows}
+            found.update(loaded)
+            now = time.monotonic()
+            with self._lock:
+                self._loads += 1
+                # Rows read before a concurrent invalidation may already be stale
+                if epoch == self._epoch:
+                    for hardware_id, entry in loaded.items():
+                        self._entries[hardware_id] = (entry, now + self.ttl)
+                        self._unknown.pop(hardware_id, None)
+                    if self.negative_ttl:
+                        for hardware_id in missing:
+                            if hardware_id not in loaded:
+                                self._remember_unknown(hardware_id, now + self.negative_ttl)
+        return found
+
+    def invalidate(self, hardware_ids=None):
+        """
+        Forget the given hardware_ids (or every entry) in this worker and
+        signal the other workers to drop their caches.
+        """
+        with self._lock:
+            if hardware_ids is None:
+                self._entries.clear()
+                self._unknown.clear()
+            else:
+                for hardware_id in hardware_ids:
+                    self._entries.pop(hardware_id, None)
+                    self._unknown.pop(hardware_id, None)
+            self._epoch += 1
+            self._invalidations += 1
+        self._bump_generation()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "ttl_seconds": self.ttl,
+                "negative_ttl_seconds": self.negative_ttl,
+                "sync_file": self.sync_file,
+                "entries": len(self._entries),
+                "unknown_entries": len(self._unknown),
+                "hits": self._hits,
+                "negative_hits": self._negative_hits,
+                "misses": self._misses,
+                "loads": self._loads,
+                "invalidations": self._invalidations
+            }
+
+    def _remember_unknown(self, hardware_id, expires_at):
+        # Bounded so a flood of random ids cannot grow the worker without limit
+        self._unknown.pop(hardware_id, None)
+        self._unknown[hardware_id] = expires_at
+        while len(self._unknown) > self.max_unknown:
+            self._unknown.popitem(last=False)
+
+    # --- Cross-worker signal ---
+
+    def _read_generation(self):
+        try:
+            st = os.stat(self.sync_file)
+        except OSError:
+            return None
+        return (st.st_ino, st.st_mtime_ns)
+
+    def _sync(self):
+        generation = self._read_generation()
+        if generation == self._generation:
+            return
+        with self._lock:
+            self._generation = generation
+            self._entries.clear()
+            self._unknown.clear()
+            self._epoch += 1
+
+    def _bump_generation(self):
+        # Replace (not rewrite) the file so the inode changes even within one mtime tick
+        directory = os.path.dirname(self.sync_file) or "."
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".registry-")
+            with os.fdopen(fd, "w") as f:
+                f.write(uuid.uuid4().hex)
+            # The generation this worker wrote (a rename keeps inode and
+            # mtime); re-reading the file after the replace could pick up
+            # another worker's newer bump and never drop the cache for it
+            st = os.stat(tmp_path)
+            os.replace(tmp_path, self.sync_file)
+        except OSError as e:
+            # Other workers fall back to the TTL
+            current_app.logger.warning(f"Could not signal hardware registry invalidation: {e}")
+            return
+        with self._lock:
+            self._generation = (st.st_ino, st.st_mtime_ns)
+
+
+def registry_enabled() -> bool:
+    return current_app.config.get("HARDWARE_REGISTRY_TTL", 60) > 0
+
+
+def get_registry(app) -> DeviceRegistry:
+    """Return the app's registry, creating it from app.config on first use."""
+    registry = app.extensions.get(EXTENSION_KEY)
+    if registry is not None:
+        return registry
+    with _registry_lock:
+        registry = app.extensions.get(EXTENSION_KEY)
+        if registry is None:
+            registry = DeviceRegistry(
+                ttl=app.config.get("HARDWARE_REGISTRY_TTL", 60),
+                sync_file=app.config.get("HARDWARE_REGISTRY_SYNC_FILE"),
+                negative_ttl=app.config.get("HARDWARE_REGISTRY_NEGATIVE_TTL", 60)
+            )
+            app.extensions[EXTENSION_KEY] = registry
+    return registry
+
+
+def lookup_kit(hardware_id):
+    """KitEntry (registry enabled) or Botiquin for a hardware_id, or None."""
+    if registry_enabled():
+        return get_registry(current_app).get(hardware_id)
+    return Botiquin.query.filter_by(hardware_id=hardware_id).first()
+
+
+def invalidate_kits(*hardware_ids):
+    """
+    Call after committing a change to kits. With no arguments every cached
+    kit is dropped (bulk changes such as the demo reset).
+    """
+    if registry_enabled():
+        get_registry(current_app).invalidate(list(hardware_ids) or None)
@@ -0,0 +1,139 @@
+"""
+Hourly and daily rollups of compartment readings.
+
+Charts and consumption reports read reading_rollups_hourly /
+reading_rollups_daily (a row per kit, compartment and period with min, max,
+first and last weight, sample and error counts) instead of scanning raw
+readings. The rollups are maintained in the ingestion transaction: the
+readings a request stores are aggregated in memory per period and merged
+into the tables with one upsert per table, so a report costs two extra
+statements, not a row-by-row scan later.
+
+Merging is order-independent: min/max and the counters combine directly,
+and first/last keep the reading with the earliest/latest timestamp, so
+backfilled (older) readings land in the right period without disturbing
+the newest values.
+"""
+
+from sqlalchemy import and_, case, or_
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+
+from db import db
+from models.models import DailyReadingRollup, HourlyReadingRollup
+
+PERIODS = {
+    "hourly": HourlyReadingRollup,
+    "daily": DailyReadingRollup
+}
+
+# Rejected readings of compartments outside the SMALLINT key are not rolled up
+_COMPARTMENT_RANGE = (-32768, 32767)
+
+
+def period_start(ts, period):
+    """Start of the hour or day (UTC) a timestamp falls in."""
+    if period == "hourly":
+        return ts.replace(minute=0, second=0, microsecond=0)
+    return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def aggregate_readings(readings, rejected, period):
+    """
+    Rollup rows (dicts) for compartment_readings rows and rejected
+    hardware_logs rows, one per (botiquin_id, compartment, period_start).
+    """
+    rollups = {}
+
+    def rollup(botiquin_id, compartment, ts):
+        key = (botiquin_id, compartment, period_start(ts, period))
+        row = rollups.get(key)
+        if row is None:
+            row = rollups[key] = {
+                "botiquin_id": botiquin_id, "compartment": compartment, "period_start": key[2],
+                "min_mg": None, "max_mg": None, "first_mg": None, "first_at": None,
+                "last_mg": None, "last_at": None, "samples": 0, "errors": 0
+            }
+        return row
+
+    for reading in readings:
+        mg, ts = reading["weight_mg"], reading["ts"]
+        row = rollup(reading["botiquin_id"], reading["compartment"], ts)
+        row["samples"] += 1
+        if row["min_mg"] is None or mg < row["min_mg"]:
+            row["min_mg"] = mg
+        if row["max_mg"] is None or mg > row["max_mg"]:
+            row["max_mg"] = mg
+        if row["first_at"] is None or ts < row["first_at"]:
+            row["first_mg"], row["first_at"] = mg, ts
+        if row["last_at"] is None or ts >= row["last_at"]:
+            row["last_mg"], row["last_at"] = mg, ts
+
+    for log in rejected:
+        number = log["compartment_number"]
+        if log["botiquin_id"] is None or number is None or \
+                not _COMPARTMENT_RANGE[0] <= number <= _COMPARTMENT_RANGE[1]:
+            continue
+        rollup(log["botiquin_id"], number, log["created_at"])["errors"] += 1
+
+    return list(rollups.values())
+
+
+_rollup_upserts = {}
+
+
+def _rollup_upsert(dialect, model):
+    """
+    INSERT ... ON DUPLICATE KEY UPDATE / ON CONFLICT DO UPDATE merging a
+    partial rollup into a stored one, built once per dialect and table.
+    """
+    stmt = _rollup_upserts.get((dialect, model))
+    if stmt is not None:
+        return stmt
+
+    table = model.__table__
+    if dialect == "mysql":
+        stmt = mysql.insert(table)
+        new = stmt.inserted
+    elif dialect in ("sqlite", "postgresql"):
+        stmt = (sqlite if dialect == "sqlite" else postgresql).insert(table)
+        new = stmt.excluded
+    else:
+        raise NotImplementedError(f"Rollup upsert is not supported on {dialect}")
+
+    old = table.c
+    earlier = and_(new.first_at.isnot(None), or_(old.first_at.is_(None), new.first_at < old.first_at))
+    later = and_(new.last_at.isnot(None), or_(old.last_at.is_(None), new.last_at >= old.last_at))
+    # MySQL applies these in order and later ones see earlier results, so
+    # each *_mg comes before the timestamp its condition reads
+    values = [
+        ("min_mg", case((old.min_mg.is_(None), new.min_mg), (new.min_mg < old.min_mg, new.min_mg),
+                        else_=old.min_mg)),
+        ("max_mg", case((old.max_mg.is_(None), new.max_mg), (new.max_mg > old.max_mg, new.max_mg),
+                        else_=old.max_mg)),
+        ("first_mg", case((earlier, new.first_mg), else_=old.first_mg)),
+        ("first_at", case((earlier, new.first_at), else_=old.first_at)),
+        ("last_mg", case((later, new.last_mg), else_=old.last_mg)),
+        ("last_at", case((later, new.last_at), else_=old.last_at)),
+        ("samples", old.samples + new.samples),
+        ("errors", old.errors + new.errors)
+    ]
+    if dialect == "mysql":
+        stmt = stmt.on_duplicate_key_update(values)
+    else:
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[old.botiquin_id, old.compartment, old.period_start],
+            set_=dict(values)
+        )
+    _rollup_upserts[(dialect, model)] = stmt
+    return stmt
+
+
+def update_rollups(readings, rejected=()):
+    """Merge stored readings and rejected readings into the hourly and daily rollups."""
+    if not readings and not rejected:
+        return
+    dialect = db.engine.dialect.name
+    for period, model in PERIODS.items():
+        rows = aggregate_readings(readings, rejected, period)
+        if rows:
+            db.session.execute(_rollup_upsert(dialect, model), rows)
@@ -0,0 +1,151 @@
+"""
+Server-driven reporting schedule for hardware kits.
+
+sensor_data and test_connection responses tell each kit when to report
+next, so kits stop reporting on fixed schedules that all fire at the top of
+the minute:
+
+- interval: HARDWARE_REPORT_INTERVAL scaled by how fast the kit's weights
+  moved since their previous reading (busy kits report more often, idle
+  ones back off) and halved while a compartment is close to a stock
+  threshold
+- load: when this worker sees more reports per second than
+  HARDWARE_REPORT_TARGET_RATE, every interval is stretched by the overshoot
+  so the fleet backs off until the rate is flat again
+- offset: a stable per-device phase (hash of hardware_id) inside the
+  interval, so kits with the same interval are spread evenly over it
+
+Intervals are clamped to HARDWARE_REPORT_INTERVAL_MIN/_MAX. `next_in` is
+the number of seconds until the kit's next slot, for kits without a clock.
+"""
+
+import math
+import threading
+import time
+import zlib
+
+from flask import current_app
+
+EXTENSION_KEY = "hardware_report_load"
+
+# Stock percentages where a compartment's status changes (see stock_status)
+_STATUS_THRESHOLDS = (20, 75)
+_THRESHOLD_MARGIN = 5
+
+# (share of capacity moved per base interval, interval factor), checked in order
+_ACTIVITY_FACTORS = ((0.10, 0.25), (0.02, 0.5), (0.005, 1.0))
+_IDLE_FACTOR = 4.0
+# Shortest time a movement is spread over, so back-to-back reports are not read as a burst
+_MIN_ELAPSED = 1.0
+
+_load_lock = threading.Lock()
+
+
+class ReportActivity:
+    """
+    How fast a kit's weights moved in one report; filled by
+    apply_sensor_payload. `rate` is the largest share of capacity moved per
+    second since a compartment's previous reading; `change` the largest
+    share moved where that time is unknown, taken as one base interval.
+    """
+
+    __slots__ = ("rate", "change", "near_threshold")
+
+    def __init__(self):
+        self.rate = 0.0
+        self.change = 0.0
+        self.near_threshold = False
+
+    def observe(self, old_weight, new_weight, initial_weight, elapsed=None):
+        """`elapsed`: seconds since old_weight was read, when known."""
+        if new_weight is None or not initial_weight or initial_weight <= 0:
+            return
+        if old_weight is not None:
+            moved = abs(new_weight - old_weight) / initial_weight
+            if elapsed is None:
+                self.change = max(self.change, moved)
+            else:
+                self.rate = max(self.rate, moved / max(elapsed, _MIN_ELAPSED))
+        percentage = new_weight / initial_weight * 100
+        if any(abs(percentage - threshold) <= _THRESHOLD_MARGIN for threshold in _STATUS_THRESHOLDS):
+            self.near_threshold = True
+
+
+class LoadMeter:
+    """Reports per second seen by this worker over a sliding window of 1s buckets."""
+
+    def __init__(self, window=10):
+        self.window = window
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    def record(self, now=None):
+        second = int(now if now is not None else time.monotonic())
+        with self._lock:
+            self._buckets[second] = self._buckets.get(second, 0) + 1
+            for old in [s for s in self._buckets if s <= second - self.window]:
+                del self._buckets[old]
+
+    def rate(self, now=None) -> float:
+        second = int(now if now is not None else time.monotonic())
+        with self._lock:
+            recent = sum(n for s, n in self._buckets.items() if s > second - self.window)
+        return recent / self.window
+
+
+def get_load_meter(app) -> LoadMeter:
+    meter = app.extensions.get(EXTENSION_KEY)
+    if meter is None:
+        with _load_lock:
+            meter = app.extensions.setdefault(EXTENSION_KEY, LoadMeter())
+    return meter
+
+
+def report_interval(activity=None, load=0.0) -> float:
+    """Seconds between reports for a kit given its last report's activity and the load factor."""
+    config = current_app.config
+    base = config.get("HARDWARE_REPORT_INTERVAL", 60)
+    interval = base
+
+    if activity is not None:
+        moved = max(activity.rate * base, activity.change)
+        factor = _IDLE_FACTOR
+        for change, activity_factor in _ACTIVITY_FACTORS:
+            if moved >= change:
+                factor = activity_factor
+                break
+        interval *= factor
+        if activity.near_threshold:
+            interval = min(interval, base / 2)
+
+    if load > 1:
+        interval *= load
+
+    return min(max(interval, config.get("HARDWARE_REPORT_INTERVAL_MIN", 15)),
+               config.get("HARDWARE_REPORT_INTERVAL_MAX", 900))
+
+
+def next_report(hardware_id, activity=None) -> dict:
+    """
+    Schedule for a kit's next report: {"interval", "offset", "next_in"} in
+    seconds. Counts the current request towards this worker's load.
+    """
+    meter = get_load_meter(current_app._get_current_object())
+    meter.record()
+    target = current_app.config.get("HARDWARE_REPORT_TARGET_RATE", 20)
+    load = meter.rate() / target if target > 0 else 0.0
+
+    interval = report_interval(activity, load)
+    offset = (zlib.crc32(hardware_id.encode("utf-8")) % 1000) / 1000 * interval
+
+    # Next slot on the kit's phase, at least half an interval away
+    now = time.time()
+    slot = offset + math.ceil((now - offset) / interval) * interval
+    if slot - now < interval / 2:
+        slot += interval
+
+    return {
+        "interval": round(interval, 1),
+        "offset": round(offset, 1),
+        "next_in": round(slot - now, 1)
+    }
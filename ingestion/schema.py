@@ -0,0 +1,145 @@
+"""
+Typed schema of /api/hardware/sensor_data payloads (msgspec Structs).
+
+The decoders are built once at import time and turn request bytes (or the
+dicts of batch requests and binary frames) into typed objects in a single
+pass, replacing hand-written .get() chains and float() try/except blocks.
+
+Validation mirrors what ingestion always accepted: numbers sent as strings
+are coerced, and a compartment without a number or weight stays a
+per-compartment error instead of rejecting the whole payload. Values of the
+wrong type are rejected with the offending field, e.g.
+{"field": "$.compartments[1].weight", "error": "Expected `float`, got `str`"}.
+
+Backfill requests (/api/hardware/backfill) carry many timestamped readings
+of one kit; their timestamps are required and parsed into datetimes (ISO
+8601 strings or unix seconds).
+"""
+
+from datetime import datetime
+from typing import Optional
+
+import msgspec
+
+
+MAX_IDEMPOTENCY_KEY_LENGTH = 128
+
+
+class CompartmentReading(msgspec.Struct, omit_defaults=True):
+    compartment: Optional[int] = None
+    weight: Optional[float] = None
+    unit: Optional[str] = None
+    medicine_name: Optional[str] = None  # Optional - can be assigned by admin instead
+    average_weight: Optional[float] = None
+    unit_weight: Optional[float] = None
+
+
+class UnitPayload(msgspec.Struct, omit_defaults=True):
+    average_weight: Optional[float] = None
+    unit_weight: Optional[float] = None
+
+
+class SensorPayload(msgspec.Struct, omit_defaults=True):
+    hardware_id: str
+    compartments: list[CompartmentReading]
+    sensor_type: Optional[str] = None
+    timestamp: Optional[str] = None
+    unit_payload: Optional[UnitPayload] = None
+    # Kit's report sequence number; with base_seq the payload is a delta that
+    # only carries the compartments changed since report `base_seq`
+    seq: Optional[int] = None
+    base_seq: Optional[int] = None
+    # Changes whenever the kit restarts its seq counter (boot counter or random nonce)
+    boot_id: Optional[int] = None
+    # Opaque retry key for kits without a counter (or the Idempotency-Key header)
+    idempotency_key: Optional[str] = None
+
+    @property
+    def is_delta(self) -> bool:
+        return self.base_seq is not None
+
+    def __post_init__(self):
+        if self.base_seq is not None and self.seq is None:
+            raise ValueError("A delta payload (base_seq) needs its own seq")
+        if self.idempotency_key is not None and not 0 < len(self.idempotency_key) <= MAX_IDEMPOTENCY_KEY_LENGTH:
+            raise ValueError(f"idempotency_key must be 1 to {MAX_IDEMPOTENCY_KEY_LENGTH} characters")
+
+
+class BackfillReading(msgspec.Struct, omit_defaults=True):
+    """One buffered report: when the kit measured it and what it measured."""
+    timestamp: datetime
+    compartments: list[CompartmentReading]
+    sensor_type: Optional[str] = None
+
+
+class BackfillPayload(msgspec.Struct, omit_defaults=True):
+    hardware_id: str
+    readings: list[BackfillReading]
+    sensor_type: Optional[str] = None  # Default for readings without their own
+
+
+class PayloadValidationError(ValueError):
+    """
+    The payload does not match the schema. `errors` lists the problems as
+    {"field": "$.path", "error": "..."} dicts.
+    """
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__("; ".join(f"{e['field']}: {e['error']}" for e in errors))
+
+
+_json_decoder = msgspec.json.Decoder(SensorPayload, strict=False)
+_backfill_decoder = msgspec.json.Decoder(BackfillPayload, strict=False)
+_json_encoder = msgspec.json.Encoder()
+
+
+def _field_errors(exc):
+    # msgspec reports "<message> - at `$.path`" ("at" is omitted for the root)
+    message, _, path = str(exc).rpartition(" - at ")
+    if not message:
+        message, path = str(exc), "$"
+    path = path.strip("`")
+    missing = message.partition("Object missing required field ")[2]
+    if missing:
+        return [{"field": f"{path}.{missing.strip('`')}", "error": "Missing required field"}]
+    return [{"field": path, "error": message}]
+
+
+def decode_sensor_payload(body: bytes) -> SensorPayload:
+    """Decode and validate a JSON body. Raises PayloadValidationError."""
+    try:
+        return _json_decoder.decode(body)
+    except msgspec.ValidationError as e:
+        raise PayloadValidationError(_field_errors(e)) from None
+    except msgspec.DecodeError as e:
+        raise PayloadValidationError([{"field": "$", "error": f"Invalid JSON: {e}"}]) from None
+
+
+def decode_backfill_payload(body: bytes) -> BackfillPayload:
+    """Decode and validate a backfill JSON body. Raises PayloadValidationError."""
+    try:
+        return _backfill_decoder.decode(body)
+    except msgspec.ValidationError as e:
+        raise PayloadValidationError(_field_errors(e)) from None
+    except msgspec.DecodeError as e:
+        raise PayloadValidationError([{"field": "$", "error": f"Invalid JSON: {e}"}]) from None
+
+
+def convert_sensor_payload(data) -> SensorPayload:
+    """
+    Validate an already parsed payload (a dict from a batch request or a
+    binary frame). SensorPayload instances are returned as is.
+    Raises PayloadValidationError.
+    """
+    if isinstance(data, SensorPayload):
+        return data
+    try:
+        return msgspec.convert(data, SensorPayload, strict=False)
+    except msgspec.ValidationError as e:
+        raise PayloadValidationError(_field_errors(e)) from None
+
+
+def encode_json(value) -> str:
+    """JSON text of a payload, for hardware_logs (stored compressed, see compress_payload)."""
+    return _json_encoder.encode(value).decode("utf-8")
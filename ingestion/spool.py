@@ -0,0 +1,527 @@
+"""
+Disk-backed write-ahead spool for sensor payloads during database outages.
+
+With HARDWARE_SPOOL_DIR set, /api/hardware/sensor_data keeps accepting
+readings while MySQL is down or slow:
+
+- when processing a payload fails because the database cannot be reached,
+  or a request's database work took longer than
+  HARDWARE_SPOOL_LATENCY_BUDGET_MS, the spool engages: that payload and
+  every following one (so kits keep their order) is appended to a local
+  journal and answered with 202
+- a background replayer drains the journal into the database in journal
+  order, in batches through apply_sensor_batch, retrying every
+  HARDWARE_SPOOL_RETRY_INTERVAL seconds while the database is unavailable;
+  once the journal is empty and the database answers within budget the
+  spool disengages and requests go straight to the database again
+- replayed readings are stamped with the time their record was journaled,
+  not the time of the replay, so an outage's backlog keeps its timeline
+- a record that fails for any other reason than the database being
+  unavailable (a payload the database rejects) is moved to the slot's
+  `dead-letter.jsonl` with its error instead of blocking the journal
+
+Journal layout: append-only segment files named after their first record
+number (`<n>.seg`), rotated at HARDWARE_SPOOL_SEGMENT_BYTES, holding records
+
+    uint32 length, uint32 crc32, float64 unix time journaled, payload (JSON)
+
+A payload is only acknowledged after an fsync covering its record;
+concurrent appends share one fsync (whoever syncs covers everyone written
+before). The replayer's position is kept in `checkpoint`, replaced
+atomically after each committed batch, and fully replayed segments are
+deleted. A torn record at the end of the journal (crash mid-write) is cut
+off when the spool is opened.
+
+Each gunicorn worker journals into its own slot (`worker-N`, claimed with
+an exclusive flock), so after a restart the new workers drain whatever the
+old ones left behind. Order is kept within a slot only: reports of one kit
+that reached different workers are replayed in the order of each journal,
+not across them (their readings still carry their journal times).
+"""
+
+import fcntl
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+
+from sqlalchemy import exc, text
+
+from db import db
+from ingestion.pipeline import apply_sensor_batch, counter_undo
+from ingestion.schema import decode_sensor_payload, encode_json
+
+EXTENSION_KEY = "hardware_spool"
+
+_RECORD = struct.Struct("<IId")
+_MAX_RECORD_BYTES = 16 * 1024 * 1024
+
+_spool_lock = threading.Lock()
+
+DEAD_LETTER_FILE = "dead-letter.jsonl"
+
+
+def database_unavailable(error) -> bool:
+    """True for errors meaning the database cannot be reached, as opposed to a bad payload."""
+    if isinstance(error, (exc.OperationalError, exc.TimeoutError)):
+        return True
+    return isinstance(error, exc.DBAPIError) and error.connection_invalidated
+
+
+def _read_records(path, offset, limit=None):
+    """
+    Records of a segment from `offset`: [(end_offset, journaled_at, body)].
+    Stops at the end of the file or at the first torn/corrupt record.
+    """
+    records = []
+    with open(path, "rb") as segment:
+        segment.seek(offset)
+        while limit is None or len(records) < limit:
+            header = segment.read(_RECORD.size)
+            if len(header) < _RECORD.size:
+                break
+            length, crc, journaled_at = _RECORD.unpack(header)
+            if length > _MAX_RECORD_BYTES:
+                break
+            body = segment.read(length)
+            if len(body) < length or zlib.crc32(body) != crc:
+                break
+            offset += _RECORD.size + length
+            records.append((offset, journaled_at, body))
+    return records
+
+
+class SensorSpool:
+    """Segmented append-only journal of sensor payloads plus its replayer thread."""
+
+    def __init__(self, app, directory, segment_bytes=16 * 1024 * 1024, latency_budget=1.0,
+                 replay_batch=100, retry_interval=5.0):
+        self.app = app
+        self.root = directory
+        self.segment_bytes = max(1024, int(segment_bytes))
+        self.latency_budget = latency_budget
+        self.replay_batch = max(1, int(replay_batch))
+        self.retry_interval = max(0.01, float(retry_interval))
+
+        self.directory = None
+        self._slot_lock = None
+        self._pid = None
+        self._lock = threading.Lock()       # journal writes, record numbers
+        self._sync_lock = threading.Lock()  # one fsync at a time
+        self._file = None
+        self._segment_size = 0
+        self._next = 0           # number of the next record appended
+        self._synced = 0         # records below this number are on disk
+        self._checkpoint = {"record": 0, "segment": 0, "offset": 0}
+        self._head_time = None   # journaled time of the oldest record not replayed
+
+        self.engaged = False
+        self.reason = None
+        self._engaged_at = 0.0
+        self._thread = None
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+
+        # Metrics
+        self._appended = 0
+        self._replayed = 0
+        self._replay_batches = 0
+        self._replay_failures = 0
+        self._dead_letters = 0
+        self._last_error = None
+        self._last_replay_ms = None
+
+    # --- Request side ---
+
+    def active(self) -> bool:
+        """Whether new payloads must be journaled: the spool is engaged or still has a backlog."""
+        self._ensure_open()
+        return self.engaged or self.pending() > 0
+
+    def engage(self, reason):
+        """Send payloads to the journal until the replayer finds the database healthy again."""
+        self._engaged_at = time.monotonic()
+        self.engaged = True
+        self.reason = reason
+        self._wakeup.set()
+
+    def observe_latency(self, seconds):
+        """Engage when a request's database work took longer than the latency budget."""
+        if self.latency_budget and seconds > self.latency_budget:
+            self.engage(f"Database latency {seconds * 1000:.0f}ms over the {self.latency_budget * 1000:.0f}ms budget")
+
+    def append(self, payload) -> int:
+        """
+        Journal a validated SensorPayload and return its record number once
+        the record is on disk.
+        """
+        self._ensure_open()
+        body = encode_json(payload).encode("utf-8")
+        journaled_at = time.time()
+        record = _RECORD.pack(len(body), zlib.crc32(body), journaled_at) + body
+        with self._lock:
+            if self._segment_size and self._segment_size + len(record) > self.segment_bytes:
+                self._rotate()
+            self._file.write(record)
+            self._file.flush()
+            self._segment_size += len(record)
+            number = self._next
+            self._next += 1
+            self._appended += 1
+            if self._head_time is None:
+                self._head_time = journaled_at
+        self._sync(number + 1)
+        self._wakeup.set()
+        return number
+
+    def pending(self) -> int:
+        return self._next - self._checkpoint["record"]
+
+    def stats(self) -> dict:
+        self._ensure_open()
+        segments = self._segments()
+        size = 0
+        for start in segments:
+            try:
+                size += os.path.getsize(self._segment_path(start))
+            except OSError:
+                pass
+        with self._lock:
+            head_time = self._head_time
+            return {
+                "directory": self.directory,
+                "engaged": self.engaged,
+                "reason": self.reason,
+                "segments": len(segments),
+                "bytes": size,
+                "pending": self.pending(),
+                "lag_seconds": round(time.time() - head_time, 3) if head_time is not None else 0.0,
+                "appended": self._appended,
+                "replayed": self._replayed,
+                "replay_batches": self._replay_batches,
+                "replay_failures": self._replay_failures,
+                "dead_letters": self._dead_letters,
+                "last_replay_ms": self._last_replay_ms,
+                "last_error": self._last_error,
+                "replayer_running": self._thread is not None and self._thread.is_alive()
+            }
+
+    def drain(self, timeout=5.0) -> bool:
+        """Block until the journal is replayed and the spool disengaged. Returns False on timeout."""
+        deadline = time.monotonic() + timeout
+        while self.pending() or self.engaged:
+            if time.monotonic() >= deadline:
+                return False
+            self._wakeup.set()
+            time.sleep(0.01)
+        return True
+
+    def close(self):
+        """Stop the replayer and release the slot (the journal stays on disk)."""
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(5.0)
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            if self._slot_lock is not None:
+                self._slot_lock.close()
+                self._slot_lock = None
+            self._pid = None
+
+    # --- Journal ---
+
+    def _ensure_open(self):
+        # Slots and threads do not survive fork(); open lazily in each gunicorn worker
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._open()
+            self._pid = os.getpid()
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="hardware-spool-replayer", daemon=True)
+            self._thread.start()
+
+    def _open(self):
+        os.makedirs(self.root, exist_ok=True)
+        slot = 0
+        while True:
+            directory = os.path.join(self.root, f"worker-{slot}")
+            os.makedirs(directory, exist_ok=True)
+            lock = open(os.path.join(directory, "lock"), "a")
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                lock.close()
+                slot += 1
+        self._slot_lock = lock
+        self.directory = directory
+
+        checkpoint_path = os.path.join(directory, "checkpoint")
+        if os.path.exists(checkpoint_path):
+            with open(checkpoint_path) as f:
+                self._checkpoint = json.load(f)
+        else:
+            self._checkpoint = {"record": 0, "segment": 0, "offset": 0}
+
+        # Count what is left to replay and cut off a torn tail
+        segments = [s for s in self._segments() if s >= self._checkpoint["segment"]]
+        if segments and segments[0] != self._checkpoint["segment"]:
+            self._checkpoint = {"record": segments[0], "segment": segments[0], "offset": 0}
+        number = self._checkpoint["record"]
+        self._head_time = None
+        end = 0
+        for start in segments:
+            offset = self._checkpoint["offset"] if start == self._checkpoint["segment"] else 0
+            number = max(number, start)
+            records = _read_records(self._segment_path(start), offset)
+            if records and self._head_time is None:
+                self._head_time = records[0][1]
+            number += len(records)
+            end = records[-1][0] if records else offset
+        if segments:
+            path = self._segment_path(segments[-1])
+            if os.path.getsize(path) > end:
+                with open(path, "r+b") as segment:
+                    segment.truncate(end)
+            self._file = open(path, "ab")
+            self._segment_size = end
+        else:
+            self._checkpoint = {"record": number, "segment": number, "offset": 0}
+            self._file = open(self._segment_path(number), "ab")
+            self._segment_size = 0
+            self._fsync_directory()
+        self._next = self._synced = number
+
+    def _segments(self):
+        if not self.directory:
+            return []
+        return sorted(int(name[:-4]) for name in os.listdir(self.directory) if name.endswith(".seg"))
+
+    def _segment_path(self, start):
+        return os.path.join(self.directory, f"{start:020d}.seg")
+
+    def _rotate(self):
+        # Caller holds _lock; records of a closed segment are always on disk
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self._file = open(self._segment_path(self._next), "ab")
+        self._segment_size = 0
+        self._fsync_directory()
+
+    def _sync(self, number):
+        """Make sure records below `number` are on disk, with one fsync for every writer waiting."""
+        with self._sync_lock:
+            if self._synced >= number:
+                return
+            with self._lock:
+                fd = os.dup(self._file.fileno())
+                target = self._next
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            self._synced = target
+
+    def _fsync_directory(self):
+        fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _save_checkpoint(self, checkpoint):
+        path = os.path.join(self.directory, "checkpoint")
+        with open(path + ".tmp", "w") as f:
+            json.dump(checkpoint, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        self._checkpoint = checkpoint
+
+    # --- Replayer ---
+
+    def _run(self):
+        while not self._stopping.is_set():
+            if not self.pending():
+                if self.engaged and time.monotonic() - self._engaged_at >= self.retry_interval:
+                    self._probe()
+                if not self.pending():
+                    self._wakeup.wait(self.retry_interval if self.engaged else 1.0)
+                    self._wakeup.clear()
+                    continue
+            batch = min(self.replay_batch, self.pending())
+            try:
+                try:
+                    self._replay_batch(batch)
+                except Exception as e:
+                    if database_unavailable(e):
+                        raise
+                    self._record_failure(e)
+                    # Retrying would fail the same way: find the record(s) at fault
+                    self._replay_singly(batch)
+            except Exception as e:
+                self._record_failure(e)
+                if database_unavailable(e):
+                    self.engage(f"{type(e).__name__}: {str(e).splitlines()[0]}")
+                self._stopping.wait(self.retry_interval)
+
+    def _record_failure(self, error):
+        with self._lock:
+            self._replay_failures += 1
+            self._last_error = str(error)
+
+    def _pending_records(self, limit):
+        """Up to `limit` records after the checkpoint: ([(journaled_at, body)], checkpoint after them)."""
+        with self._lock:
+            available = min(limit, self._next - self._checkpoint["record"])
+        checkpoint = dict(self._checkpoint)
+        pending = []
+        while len(pending) < available:
+            records = _read_records(
+                self._segment_path(checkpoint["segment"]), checkpoint["offset"], available - len(pending)
+            )
+            for end, journaled_at, body in records:
+                pending.append((journaled_at, body))
+                checkpoint["offset"] = end
+            checkpoint["record"] += len(records)
+            if len(pending) < available:
+                # This segment is exhausted; continue with the next one
+                later = [s for s in self._segments() if s > checkpoint["segment"]]
+                if not later:
+                    break
+                checkpoint["segment"], checkpoint["offset"] = later[0], 0
+                checkpoint["record"] = later[0]
+        return pending, checkpoint
+
+    def _replay_batch(self, limit):
+        """
+        Apply up to `limit` journaled payloads in one transaction and move the
+        checkpoint past them. A kit failing inside the batch fails the whole
+        batch, so no record is counted as replayed without being written.
+        """
+        pending, checkpoint = self._pending_records(limit)
+        if not pending:
+            return
+
+        started = time.perf_counter()
+        with self.app.app_context(), counter_undo() as undo:
+            try:
+                apply_sensor_batch(
+                    [decode_sensor_payload(body) for _, body in pending],
+                    received_at=[
+                        datetime.fromtimestamp(journaled_at, timezone.utc).replace(tzinfo=None)
+                        for journaled_at, _ in pending
+                    ],
+                    raise_errors=True
+                )
+            except Exception:
+                # The records are replayed again: they must not be counted twice
+                db.session.rollback()
+                undo.restore()
+                raise
+            finally:
+                db.session.remove()
+        elapsed = time.perf_counter() - started
+        self._advance(checkpoint, len(pending), elapsed)
+
+    def _replay_singly(self, count):
+        """
+        Replay the next `count` records one per transaction. A record failing
+        for another reason than the database being unavailable goes to the
+        dead-letter file and is skipped.
+        """
+        for _ in range(count):
+            try:
+                self._replay_batch(1)
+            except Exception as e:
+                if database_unavailable(e):
+                    raise
+                pending, checkpoint = self._pending_records(1)
+                if not pending:
+                    return
+                self._dead_letter(pending[0], e)
+                self._advance(checkpoint, 0, None)
+
+    def _dead_letter(self, record, error):
+        journaled_at, body = record
+        entry = {
+            "journaled_at": journaled_at,
+            "failed_at": time.time(),
+            "error": f"{type(error).__name__}: {error}",
+            "payload": body.decode("utf-8", "replace")
+        }
+        with open(os.path.join(self.directory, DEAD_LETTER_FILE), "a") as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        with self._lock:
+            self._dead_letters += 1
+
+    def _advance(self, checkpoint, replayed, elapsed):
+        """Save the checkpoint after replayed (or dead-lettered) records and drop finished segments."""
+        previous_segment = self._checkpoint["segment"]
+        self._save_checkpoint(checkpoint)
+        for start in self._segments():
+            if previous_segment <= start < checkpoint["segment"]:
+                os.remove(self._segment_path(start))
+
+        head = _read_records(self._segment_path(checkpoint["segment"]), checkpoint["offset"], 1)
+        with self._lock:
+            if replayed:
+                self._replayed += replayed
+                self._replay_batches += 1
+                self._last_replay_ms = elapsed * 1000
+                self._last_error = None
+            if self.pending() == 0:
+                self._head_time = None
+            elif head:
+                self._head_time = head[0][1]
+
+    def _probe(self):
+        """Disengage once the database answers a trivial query within budget."""
+        started = time.perf_counter()
+        try:
+            with self.app.app_context():
+                try:
+                    db.session.execute(text("SELECT 1"))
+                finally:
+                    db.session.remove()
+        except Exception as e:
+            with self._lock:
+                self._last_error = str(e)
+            return
+        elapsed = time.perf_counter() - started
+        if not self.latency_budget or elapsed <= self.latency_budget:
+            self.engaged = False
+            self.reason = None
+
+
+def get_spool(app):
+    """Return the app's spool (None unless HARDWARE_SPOOL_DIR is set), creating it on first use."""
+    spool = app.extensions.get(EXTENSION_KEY)
+    if spool is not None or not app.config.get("HARDWARE_SPOOL_DIR"):
+        return spool
+    with _spool_lock:
+        spool = app.extensions.get(EXTENSION_KEY)
+        if spool is None:
+            config = app.config
+            spool = SensorSpool(
+                app,
+                config["HARDWARE_SPOOL_DIR"],
+                segment_bytes=config.get("HARDWARE_SPOOL_SEGMENT_BYTES", 16 * 1024 * 1024),
+                latency_budget=config.get("HARDWARE_SPOOL_LATENCY_BUDGET_MS", 1000) / 1000,
+                replay_batch=config.get("HARDWARE_SPOOL_REPLAY_BATCH", 100),
+                retry_interval=config.get("HARDWARE_SPOOL_RETRY_INTERVAL", 5.0)
+            )
+            app.extensions[EXTENSION_KEY] = spool
+    return spool
@@ -9,7 +9,13 @@ Updated structure includes:
 """
 
 from datetime import datetime, date
+import zlib
 from db import db
+from sqlalchemy import PrimaryKeyConstraint
+from sqlalchemy.dialects import mysql
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.schema import CreateColumn
+from sqlalchemy.orm import foreign, remote
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin
 
@@ -118,6 +124,14 @@ class Botiquin(db.Model):
     
     active = db.Column(db.Boolean, default=True)
     last_sync_at = db.Column(db.DateTime)  # Last hardware sync
+    last_report_seq = db.Column(db.BigInteger, nullable=True)  # Sequence number of the last applied report (deltas, retries)
+    last_idempotency_key = db.Column(db.String(128), nullable=True)  # Idempotency key of the last applied report
+    last_boot_id = db.Column(db.BigInteger, nullable=True)  # boot_id of the last applied report (its seq counter)
+    server_seq = db.Column(db.BigInteger, nullable=False, default=0, server_default="0")  # Reports applied so far; sent in every ack
+    
+    # Sensor dead-band overrides (None = use the global HARDWARE_DEADBAND_* config)
+    deadband_grams = db.Column(db.Float, nullable=True)
+    deadband_percent = db.Column(db.Float, nullable=True)
     
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -140,18 +154,84 @@ class Botiquin(db.Model):
             "total_compartments": self.total_compartments,
             "active": self.active,
             "last_sync_at": self.last_sync_at.isoformat() if self.last_sync_at else None,
+            "last_report_seq": self.last_report_seq,
+            "deadband_grams": self.deadband_grams,
+            "deadband_percent": self.deadband_percent,
             "medicines_count": len(self.medicines),
             "compartments_status": self.get_compartment_status(),
             "created_at": self.created_at.isoformat(),
             "updated_at": self.updated_at.isoformat() if self.updated_at else None
         }
 
+# --- Stock rules shared by the Medicine model and the Core ingestion path ---
+
+def stock_status(current_weight, initial_weight, expiry_date=None) -> str:
+    """
+    Status for the given weights and expiry date (see Medicine.status for the rules).
+    Works on plain values so rows loaded without the ORM get the same answer.
+    """
+    # Check if we have weight data
+    if not current_weight or not initial_weight or initial_weight <= 0:
+        return "OUT_OF_STOCK"
+
+    # Calculate stock percentage based on weight
+    stock_percentage = (current_weight / initial_weight) * 100
+    
+    # Critical stock levels take priority over expiry
+    if stock_percentage <= 0:
+        return "OUT_OF_STOCK"
+    elif stock_percentage <= 20:
+        return "LOW_STOCK"
+
+    # For medicines with good stock, check expiry status
+    if expiry_date:
+        days = (expiry_date - date.today()).days
+        if days < 0:
+            return "EXPIRED"
+        if days <= 7:
+            return "EXPIRES_SOON"
+        if days <= 30:
+            return "EXPIRES_30"
+
+    # Stock level for medicines with good stock and no expiry issues
+    if stock_percentage <= 75:
+        return "GOOD_STOCK"
+    else:
+        return "FULL_STOCK"
+
+
+def reading_in_deadband(current_weight, initial_weight, expiry_date, weight_reading,
+                        deadband_grams=None, deadband_percent=None) -> bool:
+    """
+    True when a reading is within the dead-band of the stored current_weight
+    and would not change the status (see Medicine.in_deadband).
+    """
+    if current_weight is None:
+        return False
+    try:
+        weight_reading = float(weight_reading)
+    except (TypeError, ValueError):
+        return False
+
+    band = max(deadband_grams or 0, abs(current_weight) * (deadband_percent or 0) / 100)
+    if band <= 0 or abs(weight_reading - current_weight) > band:
+        return False
+
+    # Status transitions are always persisted
+    return stock_status(weight_reading, initial_weight, expiry_date) == \
+        stock_status(current_weight, initial_weight, expiry_date)
+
+
 class Medicine(db.Model):
     """
     Medicine inventory in a specific botiquin compartment.
     Enhanced with weight-based quantity calculation and compartment assignment.
     """
     __tablename__ = "medicines"
+    __table_args__ = (
+        # One medicine per compartment; also the conflict target of sensor upserts
+        db.UniqueConstraint("botiquin_id", "compartment_number", name="uq_medicines_botiquin_compartment"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     
@@ -192,11 +272,29 @@ class Medicine(db.Model):
             return calculated_qty
         return self.quantity
     
-    def update_from_sensor(self, weight_reading: float, medicine_name: str = None):
+    def in_deadband(self, weight_reading: float, deadband_grams: float = None,
+                    deadband_percent: float = None) -> bool:
+        """
+        True when a reading is within the dead-band of the stored current_weight
+        and would not change the status, i.e. it is load-cell noise.
+        The band is the larger of the absolute (grams) and percentage limits.
+        """
+        return reading_in_deadband(
+            self.current_weight, self.initial_weight, self.expiry_date,
+            weight_reading, deadband_grams, deadband_percent
+        )
+
+    def update_from_sensor(self, weight_reading: float, medicine_name: str = None,
+                           deadband_grams: float = None, deadband_percent: float = None):
         """
         Update medicine data from sensor reading.
         Called when hardware sends weight data.
+        Readings inside the optional dead-band (see in_deadband) leave the row untouched.
         """
+        if (not medicine_name or medicine_name == self.medicine_name) and \
+                self.in_deadband(weight_reading, deadband_grams, deadband_percent):
+            return self.quantity
+
         # Set initial_weight on first scan if not set
         if self.initial_weight is None:
             self.initial_weight = weight_reading
@@ -243,34 +341,7 @@ class Medicine(db.Model):
         - "GOOD_STOCK" if stock percentage 21-75%
         - "FULL_STOCK" if stock percentage > 75%
         """
-        # Check if we have weight data
-        if not self.current_weight or not self.initial_weight or self.initial_weight <= 0:
-            return "OUT_OF_STOCK"
-
-        # Calculate stock percentage based on weight
-        stock_percentage = (self.current_weight / self.initial_weight) * 100
-        
-        # Critical stock levels take priority over expiry
-        if stock_percentage <= 0:
-            return "OUT_OF_STOCK"
-        elif stock_percentage <= 20:
-            return "LOW_STOCK"
-
-        # For medicines with good stock, check expiry status
-        days = self.days_to_expiry()
-        if days is not None:
-            if days < 0:
-                return "EXPIRED"
-            if days <= 7:
-                return "EXPIRES_SOON"
-            if days <= 30:
-                return "EXPIRES_30"
-
-        # Stock level for medicines with good stock and no expiry issues
-        if stock_percentage <= 75:
-            return "GOOD_STOCK"
-        else:
-            return "FULL_STOCK"
+        return stock_status(self.current_weight, self.initial_weight, self.expiry_date)
     
     def get_status_color(self) -> str:
         """Returns Bootstrap color class based on status"""
@@ -313,36 +384,227 @@ class Medicine(db.Model):
             "updated_at": self.updated_at.isoformat() if self.updated_at else None,
         }
         
+# --- Raw payload storage for HardwareLog ---
+
+# Preset dictionary for payload compression: the keys and values every
+# sensor payload repeats, so even a one-compartment payload compresses well.
+# Streams record the dictionary's Adler-32 in their header; never edit it,
+# add another one and pick it by that id when decompressing.
+_PAYLOAD_DICTIONARY = (
+    b'{"hardware_id":"BOT","backfill_readings":,"timestamp":"2025-09-23T10:00:00",'
+    b'"unit_payload":{"average_weight":},"seq":,"base_seq":,"idempotency_key":"",'
+    b'"sensor_type":"weight","medicine_name":"","average_weight":,"unit_weight":,'
+    b'"compartments":[{"compartment":1,"weight":.0,"unit":"grams"},'
+    b'{"compartment":2,"weight":},{"compartment":3,"weight":},{"compartment":4,"weight":.5,"unit":"grams"}]}'
+)
+
+
+def compress_payload(raw) -> bytes:
+    """zlib stream (with the preset payload dictionary) of a raw payload (str or UTF-8 bytes)."""
+    if isinstance(raw, str):
+        raw = raw.encode("utf-8")
+    compressor = zlib.compressobj(zlib.Z_BEST_COMPRESSION, zdict=_PAYLOAD_DICTIONARY)
+    return compressor.compress(raw) + compressor.flush()
+
+
+def decompress_payload(blob) -> str:
+    """Raw payload text of a compress_payload() stream."""
+    decompressor = zlib.decompressobj(zdict=_PAYLOAD_DICTIONARY)
+    return (decompressor.decompress(blob) + decompressor.flush()).decode("utf-8")
+
+
 class HardwareLog(db.Model):
     """
-    Log of all hardware sensor readings for audit and debugging.
-    Stores raw data received from hardware.
+    Log of hardware payloads for audit and debugging, and of readings that
+    could not be applied. Each payload is stored once, compressed, on its
+    own row; rows of rejected readings point at that row (payload_log_id).
+    Applied compartment readings live in CompartmentReading.
+    With HARDWARE_LOG_PARTITIONS the table is split by month of created_at
+    and read through ingestion/log_partitions.py.
     """
     __tablename__ = "hardware_logs"
     
-    id = db.Column(db.Integer, primary_key=True)
-    botiquin_id = db.Column(db.Integer, db.ForeignKey('botiquines.id'), nullable=False, index=True)
+    # Primary key (id, created_at): MySQL wants the partitioning column in
+    # every unique key. SQLite keys on id alone (see _sqlite_rowid).
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    # Nullable so payloads that never resolved to a kit can still be logged.
+    # No FK: MySQL cannot partition a table with foreign keys (see ingestion/log_partitions.py)
+    botiquin_id = db.Column(db.Integer, nullable=True, index=True)
     
     # Raw data from hardware
     compartment_number = db.Column(db.Integer)
     weight_reading = db.Column(db.Float)
     sensor_type = db.Column(db.String(30))  # 'weight', 'door', 'infrared'
-    raw_data = db.Column(db.Text)  # JSON string of complete payload
+    raw_data = db.Column(db.Text)  # JSON string of complete payload (rows written before raw_payload)
+    raw_payload = db.Column(db.LargeBinary().with_variant(mysql.MEDIUMBLOB(), "mysql"))  # Complete payload, compress_payload()
+    # Row holding the payload this row's reading came from (no FK: log rows are pruned in bulk)
+    payload_log_id = db.Column(db.Integer, nullable=True, index=True)
     
     processed = db.Column(db.Boolean, default=False)
     error_message = db.Column(db.Text)
+    # Requests this row stands for (repeated errors from one device are aggregated)
+    occurrences = db.Column(db.Integer, default=1, nullable=False)
     
-    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, primary_key=True)
+    
+    payload_log = db.relationship(
+        "HardwareLog",
+        primaryjoin=lambda: foreign(HardwareLog.payload_log_id) == remote(HardwareLog.id),
+        uselist=False,
+        viewonly=True,
+        # One IN (...) query per list of rows, not one per row; a payload row
+        # points nowhere, so one level is enough
+        lazy="selectin",
+        join_depth=1
+    )
+    
+    def payload_text(self):
+        """Raw payload of this row, or of the payload row it points at."""
+        return hardware_log_payload_text(self, self.payload_log if self.payload_log_id is not None else None)
     
+    def to_dict(self):
+        return hardware_log_dict(self, self.payload_log if self.payload_log_id is not None else None)
+
+
+def _sqlite_rowid(table):
+    """
+    The id SQLite keys `table` on when its primary key adds columns to an
+    autoincrement id (hardware_logs): SQLite only generates ids for a lone
+    INTEGER PRIMARY KEY, and the id is unique by itself anyway.
+    """
+    id_column = table.autoincrement_column
+    if id_column is not None and len(table.primary_key.columns) > 1:
+        return id_column
+    return None
+
+
+@compiles(CreateColumn, "sqlite")
+def _sqlite_create_column(create, compiler, **kw):
+    column = create.element
+    if column is not _sqlite_rowid(column.table):
+        return compiler.visit_create_column(create, **kw)
+    autoincrement = " AUTOINCREMENT" if column.table.dialect_options["sqlite"]["autoincrement"] else ""
+    return f"{compiler.preparer.format_column(column)} INTEGER NOT NULL PRIMARY KEY{autoincrement}"
+
+
+@compiles(PrimaryKeyConstraint, "sqlite")
+def _sqlite_primary_key(constraint, compiler, **kw):
+    if _sqlite_rowid(constraint.table) is None:
+        return compiler.visit_primary_key_constraint(constraint, **kw)
+    return None  # Declared on the id column
+
+
+def hardware_log_payload_text(log, payload_log=None):
+    """
+    Raw payload of a hardware_logs row, or of `payload_log` (the row its
+    payload_log_id points at). Works on plain rows too, so logs read from a
+    month table (see ingestion/log_partitions.py) show the same text.
+    """
+    if log.raw_payload is not None:
+        return decompress_payload(log.raw_payload)
+    if log.raw_data is not None:
+        return log.raw_data
+    if payload_log is not None:
+        return hardware_log_payload_text(payload_log)
+    return None
+
+
+def hardware_log_dict(log, payload_log=None):
+    """API representation of a hardware_logs row (HardwareLog or a plain row)."""
+    return {
+        "id": log.id,
+        "botiquin_id": log.botiquin_id,
+        "compartment_number": log.compartment_number,
+        "weight_reading": log.weight_reading,
+        "sensor_type": log.sensor_type,
+        "raw_data": hardware_log_payload_text(log, payload_log),
+        "payload_log_id": log.payload_log_id,
+        "processed": log.processed,
+        "error_message": log.error_message,
+        "occurrences": log.occurrences,
+        "created_at": log.created_at.isoformat()
+    }
+
+
+class CompartmentReading(db.Model):
+    """
+    Time series of compartment weights reported by the hardware: one narrow
+    row per reading, weight in integer milligrams.
+    The primary key (botiquin_id, compartment, ts) is the clustered index on
+    InnoDB, so a compartment's history is stored contiguously in time order.
+    HardwareLog keeps payload-level audit rows and errors.
+    """
+    __tablename__ = "compartment_readings"
+    # SQLite: store rows in primary key order too, without a separate rowid b-tree
+    __table_args__ = {"sqlite_with_rowid": False}
+
+    botiquin_id = db.Column(db.Integer, db.ForeignKey("botiquines.id", ondelete="CASCADE"),
+                            primary_key=True, autoincrement=False)
+    compartment = db.Column(db.SmallInteger, primary_key=True, autoincrement=False)
+    # Microseconds on MySQL too, so reports within one second keep their own rows
+    ts = db.Column(db.DateTime().with_variant(mysql.DATETIME(fsp=6), "mysql"), primary_key=True)
+    weight_mg = db.Column(db.Integer, nullable=False)
+
+    @property
+    def weight(self):
+        """Weight in grams, as reported."""
+        return self.weight_mg / 1000
+
     def to_dict(self):
         return {
-            "id": self.id,
             "botiquin_id": self.botiquin_id,
-            "compartment_number": self.compartment_number,
-            "weight_reading": self.weight_reading,
-            "sensor_type": self.sensor_type,
-            "raw_data": self.raw_data,
-            "processed": self.processed,
-            "error_message": self.error_message,
-            "created_at": self.created_at.isoformat()
+            "compartment": self.compartment,
+            "weight": self.weight,
+            "timestamp": self.ts.isoformat()
+        }
+
+
+class ReadingRollup:
+    """
+    Columns of the reading rollups: per kit, compartment and period, the
+    min, max, first and last weight (milligrams), how many readings were
+    stored and how many of the compartment's readings were rejected.
+    Maintained incrementally by ingestion (see ingestion/rollups.py).
+    """
+    __table_args__ = {"sqlite_with_rowid": False}
+
+    botiquin_id = db.Column(db.Integer, db.ForeignKey("botiquines.id", ondelete="CASCADE"),
+                            primary_key=True, autoincrement=False)
+    compartment = db.Column(db.SmallInteger, primary_key=True, autoincrement=False)
+    # Start of the period (UTC): the hour, or midnight of the day
+    period_start = db.Column(db.DateTime, primary_key=True)
+
+    min_mg = db.Column(db.Integer, nullable=True)  # Weights are NULL for a period with only errors
+    max_mg = db.Column(db.Integer, nullable=True)
+    first_mg = db.Column(db.Integer, nullable=True)
+    first_at = db.Column(db.DateTime().with_variant(mysql.DATETIME(fsp=6), "mysql"), nullable=True)
+    last_mg = db.Column(db.Integer, nullable=True)
+    last_at = db.Column(db.DateTime().with_variant(mysql.DATETIME(fsp=6), "mysql"), nullable=True)
+    samples = db.Column(db.Integer, default=0, nullable=False)
+    errors = db.Column(db.Integer, default=0, nullable=False)
+
+    def to_dict(self):
+        def grams(mg):
+            return None if mg is None else mg / 1000
+
+        return {
+            "botiquin_id": self.botiquin_id,
+            "compartment": self.compartment,
+            "period_start": self.period_start.isoformat(),
+            "min_weight": grams(self.min_mg),
+            "max_weight": grams(self.max_mg),
+            "first_weight": grams(self.first_mg),
+            "first_at": self.first_at.isoformat() if self.first_at else None,
+            "last_weight": grams(self.last_mg),
+            "last_at": self.last_at.isoformat() if self.last_at else None,
+            "samples": self.samples,
+            "errors": self.errors
         }
+
+
+class HourlyReadingRollup(ReadingRollup, db.Model):
+    __tablename__ = "reading_rollups_hourly"
+
+
+class DailyReadingRollup(ReadingRollup, db.Model):
+    __tablename__ = "reading_rollups_daily"
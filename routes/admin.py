@@ -6,7 +6,11 @@ Only accessible by super admins.
 from flask import Blueprint, request, jsonify
 from datetime import datetime
 from db import db
-from models.models import User, Company, Botiquin, Medicine, HardwareLog
+from models.models import (
+    User, Company, Botiquin, Medicine, CompartmentReading, HourlyReadingRollup, DailyReadingRollup
+)
+from ingestion.log_partitions import clear_logs, count_logs, truncate_logs
+from ingestion.registry import invalidate_kits
 from werkzeug.security import generate_password_hash
 import os
 
@@ -57,8 +61,11 @@ def reset_demo_data():
         # Delete all data in correct order (respecting foreign keys)
         print("Starting demo data reset...")
         
-        # 1. Delete hardware logs
-        HardwareLog.query.delete()
+        # 1. Delete hardware logs and readings (logs are emptied, not deleted row by row)
+        truncate = clear_logs()
+        CompartmentReading.query.delete()
+        HourlyReadingRollup.query.delete()
+        DailyReadingRollup.query.delete()
         print("Deleted hardware logs")
         
         # 2. Delete medicines
@@ -640,6 +647,10 @@ def reset_demo_data():
         
         # Commit all changes
         db.session.commit()
+        invalidate_kits()
+        if truncate:
+            # Partitioned MySQL logs: TRUNCATE commits by itself, so only after the reset did
+            truncate_logs()
         
         print("Demo data reset completed successfully")
         
@@ -681,7 +692,8 @@ def get_demo_status():
             "users": User.query.count(),
             "botiquines": Botiquin.query.count(),
             "medicines": Medicine.query.count(),
-            "hardware_logs": HardwareLog.query.count()
+            "hardware_logs": count_logs(),
+            "compartment_readings": CompartmentReading.query.count()
         }
         
         return jsonify({
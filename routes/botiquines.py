@@ -7,6 +7,7 @@ from flask import Blueprint, request, jsonify
 from datetime import datetime
 from db import db
 from models.models import Botiquin, Company, Medicine
+from ingestion.registry import invalidate_kits
 
 bp = Blueprint("botiquines", __name__)
 
@@ -36,8 +37,20 @@ def validate_botiquin_payload(data, partial=False):
         except (TypeError, ValueError):
             errors.append("'total_compartments' must be an integer")
     
+    # Validate sensor dead-band overrides (null = use global config)
+    for field in ["deadband_grams", "deadband_percent"]:
+        if field in data and data[field] is not None:
+            try:
+                if float(data[field]) < 0:
+                    errors.append(f"'{field}' must be >= 0")
+            except (TypeError, ValueError):
+                errors.append(f"'{field}' must be a number")
+    
     return (len(errors) == 0, errors)
 
+def _optional_float(value):
+    return float(value) if value is not None else None
+
 # -------- Routes --------
 
 @bp.get("/")
@@ -84,11 +97,14 @@ def create_botiquin():
         location=data.get("location"),
         company_id=company_id,
         total_compartments=int(data.get("total_compartments", 4)),
-        active=data.get("active", True)
+        active=data.get("active", True),
+        deadband_grams=_optional_float(data.get("deadband_grams")),
+        deadband_percent=_optional_float(data.get("deadband_percent"))
     )
     
     db.session.add(botiquin)
     db.session.commit()
+    invalidate_kits(botiquin.hardware_id)
     
     return jsonify(botiquin.to_dict()), 201
 
@@ -179,18 +195,23 @@ def update_botiquin(botiquin_id):
         if existing:
             return jsonify({"error": f"Hardware ID '{data['hardware_id']}' already in use"}), 400
     
+    previous_hardware_id = botiquin.hardware_id
+    
     # Update fields
     fields = ["hardware_id", "name", "location", "company_id", 
-              "total_compartments", "active"]
+              "total_compartments", "active", "deadband_grams", "deadband_percent"]
     
     for field in fields:
         if field in data:
             if field in ["company_id", "total_compartments"]:
                 setattr(botiquin, field, int(data[field]))
+            elif field in ["deadband_grams", "deadband_percent"]:
+                setattr(botiquin, field, _optional_float(data[field]))
             else:
                 setattr(botiquin, field, data[field])
     
     db.session.commit()
+    invalidate_kits(previous_hardware_id, botiquin.hardware_id)
     return jsonify(botiquin.to_dict()), 200
 
 
@@ -207,8 +228,10 @@ def delete_botiquin(botiquin_id):
     # Check if it has medicines
     medicine_count = len(botiquin.medicines)
     
+    hardware_id = botiquin.hardware_id
     db.session.delete(botiquin)
     db.session.commit()
+    invalidate_kits(hardware_id)
     
     return jsonify({
         "message": f"Botiquin deleted successfully",
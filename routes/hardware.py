@@ -3,11 +3,58 @@ Routes for hardware integration.
 Receives sensor data and updates medicine inventory.
 """
 
-from flask import Blueprint, request, jsonify
-from datetime import datetime
-import json
+from flask import Blueprint, request, jsonify, current_app
+from datetime import datetime, timezone
+from io import BytesIO
+import os
+import queue
+import time
 from db import db
-from models.models import Botiquin, Medicine, HardwareLog
+from models.models import Botiquin, CompartmentReading
+from ingestion.pipeline import (
+    DeltaGapError,
+    DuplicateReport,
+    apply_sensor_alone,
+    apply_sensor_batch,
+    apply_sensor_payload,
+    counter_undo,
+    find_kits,
+    hardware_log_row,
+    load_compartment_medicines,
+    payload_compartment_numbers,
+    sensor_ack,
+    sensor_response,
+    unknown_device_log,
+    write_compartment_readings,
+    write_hardware_logs,
+    write_payload_logs,
+)
+from ingestion.async_writer import get_writer
+from ingestion.backfill import apply_backfill
+from ingestion.codec import (
+    BINARY_CONTENT_TYPE,
+    CONTENT_ENCODINGS,
+    PayloadDecodeError,
+    PayloadTooLargeError,
+    decode_sensor_frame,
+    inflate,
+)
+from ingestion.schema import (
+    MAX_IDEMPOTENCY_KEY_LENGTH,
+    PayloadValidationError,
+    convert_sensor_payload,
+    decode_backfill_payload,
+    decode_sensor_payload,
+    encode_json,
+)
+from werkzeug.wsgi import get_input_stream
+from ingestion.group_commit import get_coordinator
+from ingestion.idempotency import get_response_cache, idempotency_key
+from ingestion.log_partitions import query_logs
+from ingestion.registry import get_registry, invalidate_kits, lookup_kit
+from ingestion.rollups import PERIODS as ROLLUP_PERIODS
+from ingestion.schedule import ReportActivity, next_report
+from ingestion.spool import database_unavailable, get_spool
 
 # Expected payload example for sensor updates (MVP assumes 4 compartments minimum):
 # {
@@ -30,6 +77,124 @@ from models.models import Botiquin, Medicine, HardwareLog
 
 bp = Blueprint("hardware", __name__)
 
+# Upper bound on kits accepted in one /batch_sensor_data request
+MAX_BATCH_PAYLOADS = 200
+
+# Upper bound on buffered readings accepted in one /backfill request
+MAX_BACKFILL_READINGS = 1000
+
+# Upper bound on readings returned by one /readings request
+MAX_READINGS_PAGE = 10000
+
+
+@bp.before_request
+def _decompress_request_body():
+    """
+    Accept gzip/deflate request bodies (Content-Encoding) on every hardware
+    endpoint. The body is inflated in chunks up to HARDWARE_MAX_DECOMPRESSED_BYTES
+    and swapped into the WSGI environ, so handlers read it as if it had been
+    sent uncompressed.
+    """
+    encoding = request.headers.get("Content-Encoding", "").strip().lower()
+    if encoding in ("", "identity"):
+        return None
+    if encoding not in CONTENT_ENCODINGS:
+        return jsonify({"error": f"Unsupported Content-Encoding: {encoding}"}), 415
+    
+    environ = request.environ
+    limit = current_app.config.get("HARDWARE_MAX_DECOMPRESSED_BYTES", 2 * 1024 * 1024)
+    try:
+        body = inflate(get_input_stream(environ), encoding, limit)
+    except PayloadTooLargeError as e:
+        return jsonify({"error": str(e)}), 413
+    except PayloadDecodeError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    environ["wsgi.input"] = BytesIO(body)
+    environ["CONTENT_LENGTH"] = str(len(body))
+    environ.pop("HTTP_CONTENT_ENCODING", None)
+    environ.pop("wsgi.input_terminated", None)
+    return None
+
+
+def _sensor_payload(body):
+    """
+    Decode a sensor_data body into a SensorPayload: JSON, or the compact
+    binary frame (see ingestion/codec.py) when sent as
+    application/vnd.vitalstock.sensor. Raises PayloadDecodeError for
+    malformed binary frames and PayloadValidationError for invalid payloads.
+    """
+    if request.mimetype == BINARY_CONTENT_TYPE:
+        return convert_sensor_payload(decode_sensor_frame(body))
+    return decode_sensor_payload(body)
+
+
+def _async_ingest_requested():
+    """
+    Async mode is enabled globally with HARDWARE_ASYNC_INGEST or per request
+    with the standard `Prefer: respond-async` header.
+    """
+    if current_app.config.get("HARDWARE_ASYNC_INGEST"):
+        return True
+    return "respond-async" in request.headers.get("Prefer", "").lower()
+
+
+def _ack_requested():
+    """
+    Kits that ignore the detailed response ask for a minimal acknowledgement
+    with `Prefer: return=minimal` (RFC 7240) or the `?ack=1` query flag.
+    """
+    if request.args.get("ack", "").lower() in ("1", "true"):
+        return True
+    return "return=minimal" in request.headers.get("Prefer", "").lower().replace(" ", "")
+
+
+def _enqueue_sensor_payload(data):
+    """
+    Hand a validated payload to the background writer.
+    Nothing touches the database here; the outcome is looked up by receipt.
+    """
+    writer = get_writer(current_app._get_current_object())
+    try:
+        receipt_id = writer.submit(data)
+    except queue.Full:
+        return jsonify({"error": "Ingestion queue is full, retry later"}), 503
+
+    return jsonify({
+        "status": "accepted",
+        "receipt_id": receipt_id,
+        "status_url": f"{request.script_root}/api/hardware/ingest/receipts/{receipt_id}",
+        "timestamp": datetime.utcnow().isoformat()
+    }), 202
+
+
+def _spool_sensor_payload(spool, data):
+    """
+    Journal a payload while the database is unavailable or slow; the spool's
+    replayer applies it once the database is healthy (see ingestion/spool.py).
+    """
+    try:
+        record = spool.append(data)
+    except OSError as e:
+        return jsonify({"error": f"Database unavailable and the spool cannot be written: {e}"}), 503
+
+    return jsonify({
+        "status": "spooled",
+        "record": record,
+        "pending": spool.pending(),
+        "timestamp": datetime.utcnow().isoformat()
+    }), 202
+
+
+def _group_commit_sensor_payload(data):
+    """
+    Apply the payload through the group commit coordinator and answer with
+    this request's own result, exactly as the plain path would.
+    """
+    kit_result = get_coordinator(current_app._get_current_object()).submit(data, _ack_requested())
+    body = {k: v for k, v in kit_result.items() if k not in ("index", "hardware_id", "status_code")}
+    return jsonify(body), kit_result["status_code"]
+
 
 @bp.post("/sensor_data")
 def receive_sensor_data():
@@ -47,215 +212,441 @@ def receive_sensor_data():
             {"compartment": 3, "weight": 0.0, "unit": "grams"}
         ]
     }
-    """
-    data = request.get_json()
     
-    if not data:
+    Kits may send the same payload as a binary frame instead, with
+    Content-Type: application/vnd.vitalstock.sensor (see ingestion/codec.py).
+    
+    Delta mode: a kit that numbers its reports ("seq") may send only the
+    compartments changed since report N with "base_seq": N. If N is not the
+    last report the server applied, nothing is written and the answer is
+    409 {"code": "RESEND_FULL", ...}; the next report must be a full one.
+    
+    Ack mode: with `Prefer: return=minimal` or `?ack=1` a successful report
+    is answered with {"ack": "ok" | "partial", "server_seq": N, "seq": S,
+    "next": T} only: the kit's count of applied reports, the report's own
+    "seq" (when it sent one) and the seconds until its next report (see
+    sensor_ack).
+    
+    Spool: with HARDWARE_SPOOL_DIR set, payloads that arrive while the
+    database is unreachable or over its latency budget are journaled to
+    disk and answered with 202 {"status": "spooled", ...}.
+    
+    Retries: a report with a "seq", an "idempotency_key" or an
+    Idempotency-Key header is applied once; a retry gets the original
+    response back (Idempotent-Replayed: true) or, when this worker no longer
+    has it, 200 {"duplicate": true, ...} (see ingestion/idempotency.py).
+    """
+    body = request.get_data()
+    if not body:
         return jsonify({"error": "No data provided"}), 400
     
+    try:
+        data = _sensor_payload(body)
+    except PayloadDecodeError as e:
+        return jsonify({"error": f"Invalid binary payload: {e}"}), 400
+    except PayloadValidationError as e:
+        write_hardware_logs([hardware_log_row(
+            raw_data=body.decode("utf-8", "replace"),
+            sensor_type="unknown",
+            error_message=f"Invalid payload: {e}"
+        )])
+        db.session.commit()
+        return jsonify({"error": "Invalid sensor payload", "errors": e.errors}), 400
+    
+    header_key = request.headers.get("Idempotency-Key")
+    if header_key is not None and data.idempotency_key is None:
+        if not 0 < len(header_key) <= MAX_IDEMPOTENCY_KEY_LENGTH:
+            return jsonify({"error": f"Idempotency-Key must be 1 to {MAX_IDEMPOTENCY_KEY_LENGTH} characters"}), 400
+        data.idempotency_key = header_key
+    
+    report_key = idempotency_key(data)
+    if report_key is None:
+        return _receive_sensor_payload(data)
+    
+    # A retry this worker already answered gets the same answer, without a query
+    cache = get_response_cache(current_app._get_current_object())
+    cache_key = (report_key, _ack_requested())
+    cached = cache.get(data.hardware_id, cache_key)
+    if cached is not None:
+        status, content = cached
+        return current_app.response_class(
+            content, status=status, mimetype="application/json", headers={"Idempotent-Replayed": "true"}
+        )
+    
+    response = current_app.make_response(_receive_sensor_payload(data))
+    if response.status_code in (200, 202):
+        cache.put(data.hardware_id, cache_key, response.status_code, response.get_data())
+    return response
+
+
+def _receive_sensor_payload(data):
+    """Apply a decoded sensor_data payload: spool, async, group commit or in this request."""
+    # While the spool holds a backlog, new payloads queue behind it to keep their order
+    spool = get_spool(current_app._get_current_object())
+    if spool is not None and spool.active():
+        return _spool_sensor_payload(spool, data)
+    
+    if _async_ingest_requested():
+        return _enqueue_sensor_payload(data)
+    
+    if current_app.config.get("HARDWARE_GROUP_COMMIT"):
+        return _group_commit_sensor_payload(data)
+    
     # Log raw data for debugging
-    log_entry = HardwareLog(
-        raw_data=json.dumps(data),
-        sensor_type=data.get("sensor_type", "unknown"),
-        created_at=datetime.utcnow()
+    log_entry = hardware_log_row(
+        raw_data=encode_json(data),
+        sensor_type="unknown" if data.sensor_type is None else data.sensor_type
     )
+    # Rejected compartments, written together with log_entry in one INSERT;
+    # applied readings go to compartment_readings
+    comp_logs = []
+    readings = []
+    started = time.perf_counter()
     
     try:
-        # Validate required fields
-        required = ["hardware_id", "compartments"]
-        missing = [f for f in required if f not in data]
-        if missing:
-            log_entry.error_message = f"Missing fields: {missing}"
-            db.session.add(log_entry)
-            db.session.commit()
-            return jsonify({"error": f"Missing required fields: {missing}"}), 400
-        
         # Find botiquin by hardware_id
-        botiquin = Botiquin.query.filter_by(hardware_id=data["hardware_id"]).first()
+        botiquin = find_kits([data.hardware_id]).get(data.hardware_id)
         if not botiquin:
-            log_entry.error_message = f"Botiquin with hardware_id '{data['hardware_id']}' not found"
-            db.session.add(log_entry)
-            db.session.commit()
-            return jsonify({"error": f"Botiquin not found for hardware_id: {data['hardware_id']}"}), 404
+            if unknown_device_log(log_entry, data.hardware_id):
+                write_hardware_logs([log_entry])
+                db.session.commit()
+            return jsonify({"error": f"Botiquin not found for hardware_id: {data.hardware_id}"}), 404
         
-        log_entry.botiquin_id = botiquin.id
+        log_entry["botiquin_id"] = botiquin.id
         
-        results = []
-        errors = []
-
-        payload_section = data.get("unit_payload", {})
-        payload_avg_weight = payload_section.get("average_weight", payload_section.get("unit_weight"))
-        if payload_avg_weight is not None:
-            try:
-                payload_avg_weight = float(payload_avg_weight)
-                if payload_avg_weight <= 0:
-                    errors.append({"warning": "Payload average_weight must be greater than zero"})
-                    payload_avg_weight = None
-            except (TypeError, ValueError):
-                errors.append({"warning": "Payload average_weight is not a valid number"})
-                payload_avg_weight = None
+        # Resolve every compartment of the payload with a single IN (...) query
+        # instead of one SELECT per compartment
+        medicines = load_compartment_medicines([botiquin.id], payload_compartment_numbers(data))
+
+        ack = _ack_requested()
+        activity = ReportActivity()
+        results, errors, server_seq = apply_sensor_payload(
+            data, botiquin, medicines, comp_logs, readings, build_results=not ack, activity=activity
+        )
         
-        # Iterate through compartments
-        for comp in data["compartments"]:
-            compartment_number = comp.get("compartment")
-            weight = comp.get("weight")
-            medicine_name = comp.get("medicine_name")  # New field from hardware
-            avg_weight_override = comp.get("average_weight", comp.get("unit_weight"))
-            
-            # Create individual log entries per compartment
-            comp_log = HardwareLog(
-                botiquin_id=botiquin.id,
-                compartment_number=compartment_number,
-                weight_reading=weight,
-                sensor_type=data.get("sensor_type", "unknown"),
-                raw_data=json.dumps(comp),
-                created_at=datetime.utcnow()
-            )
-            
-            if compartment_number is None or weight is None:
-                comp_log.error_message = "Missing compartment or weight data"
-                comp_log.processed = False
-                db.session.add(comp_log)
-                errors.append({
-                    "compartment": compartment_number,
-                    "error": "Missing compartment or weight data"
-                })
-                continue
-            
-            # Find medicine in the compartment
-            medicine = Medicine.query.filter_by(
-                botiquin_id=botiquin.id,
-                compartment_number=compartment_number
-            ).first()
-            
-            if not medicine:
-                # Create a new medicine record for this compartment
-                medicine = Medicine(
-                    botiquin_id=botiquin.id,
-                    compartment_number=compartment_number,
-                    medicine_name=medicine_name,  # Use name from hardware if provided
-                    current_weight=weight,
-                    initial_weight=weight,  # Set initial weight on first reading
-                    quantity=0,  # Will be calculated when unit_weight is set by admin
-                    reorder_level=5,
-                    last_scan_at=datetime.utcnow()
-                )
-                db.session.add(medicine)
-                db.session.flush()  # Get the ID
-                
-                comp_log.processed = True
-                db.session.add(comp_log)
-                
-                results.append({
-                    "compartment": compartment_number,
-                    "medicine": medicine.medicine_name or "No asignado",
-                    "old_weight": None,
-                    "new_weight": weight,
-                    "old_quantity": 0,
-                    "new_quantity": 0,
-                    "quantity_change": 0,
-                    "status": "NEW_MEDICINE",
-                    "message": "New medicine record created"
-                })
-                continue
-            
-            # Note: unit_weight is not updated from hardware data
-            # It will be set by admin when assigning medicine names
-
-            old_quantity = medicine.quantity
-            old_weight = medicine.current_weight
-
-            # Update from sensor (uses internal logic to update quantity based on current unit_weight)
-            new_quantity = medicine.update_from_sensor(weight, medicine_name)
-            
-            # Mark compartment log as processed
-            comp_log.processed = True
-            db.session.add(comp_log)
-            
-            results.append({
-                "compartment": compartment_number,
-                "medicine": medicine.medicine_name or "No asignado",
-                "old_weight": old_weight,
-                "new_weight": medicine.current_weight,
-                "old_quantity": old_quantity,
-                "new_quantity": new_quantity,
-                "quantity_change": new_quantity - old_quantity,
-                "status": medicine.status()
-            })
+        # Mark main log as processed
+        log_entry["processed"] = True
         
-        # Update botiquin sync timestamp
-        botiquin.last_sync_at = datetime.utcnow()
+        write_payload_logs([(log_entry, comp_logs)])
+        write_compartment_readings(readings, comp_logs)
+        db.session.commit()
+        if spool is not None:
+            spool.observe_latency(time.perf_counter() - started)
         
-        # Mark main log as processed
-        log_entry.processed = True
+        schedule = next_report(data.hardware_id, activity)
+        if ack:
+            return jsonify(sensor_ack(data, errors, server_seq, schedule)), 200
+        return jsonify(sensor_response(botiquin, results, errors, schedule)), 200
+    
+    except DuplicateReport as e:
+        # A retry of a report already applied: nothing to write or log
+        db.session.rollback()
+        return jsonify(e.ack() if ack else e.response()), 200
+    
+    except DeltaGapError as e:
+        # Nothing of the delta was written; the kit must resend every compartment
+        db.session.rollback()
+        log_entry["error_message"] = str(e)
+        write_hardware_logs([log_entry])
+        db.session.commit()
+        return jsonify(e.response()), 409
         
-        db.session.add(log_entry)
+    except Exception as e:
+        db.session.rollback()
+        if spool is not None and database_unavailable(e):
+            spool.engage(f"{type(e).__name__}: {str(e).splitlines()[0]}")
+            return _spool_sensor_payload(spool, data)
+        log_entry["error_message"] = str(e)
+        log_entry["processed"] = False
+        try:
+            write_hardware_logs([log_entry])
+            db.session.commit()
+        except Exception:
+            # The database may be what failed; the kit still gets its answer
+            db.session.rollback()
+        return jsonify({"error": f"Processing error: {str(e)}"}), 500
+
+
+@bp.post("/batch_sensor_data")
+def receive_batch_sensor_data():
+    """
+    Batch endpoint for gateways relaying readings of many kits.
+    
+    Accepts a JSON array of payloads in the /sensor_data shape (or an object
+    with a "payloads" array). All kits are applied in one transaction with a
+    SAVEPOINT per kit (see ingestion.pipeline.apply_sensor_batch), so a
+    failing kit is rolled back without affecting the others; if the writes
+    shared by the batch fail, each kit is applied in its own transaction.
+    
+    Returns one entry per payload, in request order:
+    {"index": 0, "hardware_id": "BOT001", "status_code": 200, ...sensor_data response}
+    """
+    data = request.get_json()
+    payloads = data.get("payloads") if isinstance(data, dict) else data
+    
+    if not payloads or not isinstance(payloads, list):
+        return jsonify({"error": "Expected a non-empty array of payloads"}), 400
+    if len(payloads) > MAX_BATCH_PAYLOADS:
+        return jsonify({"error": f"Batch exceeds {MAX_BATCH_PAYLOADS} payloads"}), 413
+    
+    ack = _ack_requested()
+    with counter_undo() as undo:
+        try:
+            kit_results = apply_sensor_batch(payloads, [ack] * len(payloads))
+        except Exception:
+            # The batch's shared log/readings writes or its commit failed:
+            # apply every kit alone so no kit is rolled back with another
+            db.session.rollback()
+            undo.restore()
+            kit_results = [
+                {**apply_sensor_alone(payload, ack), "index": index} for index, payload in enumerate(payloads)
+            ]
+    
+    failed = sum(1 for r in kit_results if r["status_code"] != 200)
+    return jsonify({
+        "success": failed == 0,
+        "processed": len(kit_results) - failed,
+        "failed": failed,
+        "results": kit_results,
+        "timestamp": datetime.utcnow().isoformat()
+    }), 200
+
+
+@bp.post("/backfill")
+def receive_backfill():
+    """
+    Upload of readings a kit buffered while offline, with device timestamps.
+    
+    Expected JSON format:
+    {
+        "hardware_id": "BOT001",
+        "sensor_type": "weight",
+        "readings": [
+            {"timestamp": "2025-09-23T10:30:00", "compartments": [{"compartment": 1, "weight": 45.5}]},
+            {"timestamp": 1758623460, "compartments": [{"compartment": 1, "weight": 44.9}]}
+        ]
+    }
+    
+    Every reading is stored in hardware_logs stamped with its own timestamp
+    (ISO 8601, UTC unless an offset is given, or unix seconds), in time
+    order. Each compartment's current state is updated only from its newest
+    reading, and only if that is newer than the compartment's last scan
+    (see ingestion/backfill.py); the others are listed under "skipped".
+    """
+    body = request.get_data()
+    if not body:
+        return jsonify({"error": "No data provided"}), 400
+    
+    try:
+        data = decode_backfill_payload(body)
+    except PayloadValidationError as e:
+        write_hardware_logs([hardware_log_row(
+            raw_data=body.decode("utf-8", "replace"),
+            sensor_type="unknown",
+            error_message=f"Invalid backfill payload: {e}"
+        )])
+        db.session.commit()
+        return jsonify({"error": "Invalid backfill payload", "errors": e.errors}), 400
+    
+    if not data.readings:
+        return jsonify({"error": "Expected a non-empty array of readings"}), 400
+    if len(data.readings) > MAX_BACKFILL_READINGS:
+        return jsonify({"error": f"Backfill exceeds {MAX_BACKFILL_READINGS} readings"}), 413
+    
+    # One log row for the request itself (the payload, compressed); the
+    # readings get a compartment_readings row per compartment
+    log_entry = hardware_log_row(
+        raw_data=encode_json(data),
+        sensor_type="unknown" if data.sensor_type is None else data.sensor_type
+    )
+    comp_logs = []
+    history = []
+    
+    try:
+        botiquin = find_kits([data.hardware_id]).get(data.hardware_id)
+        if not botiquin:
+            if unknown_device_log(log_entry, data.hardware_id):
+                write_hardware_logs([log_entry])
+                db.session.commit()
+            return jsonify({"error": f"Botiquin not found for hardware_id: {data.hardware_id}"}), 404
+        
+        log_entry["botiquin_id"] = botiquin.id
+        summary, errors = apply_backfill(data, botiquin, comp_logs, history)
+        log_entry["processed"] = True
+        
+        write_payload_logs([(log_entry, comp_logs)])
+        write_compartment_readings(history, comp_logs)
         db.session.commit()
         
-        # Prepare response
-        response = {
+        return jsonify({
             "success": len(errors) == 0,
             "botiquin": {
                 "id": botiquin.id,
                 "name": botiquin.name,
                 "hardware_id": botiquin.hardware_id
             },
-            "results": results,
+            **summary,
             "errors": errors if errors else None,
             "timestamp": datetime.utcnow().isoformat()
-        }
-        
-        # Add alerts if any medicine has critical or warning status
-        alerts = []
-        for res in results:
-            status = res.get("status")
-            if status in ["OUT_OF_STOCK", "EXPIRED"]:
-                alerts.append({
-                    "type": "critical",
-                    "message": f"{res.get('medicine')} is {status}"
-                })
-            elif status in ["LOW_STOCK", "EXPIRES_SOON"]:
-                alerts.append({
-                    "type": "warning", 
-                    "message": f"{res.get('medicine')} is {status}"
-                })
-        if alerts:
-            response["alerts"] = alerts
-        
-        return jsonify(response), 200
-        
+        }), 200
+    
     except Exception as e:
-        log_entry.error_message = str(e)
-        log_entry.processed = False
-        db.session.add(log_entry)
-        db.session.commit()
+        db.session.rollback()
+        log_entry["error_message"] = str(e)
+        log_entry["processed"] = False
+        try:
+            write_hardware_logs([log_entry])
+            db.session.commit()
+        except Exception:
+            # The database may be what failed; the kit still gets its answer
+            db.session.rollback()
         return jsonify({"error": f"Processing error: {str(e)}"}), 500
 
 
-# Removed /batch_sensor_data endpoint as per instructions
+@bp.get("/ingest/status")
+def get_ingest_status():
+    """
+    Metrics of this worker's asynchronous ingestion queue (queue depth,
+    batch sizes, flush latency), group commit coordinator, device registry
+    and spool (journal size and replay lag).
+    """
+    app = current_app._get_current_object()
+    spool = get_spool(app)
+    return jsonify({
+        "async_enabled": bool(app.config.get("HARDWARE_ASYNC_INGEST")),
+        "worker_pid": os.getpid(),
+        **get_writer(app).stats(),
+        "group_commit": {
+            "enabled": bool(app.config.get("HARDWARE_GROUP_COMMIT")),
+            **get_coordinator(app).stats()
+        },
+        "registry": {
+            "enabled": app.config.get("HARDWARE_REGISTRY_TTL", 60) > 0,
+            **get_registry(app).stats()
+        },
+        "spool": {"enabled": False} if spool is None else {"enabled": True, **spool.stats()},
+        "idempotency": get_response_cache(app).stats()
+    }), 200
+
+
+@bp.get("/ingest/receipts/<receipt_id>")
+def get_ingest_receipt(receipt_id):
+    """Look up the outcome of a payload accepted with 202."""
+    receipt = get_writer(current_app._get_current_object()).receipt(receipt_id)
+    if not receipt:
+        return jsonify({
+            "error": "Receipt not found (expired or accepted by another worker)"
+        }), 404
+    return jsonify(receipt), 200
 
 
 @bp.get("/logs")
 def get_hardware_logs():
     """
     Get hardware communication logs for debugging.
-    Can filter by botiquin_id, processed status, or date range.
+    Can filter by botiquin_id, processed status, or an ISO 8601 `since` /
+    `until` range; with partitioned logs only the months in the range are
+    read (see ingestion/log_partitions.py).
+    Payloads are stored compressed and returned as text in raw_data; rows of
+    rejected readings show the payload they came from.
     """
-    botiquin_id = request.args.get("botiquin_id")
+    botiquin_id = request.args.get("botiquin_id", type=int)
     processed = request.args.get("processed")
     limit = request.args.get("limit", 100, type=int)
     
-    query = HardwareLog.query
+    try:
+        since, until = _time_range_args()
+    except ValueError:
+        return jsonify({"error": "since and until must be ISO 8601 timestamps"}), 400
     
-    if botiquin_id:
-        query = query.filter_by(botiquin_id=botiquin_id)
+    logs = query_logs(
+        botiquin_id=botiquin_id,
+        processed=None if processed is None else processed.lower() == "true",
+        since=since,
+        until=until,
+        limit=limit
+    )
     
-    if processed is not None:
-        query = query.filter_by(processed=processed.lower() == "true")
+    return jsonify(logs), 200
+
+
+def _time_range_args():
+    """
+    The optional ISO 8601 `since` / `until` query arguments as naive UTC
+    datetimes, like the stored timestamps; ValueError when malformed.
+    """
+    def parse(name):
+        if name not in request.args:
+            return None
+        value = datetime.fromisoformat(request.args[name])
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value
     
-    logs = query.order_by(HardwareLog.created_at.desc()).limit(limit).all()
+    return parse("since"), parse("until")
+
+
+@bp.get("/readings")
+def get_compartment_readings():
+    """
+    Weight history of a kit's compartments from compartment_readings.
+    Requires botiquin_id; filter by compartment and an ISO 8601 `since` /
+    `until` range. Newest first, up to `limit` readings (weights in grams).
+    """
+    botiquin_id = request.args.get("botiquin_id", type=int)
+    if botiquin_id is None:
+        return jsonify({"error": "botiquin_id is required"}), 400
+    compartment = request.args.get("compartment", type=int)
+    limit = min(request.args.get("limit", 1000, type=int), MAX_READINGS_PAGE)
+    
+    try:
+        since, until = _time_range_args()
+    except ValueError:
+        return jsonify({"error": "since and until must be ISO 8601 timestamps"}), 400
+    
+    # Range scans on the (botiquin_id, compartment, ts) primary key
+    query = CompartmentReading.query.filter_by(botiquin_id=botiquin_id)
+    if compartment is not None:
+        query = query.filter_by(compartment=compartment)
+    if since is not None:
+        query = query.filter(CompartmentReading.ts >= since)
+    if until is not None:
+        query = query.filter(CompartmentReading.ts < until)
+    
+    readings = query.order_by(CompartmentReading.ts.desc()).limit(limit).all()
+    return jsonify([reading.to_dict() for reading in readings]), 200
+
+
+@bp.get("/rollups/<any(hourly, daily):period>")
+def get_reading_rollups(period):
+    """
+    Hourly or daily rollups of a kit's readings (see ingestion/rollups.py):
+    min, max, first and last weight (grams), samples and errors per
+    compartment and period. Requires botiquin_id; filter by compartment and
+    an ISO 8601 `since` / `until` range on the period start. Oldest first.
+    """
+    botiquin_id = request.args.get("botiquin_id", type=int)
+    if botiquin_id is None:
+        return jsonify({"error": "botiquin_id is required"}), 400
+    compartment = request.args.get("compartment", type=int)
+    limit = min(request.args.get("limit", 1000, type=int), MAX_READINGS_PAGE)
+    
+    try:
+        since, until = _time_range_args()
+    except ValueError:
+        return jsonify({"error": "since and until must be ISO 8601 timestamps"}), 400
     
-    return jsonify([log.to_dict() for log in logs]), 200
+    model = ROLLUP_PERIODS[period]
+    query = model.query.filter_by(botiquin_id=botiquin_id)
+    if compartment is not None:
+        query = query.filter_by(compartment=compartment)
+    if since is not None:
+        query = query.filter(model.period_start >= since)
+    if until is not None:
+        query = query.filter(model.period_start < until)
+    
+    rollups = query.order_by(model.period_start, model.compartment).limit(limit).all()
+    return jsonify([rollup.to_dict() for rollup in rollups]), 200
 
 
 @bp.post("/test_connection")
@@ -263,6 +654,7 @@ def test_hardware_connection():
     """
     Test endpoint for hardware to verify connection.
     Hardware can ping this to confirm API is reachable.
+    Registered kits also get their reporting schedule ("next_report").
     """
     data = request.get_json() or {}
     hardware_id = data.get("hardware_id", "unknown")
@@ -270,16 +662,19 @@ def test_hardware_connection():
     # Check if botiquin exists
     botiquin = None
     if hardware_id != "unknown":
-        botiquin = Botiquin.query.filter_by(hardware_id=hardware_id).first()
+        botiquin = lookup_kit(hardware_id)
     
-    return jsonify({
+    response = {
         "status": "connected",
         "timestamp": datetime.utcnow().isoformat(),
         "hardware_id": hardware_id,
         "botiquin_found": botiquin is not None,
         "botiquin_name": botiquin.name if botiquin else None,
         "message": "Hardware connection successful"
-    }), 200
+    }
+    if botiquin is not None:
+        response["next_report"] = next_report(botiquin.hardware_id)
+    return jsonify(response), 200
 
 
 @bp.post("/register_hardware")
@@ -307,13 +702,18 @@ def register_hardware():
     if missing:
         return jsonify({"error": f"Missing fields: {missing}"}), 400
     
-    # Check if already exists
-    existing = Botiquin.query.filter_by(hardware_id=data["hardware_id"]).first()
+    # Check if already exists; a stale registry entry may point at a deleted kit
+    existing = lookup_kit(data["hardware_id"])
     if existing:
-        return jsonify({
-            "status": "already_registered",
-            "botiquin": existing.to_dict()
-        }), 200
+        botiquin = db.session.get(Botiquin, existing.id)
+        if botiquin is None:
+            invalidate_kits(data["hardware_id"])
+            botiquin = Botiquin.query.filter_by(hardware_id=data["hardware_id"]).first()
+        if botiquin is not None:
+            return jsonify({
+                "status": "already_registered",
+                "botiquin": botiquin.to_dict()
+            }), 200
     
     # company_id is optional
     company_id = data.get("company_id", None)
@@ -339,6 +739,7 @@ def register_hardware():
     
     db.session.add(botiquin)
     db.session.commit()
+    invalidate_kits(botiquin.hardware_id)
     
     return jsonify({
         "status": "registered",
@@ -7,6 +7,7 @@ from flask import Blueprint, request, jsonify
 from datetime import datetime, date
 from db import db
 from models.models import Medicine, Botiquin
+from ingestion.pipeline import kit_deadband
 
 bp = Blueprint("medicines", __name__)
 
@@ -82,6 +83,17 @@ def validate_payload(data, *, partial=False):
 
     return (len(errors) == 0, errors)
 
+def compartment_taken(botiquin_id, compartment_number, exclude_id=None):
+    """A compartment holds at most one medicine (unique botiquin_id + compartment_number)."""
+    if not botiquin_id or compartment_number is None:
+        return False
+    query = Medicine.query.filter_by(botiquin_id=botiquin_id, compartment_number=compartment_number)
+    if exclude_id is not None:
+        query = query.filter(Medicine.id != exclude_id)
+    # Do not flush pending edits first: they may be the conflicting row
+    with db.session.no_autoflush:
+        return db.session.query(query.exists()).scalar()
+
 # -------- Routes --------
 
 @bp.get("/")
@@ -195,6 +207,9 @@ def create_medicine():
         last_scan_at=datetime.utcnow(),
     )
     
+    if compartment_taken(med.botiquin_id, med.compartment_number):
+        return jsonify({"errors": [f"Compartment {med.compartment_number} is already assigned in this botiquin"]}), 400
+    
     # Calculate quantity from weight if both weights are provided
     if med.unit_weight and med.current_weight:
         med.calculate_quantity_from_weight()
@@ -254,6 +269,10 @@ def update_medicine(med_id):
             else:
                 setattr(med, f, data[f])
     
+    if compartment_taken(med.botiquin_id, med.compartment_number, exclude_id=med.id):
+        db.session.rollback()
+        return jsonify({"errors": [f"Compartment {med.compartment_number} is already assigned in this botiquin"]}), 400
+
     # Recalculate quantity if weights changed
     if any(k in data for k in ["average_weight", "unit_weight", "current_weight"]):
         if med.unit_weight and med.current_weight:
@@ -297,9 +316,11 @@ def update_medicine_weight(med_id):
     except (TypeError, ValueError):
         return jsonify({"error": "Weight must be a number"}), 400
     
-    # Update weight and calculate new quantity
+    # Update weight and calculate new quantity; noise inside the kit's
+    # dead-band is ignored as on /api/hardware/sensor_data
     old_quantity = med.quantity
-    new_quantity = med.update_from_sensor(weight)
+    deadband_grams, deadband_percent = kit_deadband(med.botiquin)
+    new_quantity = med.update_from_sensor(weight, deadband_grams=deadband_grams, deadband_percent=deadband_percent)
     
     db.session.commit()
     
@@ -8,6 +8,7 @@ from flask_login import current_user, login_required, logout_user
 from models.models import Medicine, Botiquin, Company, User
 from datetime import datetime
 from db import db
+from ingestion.registry import invalidate_kits
 
 bp = Blueprint("pages", __name__)
 
@@ -410,5 +411,6 @@ def assign_single_botiquin(botiquin_id):
     
     botiquin.company_id = company.id
     db.session.commit()
+    invalidate_kits(botiquin.hardware_id)
     flash("Botiquín asignado correctamente", "success")
     return redirect(url_for("pages.dashboard"))
@@ -0,0 +1,1350 @@
+#!/usr/bin/env python3
+"""
+Tests for the hardware ingestion endpoints.
+Runs the Flask app against an in-memory SQLite database so no MySQL is needed.
+"""
+
+import json
+import os
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+
+def make_app(database_url="sqlite://"):
+    """Build a fresh app bound to an empty (by default in-memory) SQLite database."""
+    os.environ["DATABASE_URL"] = database_url
+    from app import create_app
+    from db import db
+
+    app = create_app()
+    app.config["TESTING"] = True
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+def register_kit(client, hardware_id="BOT_TEST", compartments=4):
+    response = client.post("/api/hardware/register_hardware", json={
+        "hardware_id": hardware_id,
+        "name": f"Kit {hardware_id}",
+        "compartments": compartments
+    })
+    assert response.status_code == 201
+    return response.get_json()["botiquin"]
+
+
+def sensor_payload(hardware_id, compartments, weight=50.0):
+    return {
+        "hardware_id": hardware_id,
+        "sensor_type": "weight",
+        "compartments": [
+            {"compartment": n, "weight": weight, "unit": "grams"}
+            for n in range(1, compartments + 1)
+        ]
+    }
+
+
+@contextmanager
+def count_statements(app, contains=None):
+    """Count SQL statements sent to the database (optionally only those containing `contains`)."""
+    from db import db
+
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if contains is None or contains in statement:
+            statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
+def test_sensor_data_medicine_queries_do_not_scale_with_compartments():
+    app = make_app()
+    counts = {}
+
+    with app.test_client() as client:
+        for size in (4, 16):
+            hardware_id = f"BOT_{size}"
+            register_kit(client, hardware_id, compartments=size)
+
+            # First report creates every compartment, second one updates them
+            with count_statements(app, contains="medicines") as created:
+                response = client.post("/api/hardware/sensor_data", json=sensor_payload(hardware_id, size))
+            assert response.status_code == 200
+            assert all(r["status"] == "NEW_MEDICINE" for r in response.get_json()["results"])
+
+            with count_statements(app, contains="medicines") as updated:
+                response = client.post("/api/hardware/sensor_data", json=sensor_payload(hardware_id, size, 40.0))
+            assert response.status_code == 200
+            assert len(response.get_json()["results"]) == size
+
+            counts[size] = (len(created), len(updated))
+
+    assert counts[4] == counts[16]
+
+
+def test_sensor_data_creates_each_compartment_once():
+    app = make_app()
+
+    with app.test_client() as client:
+        kit = register_kit(client)
+        payload = sensor_payload("BOT_TEST", 4)
+        payload["compartments"].append({"compartment": "2", "weight": 12.0, "unit": "grams"})
+
+        response = client.post("/api/hardware/sensor_data", json=payload)
+        assert response.status_code == 200
+
+        response = client.post("/api/hardware/sensor_data", json=sensor_payload("BOT_TEST", 4, 30.0))
+        results = response.get_json()["results"]
+        assert [r["old_weight"] for r in results] == [50.0, 12.0, 50.0, 50.0]
+
+    with app.app_context():
+        from models.models import Medicine
+        assert Medicine.query.filter_by(botiquin_id=kit["id"]).count() == 4
+
+
+def test_sensor_data_writes_readings_and_each_payload_once():
+    app = make_app()
+
+    with app.test_client() as client:
+        kit = register_kit(client, compartments=8)
+        payload = sensor_payload("BOT_TEST", 8, 12.3456)
+        payload["compartments"].append({"compartment": 9})
+        with count_statements(app, contains="INSERT INTO hardware_logs") as log_inserts, \
+                count_statements(app, contains="INSERT INTO compartment_readings") as reading_inserts:
+            response = client.post("/api/hardware/sensor_data", json=payload)
+        assert response.status_code == 200
+        assert len(log_inserts) == 2 and len(reading_inserts) == 1
+
+        # hardware_logs: the payload, stored once, and the compartment that
+        # could not be applied, pointing at it
+        logs = client.get(f"/api/hardware/logs?botiquin_id={kit['id']}").get_json()
+        assert len(logs) == 2
+        assert set(logs[0]) == {
+            "id", "botiquin_id", "compartment_number", "weight_reading", "sensor_type",
+            "raw_data", "payload_log_id", "processed", "error_message", "occurrences", "created_at"
+        }
+        rejected, = [log for log in logs if log["error_message"]]
+        stored, = [log for log in logs if not log["error_message"]]
+        assert rejected["compartment_number"] == 9 and rejected["payload_log_id"] == stored["id"]
+        assert json.loads(stored["raw_data"]) == json.loads(rejected["raw_data"]) == payload
+
+        with app.app_context():
+            from db import db
+            from models.models import HardwareLog
+            row = HardwareLog.query.filter_by(id=stored["id"]).one()
+            assert row.raw_data is None and len(row.raw_payload) < len(stored["raw_data"]) / 3
+
+        # compartment_readings: one narrow row per applied reading, milligram precision
+        readings = client.get(f"/api/hardware/readings?botiquin_id={kit['id']}").get_json()
+        assert sorted(r["compartment"] for r in readings) == list(range(1, 9))
+        assert {r["weight"] for r in readings} == {12.346}
+        assert len({r["timestamp"] for r in readings}) == 1
+
+        since = readings[0]["timestamp"]
+        client.post("/api/hardware/sensor_data", json=sensor_payload("BOT_TEST", 8, 20.0))
+        history = client.get(f"/api/hardware/readings?botiquin_id={kit['id']}&compartment=3").get_json()
+        assert [r["weight"] for r in history] == [20.0, 12.346]
+        newer = client.get(
+            f"/api/hardware/readings?botiquin_id={kit['id']}&compartment=3&until={since}"
+        ).get_json()
+        assert newer == []
+        assert client.get("/api/hardware/readings").status_code == 400
+
+        # Rows loaded through the ORM fetch their payload rows together
+        other = sensor_payload("BOT_TEST", 2, 5.0)
+        other["compartments"].append({"compartment": 9})
+        client.post("/api/hardware/sensor_data", json=other)
+        with app.app_context():
+            from models.models import HardwareLog
+            with count_statements(app, contains="FROM hardware_logs") as selects:
+                rows = HardwareLog.query.filter(HardwareLog.error_message.isnot(None)).all()
+                assert sorted(json.loads(r.to_dict()["raw_data"])["compartments"][0]["weight"] for r in rows) == [5.0, 12.3456]
+            assert len(selects) == 2
+
+
+def test_batch_sensor_data_isolates_failing_kits(tmp_path, monkeypatch):
+    # A file database: SQLite nests savepoints in a real transaction there (see db.py)
+    app = make_app(f"sqlite:///{tmp_path / 'batch.db'}")
+    import ingestion.pipeline as pipeline
+
+    with app.test_client() as client:
+        kit_a = register_kit(client, "BOT_A")
+        kit_b = register_kit(client, "BOT_B")
+        client.post("/api/hardware/sensor_data", json=sensor_payload("BOT_B", 4))
+
+        # BOT_B fails after its compartments were written inside its savepoint
+        write = pipeline.write_compartments
+
+        def failing_write(rows, medicines):
+            written = write(rows, medicines)
+            if rows and rows[0]["botiquin_id"] == kit_b["id"]:
+                raise RuntimeError("disk full")
+            return written
+
+        monkeypatch.setattr(pipeline, "write_compartments", failing_write)
+
+        malformed = sensor_payload("BOT_A", 1, 10.0)
+        malformed["compartments"].append({"compartment": 2, "weight": "heavy", "unit": "grams"})
+
+        with count_statements(app, contains="FROM botiquines") as kit_lookups:
+            response = client.post("/api/hardware/batch_sensor_data", json=[
+                sensor_payload("BOT_A", 4),
+                sensor_payload("BOT_B", 1, 10.0),
+                {"hardware_id": "BOT_MISSING", "compartments": []},
+                {"hardware_id": "BOT_A"},
+                malformed,
+            ])
+        assert response.status_code == 200
+        assert len(kit_lookups) == 1
+
+        body = response.get_json()
+        assert [r["status_code"] for r in body["results"]] == [200, 500, 404, 400, 400]
+        assert body["processed"] == 1 and body["failed"] == 4
+        assert len(body["results"][0]["results"]) == 4
+        assert body["results"][3]["errors"] == [{"field": "$.compartments", "error": "Missing required field"}]
+        assert body["results"][4]["errors"][0]["field"] == "$.compartments[1].weight"
+
+    with app.app_context():
+        from models.models import Medicine
+        # The failed kit's partial update was rolled back, the others were kept
+        medicine = Medicine.query.filter_by(botiquin_id=kit_b["id"], compartment_number=1).one()
+        assert medicine.current_weight == 50.0
+        assert Medicine.query.count() == 8
+
+    # BOT_B's readings make the batch's shared INSERT fail: BOT_A is applied alone and kept
+    monkeypatch.undo()
+    write_readings = pipeline.write_compartment_readings
+
+    def reject_33g(readings, rejected):
+        if any(row["weight_mg"] == 33000 for row in readings):
+            raise RuntimeError("Out of range value")
+        write_readings(readings, rejected)
+
+    monkeypatch.setattr(pipeline, "write_compartment_readings", reject_33g)
+    with app.test_client() as client:
+        response = client.post("/api/hardware/batch_sensor_data", json=[
+            sensor_payload("BOT_A", 4, 31.0), sensor_payload("BOT_B", 4, 33.0)
+        ])
+        results = response.get_json()["results"]
+        assert [(r["index"], r["status_code"]) for r in results] == [(0, 200), (1, 500)]
+
+    with app.app_context():
+        weights = {(m.botiquin_id, m.current_weight) for m in Medicine.query.all()}
+        assert weights == {(kit_a["id"], 31.0), (kit_b["id"], 50.0)}
+
+
+def test_sensor_data_async_mode_returns_receipt():
+    app = make_app()
+    app.config["HARDWARE_ASYNC_INGEST"] = True
+
+    with app.test_client() as client:
+        register_kit(client)
+        response = client.post("/api/hardware/sensor_data", json=sensor_payload("BOT_TEST", 4))
+        assert response.status_code == 202
+        receipt_id = response.get_json()["receipt_id"]
+
+        missing = client.post("/api/hardware/sensor_data", json=sensor_payload("BOT_MISSING", 4))
+        assert missing.status_code == 202
+
+        from ingestion.async_writer import get_writer
+        assert get_writer(app).drain(timeout=5)
+
+        receipt = client.get(f"/api/hardware/ingest/receipts/{receipt_id}").get_json()
+        assert receipt["status"] == "processed"
+        assert receipt["status_code"] == 200
+
+        receipt = client.get(f"/api/hardware/ingest/receipts/{missing.get_json()['receipt_id']}").get_json()
+        assert receipt["status"] == "failed"
+        assert receipt["status_code"] == 404
+
+        stats = client.get("/api/hardware/ingest/status").get_json()
+        assert stats["queue_depth"] == 0
+        assert stats["processed"] == 1 and stats["failed"] == 1
+
+        bad = client.post("/api/hardware/sensor_data", json={"hardware_id": "BOT_TEST"})
+        assert bad.status_code == 400
+
+    with app.app_context():
+        from models.models import Medicine
+        assert Medicine.query.count() == 4
+
+
+def test_sensor_data_group_commit_shares_one_commit():
+    import threading
+
+    app = make_app()
+    app.config["HARDWARE_GROUP_COMMIT"] = True
+    app.config["HARDWARE_GROUP_COMMIT_WINDOW_MS"] = 2000
+    app.config["HARDWARE_GROUP_COMMIT_MAX_SIZE"] = 4
+
+    with app.test_client() as client:
+        for n in range(3):
+            register_kit(client, f"BOT_{n}")
+
+    from db import db
+    with app.app_context():
+        engine = db.engine
+    commits = []
+    listener = lambda conn: commits.append(1)
+    event.listen(engine, "commit", listener)
+
+    responses = {}
+
+    def post(hardware_id):
+        responses[hardware_id] = app.test_client().post(
+            "/api/hardware/sensor_data", json=sensor_payload(hardware_id, 4)
+        )
+
+    threads = [threading.Thread(target=post, args=(h,)) for h in ("BOT_0", "BOT_1", "BOT_2", "BOT_MISSING")]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    event.remove(engine, "commit", listener)
+
+    assert len(commits) == 1
+    assert [responses[f"BOT_{n}"].status_code for n in range(3)] == [200, 200, 200]
+    assert responses["BOT_1"].get_json()["botiquin"]["hardware_id"] == "BOT_1"
+    assert responses["BOT_MISSING"].status_code == 404
+
+
+def test_group_commit_fallback_does_not_count_side_effects_twice(monkeypatch):
+    app = make_app()
+    import ingestion.pipeline as pipeline
+    from ingestion.group_commit import GroupCommitCoordinator, _Group
+
+    write_payload_logs = pipeline.write_payload_logs
+    calls = []
+
+    def fail_first_commit(entries):
+        calls.append(len(entries))
+        if len(calls) == 1:
+            raise RuntimeError("Shared commit failed")
+        write_payload_logs(entries)
+
+    monkeypatch.setattr(pipeline, "write_payload_logs", fail_first_commit)
+
+    group = _Group()
+    group.payloads = [sensor_payload("BOT_GONE", 4), sensor_payload("BOT_GONE", 4)]
+    group.acks = [False, False]
+    with app.app_context():
+        GroupCommitCoordinator()._commit(group)
+        unknown = app.extensions[pipeline.UNKNOWN_DEVICES_KEY]["BOT_GONE"]
+
+    # The failed attempt logged the first request and folded the second;
+    # retried alone, the first is logged again instead of being folded too
+    assert [r["status_code"] for r in group.results] == [404, 404]
+    assert unknown[0] == 1
+    with app.test_client() as client:
+        logs = client.get("/api/hardware/logs").get_json()
+    assert [log["occurrences"] for log in logs] == [1]
+
+
+def test_async_writer_retries_a_failed_batch_payload_by_payload(monkeypatch):
+    app = make_app()
+    import ingestion.pipeline as pipeline
+    from ingestion.async_writer import AsyncIngestWriter
+
+    write_payload_logs = pipeline.write_payload_logs
+    calls = []
+
+    def fail_first_commit(entries):
+        calls.append(len(entries))
+        if len(calls) == 1:
+            raise RuntimeError("Batch commit failed")
+        write_payload_logs(entries)
+
+    with app.test_client() as client:
+        register_kit(client, "BOT_A")
+        register_kit(client, "BOT_B")
+    monkeypatch.setattr(pipeline, "write_payload_logs", fail_first_commit)
+
+    # Both payloads were answered 202 already: neither is lost with the batch
+    writer = AsyncIngestWriter(app)
+    writer._flush([(None, sensor_payload("BOT_A", 4, 21.0)), (None, sensor_payload("BOT_B", 4, 22.0))])
+    stats = writer.stats()
+    assert (stats["processed"], stats["failed"], stats["fallbacks"]) == (2, 0, 1)
+    assert calls == [2, 1, 1]
+
+    with app.app_context():
+        from models.models import Medicine
+        assert {m.current_weight for m in Medicine.query.all()} == {21.0, 22.0}
+
+
+def test_sensor_data_deadband_skips_noise_but_keeps_status_changes():
+    app = make_app()
+    app.config["HARDWARE_DEADBAND_GRAMS"] = 1.0
+    app.config["HARDWARE_DEADBAND_LOG_EVERY"] = 3
+
+    with app.test_client() as client:
+        kit = register_kit(client)
+        client.post("/api/hardware/sensor_data", json=sensor_payload("BOT_TEST", 4, 50.0))
+
+        for weight in (50.2, 49.9, 50.4):
+            response = client.post("/api/hardware/sensor_data", json=sensor_payload("BOT_TEST", 4, weight))
+            assert all(r["unchanged"] for r in response.get_json()["results"])
+
+        # Only every 3rd unchanged reading per compartment reaches the readings history
+        readings = client.get(f"/api/hardware/readings?botiquin_id={kit['id']}").get_json()
+        assert len(readings) == 4 + 4
+
+        # Outside the band: persisted
+        client.post("/api/hardware/sensor_data", json=sensor_payload("BOT_TEST", 4, 10.5))
+        # Inside the band but GOOD_STOCK -> LOW_STOCK: persisted as well
+        response = client.post("/api/hardware/sensor_data", json=sensor_payload("BOT_TEST", 4, 9.8))
+        result = response.get_json()["results"][0]
+        assert "unchanged" not in result
+        assert result["status"] == "LOW_STOCK"
+
+        # A per-kit override of 0 disables the global band for that kit
+        client.put(f"/api/botiquines/{kit['id']}", json={"deadband_grams": 0})
+        response = client.post("/api/hardware/sensor_data", json=sensor_payload("BOT_TEST", 4, 9.7))
+        assert "unchanged" not in response.get_json()["results"][0]
+
+    with app.app_context():
+        from models.models import Medicine
+        medicine = Medicine.query.filter_by(botiquin_id=kit["id"], compartment_number=1).one()
+        assert medicine.current_weight == 9.7
+        assert medicine.in_deadband(9.2, deadband_grams=1.0) is True
+        assert medicine.in_deadband(9.2, deadband_grams=0.3) is False
+        medicine_id = medicine.id
+
+    # The manual weight endpoint applies the same per-kit band
+    with app.test_client() as client:
+        client.put(f"/api/botiquines/{kit['id']}", json={"deadband_grams": 1.0})
+        response = client.post(f"/api/medicines/{medicine_id}/update_weight", json={"weight": 9.4})
+        assert response.get_json()["medicine"]["current_weight"] == 9.7
+        response = client.post(f"/api/medicines/{medicine_id}/update_weight", json={"weight": 5.0})
+        assert response.get_json()["medicine"]["current_weight"] == 5.0
+
+
+def test_upsert_compartments_keeps_one_row_per_compartment():
+    from datetime import datetime
+    from db import db
+    from ingestion.pipeline import compartment_row, upsert_compartments
+    from models.models import Medicine
+
+    app = make_app()
+    with app.test_client() as client:
+        kit = register_kit(client)
+
+    with app.app_context():
+        now = datetime.utcnow()
+        upsert_compartments([
+            compartment_row(kit["id"], 1, "tylenol", 50.0, 50.0, now),
+            compartment_row(kit["id"], 2, None, 20.0, 20.0, now),
+        ])
+        # A second writer racing on the same compartments updates instead of duplicating
+        upsert_compartments([
+            compartment_row(kit["id"], 1, None, 45.0, 45.0, now),
+            compartment_row(kit["id"], 2, "gel", 18.0, 18.0, now),
+        ])
+        db.session.commit()
+
+        rows = {m.compartment_number: m for m in Medicine.query.filter_by(botiquin_id=kit["id"])}
+        assert len(rows) == 2
+        assert (rows[1].medicine_name, rows[1].initial_weight, rows[1].current_weight) == ("tylenol", 50.0, 45.0)
+        assert (rows[2].medicine_name, rows[2].initial_weight, rows[2].current_weight) == ("gel", 20.0, 18.0)
+
+
+def test_core_ingest_matches_orm_ingest():
+    from datetime import date, timedelta
+
+    def run(core, registry_ttl):
+        app = make_app()
+        app.config["HARDWARE_INGEST_CORE"] = core
+        app.config["HARDWARE_REGISTRY_TTL"] = registry_ttl
+        app.config["HARDWARE_DEADBAND_GRAMS"] = 0.5
+        app.config["HARDWARE_DEADBAND_LOG_EVERY"] = 2
+        bodies = []
+        with app.test_client() as client:
+            kit = register_kit(client)
+            for weight in (50.0, 30.0, 30.2, 9.0, 30.1):
+                payload = sensor_payload("BOT_TEST", 4, weight)
+                payload["compartments"][0]["medicine_name"] = "tylenol"
+                payload["compartments"].append({"compartment": None, "weight": 1.0})
+                bodies.append(client.post("/api/hardware/sensor_data", json=payload).get_json())
+                if weight == 50.0:
+                    client.put("/api/medicines/1", json={"expiry_date": (date.today() + timedelta(days=5)).isoformat()})
+            batch = client.post("/api/hardware/batch_sensor_data", json=[
+                sensor_payload("BOT_TEST", 6, 2.0), sensor_payload("BOT_NOPE", 1), sensor_payload("BOT_TEST", 6, 1.5)
+            ]).get_json()
+            logs = client.get(f"/api/hardware/logs?limit=1000").get_json()
+            medicines = client.get(f"/api/medicines/?botiquin_id={kit['id']}").get_json()
+
+        def strip(item, keys=("timestamp", "next_report", "created_at", "updated_at", "last_scan_at", "id")):
+            if isinstance(item, dict):
+                return {k: strip(v) for k, v in item.items() if k not in keys}
+            if isinstance(item, list):
+                return [strip(v) for v in item]
+            return item
+
+        return strip(bodies), strip(batch), strip(logs), strip(medicines)
+
+    # With and without the registry, so kits are loaded by both paths too
+    for registry_ttl in (60, 0):
+        orm, core = run(False, registry_ttl), run(True, registry_ttl)
+        assert orm[0] == core[0]
+        assert orm[1] == core[1]
+        assert orm[2] == core[2]
+        assert orm[3] == core[3]
+        assert any(r.get("alerts") for r in orm[0])
+
+
+def test_registry_resolves_kits_without_querying_botiquines(tmp_path):
+    app = make_app()
+    from ingestion.registry import DeviceRegistry
+
+    app.config["HARDWARE_REGISTRY_SYNC_FILE"] = str(tmp_path / "registry.gen")
+
+    with app.test_client() as client:
+        kit = register_kit(client)
+        client.post("/api/hardware/sensor_data", json=sensor_payload("BOT_TEST", 4))
+
+        with count_statements(app, contains="FROM botiquines") as lookups:
+            for _ in range(3):
+                assert client.post("/api/hardware/sensor_data", json=sensor_payload("BOT_TEST", 4)).status_code == 200
+                assert client.post("/api/hardware/test_connection", json={"hardware_id": "BOT_TEST"}).get_json()["botiquin_found"]
+        assert lookups == []
+
+        # Renaming the kit invalidates the cached entry
+        client.put(f"/api/botiquines/{kit['id']}", json={"hardware_id": "BOT_RENAMED"})
+        assert client.post("/api/hardware/sensor_data", json=sensor_payload("BOT_TEST", 4)).status_code == 404
+        assert client.post("/api/hardware/sensor_data", json=sensor_payload("BOT_RENAMED", 4)).status_code == 200
+
+    # Another worker sharing the sync file drops its cache when a kit changes
+    other = DeviceRegistry(ttl=60, sync_file=app.config["HARDWARE_REGISTRY_SYNC_FILE"])
+    with app.app_context():
+        assert other.get("BOT_RENAMED").id == kit["id"]
+    assert app.test_client().delete(f"/api/botiquines/{kit['id']}").status_code == 200
+    with app.app_context():
+        assert other.get("BOT_RENAMED") is None
+
+
+def test_register_hardware_with_stale_registry_entry(tmp_path):
+    app = make_app()
+    from db import db
+    from models.models import Botiquin
+
+    app.config["HARDWARE_REGISTRY_SYNC_FILE"] = str(tmp_path / "registry.gen")
+
+    with app.test_client() as client:
+        register_kit(client)
+        assert client.post("/api/hardware/test_connection", json={"hardware_id": "BOT_TEST"}).get_json()["botiquin_found"]
+
+        # Deleted behind the registry's back: the cached entry points at no row
+        with app.app_context():
+            db.session.execute(Botiquin.__table__.delete())
+            db.session.commit()
+
+        kit = register_kit(client)
+        assert client.post("/api/hardware/sensor_data", json=sensor_payload("BOT_TEST", 4)).status_code == 200
+        with app.app_context():
+            assert db.session.get(Botiquin, kit["id"]).hardware_id == "BOT_TEST"
+
+
+def test_unknown_device_is_cached_and_its_errors_aggregated():
+    app = make_app()
+    app.config["HARDWARE_UNKNOWN_LOG_INTERVAL"] = 0.2
+
+    with app.test_client() as client:
+        with count_statements(app, contains="FROM botiquines") as lookups:
+            for _ in range(5):
+                assert client.post("/api/hardware/sensor_data", json=sensor_payload("BOT_GHOST", 4)).status_code == 404
+        assert len(lookups) == 1
+
+        # After the interval the next failure logs the requests folded in so far
+        time.sleep(0.25)
+        assert client.post("/api/hardware/sensor_data", json=sensor_payload("BOT_GHOST", 4)).status_code == 404
+        logs = client.get("/api/hardware/logs?limit=100").get_json()
+        assert [log["occurrences"] for log in logs] == [5, 1]
+
+        # A device that stops sending still gets its folded requests written
+        for _ in range(3):
+            client.post("/api/hardware/sensor_data", json=sensor_payload("BOT_GHOST", 4))
+        deadline = time.monotonic() + 2
+        while len(logs) < 3 and time.monotonic() < deadline:
+            time.sleep(0.05)
+            logs = client.get("/api/hardware/logs?limit=100").get_json()
+        assert [log["occurrences"] for log in logs] == [3, 5, 1]
+        assert logs[0]["error_message"] == "Botiquin with hardware_id 'BOT_GHOST' not found (3 requests since the last logged one)"
+
+        # Registering the device clears the negative entry right away
+        register_kit(client, "BOT_GHOST")
+        assert client.post("/api/hardware/sensor_data", json=sensor_payload("BOT_GHOST", 4)).status_code == 200
+
+
+def test_binary_sensor_frame_matches_json_payload():
+    app = make_app()
+    from ingestion.codec import BINARY_CONTENT_TYPE, decode_sensor_frame, encode_sensor_frame
+
+    def payload(hardware_id):
+        data = sensor_payload(hardware_id, 4, 30.2)
+        data["unit_payload"] = {"average_weight": 0.5}
+        return data
+
+    frame = encode_sensor_frame(payload("BOT_BINARY"))
+    assert len(frame) < len(json.dumps(payload("BOT_BINARY"))) / 4
+
+    # Retry identity survives the frame
+    numbered = dict(payload("BOT_BINARY"), seq=7, base_seq=5, boot_id=0xDEADBEEF)
+    decoded = decode_sensor_frame(encode_sensor_frame(numbered))
+    assert (decoded["seq"], decoded["base_seq"], decoded["boot_id"]) == (7, 5, 0xDEADBEEF)
+
+    with app.test_client() as client:
+        register_kit(client, "BOT_JSON")
+        register_kit(client, "BOT_BINARY")
+        from_json = client.post("/api/hardware/sensor_data", json=payload("BOT_JSON")).get_json()
+        from_binary = client.post("/api/hardware/sensor_data", data=frame,
+                                  content_type=BINARY_CONTENT_TYPE).get_json()
+        assert from_binary["results"] == from_json["results"]
+        assert from_binary["success"] and from_binary["botiquin"]["hardware_id"] == "BOT_BINARY"
+
+        response = client.post("/api/hardware/sensor_data", data=frame[:-3], content_type=BINARY_CONTENT_TYPE)
+        assert response.status_code == 400
+        assert "Invalid binary payload" in response.get_json()["error"]
+
+
+def test_compressed_request_bodies_match_uncompressed():
+    import gzip
+    import zlib
+
+    app = make_app()
+    app.config["HARDWARE_MAX_DECOMPRESSED_BYTES"] = 64 * 1024
+
+    def batch(weight):
+        return json.dumps([sensor_payload(f"BOT_{n}", 4, weight) for n in range(3)]).encode("utf-8")
+
+    def post(client, body, encoding=None):
+        headers = {"Content-Encoding": encoding} if encoding else {}
+        response = client.post("/api/hardware/batch_sensor_data", data=body,
+                               content_type="application/json", headers=headers)
+        body = response.get_json()
+        body.pop("timestamp", None)
+        for kit in body.get("results", []):
+            kit.pop("timestamp", None)
+            kit.pop("next_report", None)
+        return response.status_code, body
+
+    def reading(client, compress=None, encoding=None):
+        # Same starting state for every encoding, then the reading under test
+        post(client, batch(60.0))
+        body = batch(50.0)
+        return post(client, compress(body) if compress else body, encoding)
+
+    with app.test_client() as client:
+        for n in range(3):
+            register_kit(client, f"BOT_{n}")
+
+        plain = reading(client)
+        assert plain[0] == 200
+        assert reading(client, gzip.compress, "gzip") == plain
+        assert reading(client, zlib.compress, "deflate") == plain
+
+        # A zip bomb is cut off at the limit instead of being inflated
+        status, body = post(client, gzip.compress(b" " * (10 * 1024 * 1024)), "gzip")
+        assert status == 413
+        assert post(client, gzip.compress(batch(50.0))[:-8], "gzip")[0] == 400
+        assert post(client, batch(50.0), "br")[0] == 415
+
+
+def test_sensor_data_reports_field_errors_from_schema():
+    app = make_app()
+
+    with app.test_client() as client:
+        register_kit(client)
+        response = client.post("/api/hardware/sensor_data", json={
+            "hardware_id": "BOT_TEST",
+            "unit_payload": {"average_weight": "half a gram"},
+            "compartments": [{"compartment": 1, "weight": 50.0}]
+        })
+        assert response.status_code == 400
+        assert response.get_json()["errors"] == [
+            {"field": "$.unit_payload.average_weight", "error": "Expected `float | null`, got `str`"}
+        ]
+
+        # Numeric strings are still accepted, missing readings stay per-compartment errors
+        response = client.post("/api/hardware/sensor_data", json={
+            "hardware_id": "BOT_TEST",
+            "compartments": [{"compartment": "1", "weight": "50.5"}, {"compartment": 2}]
+        })
+        body = response.get_json()
+        assert response.status_code == 200
+        assert body["results"][0]["new_weight"] == 50.5
+        assert body["errors"] == [{"compartment": 2, "error": "Missing compartment or weight data"}]
+
+        logs = client.get("/api/hardware/logs?limit=100").get_json()
+        assert any(log["error_message"].startswith("Invalid payload: $.unit_payload.average_weight")
+                   for log in logs if log["error_message"])
+
+
+def test_delta_payloads_apply_on_their_base_report_only():
+    app = make_app()
+    from ingestion.codec import BINARY_CONTENT_TYPE, encode_sensor_frame
+
+    def delta(seq, base_seq, compartments):
+        return {"hardware_id": "BOT_TEST", "seq": seq, "base_seq": base_seq, "compartments": [
+            {"compartment": n, "weight": w} for n, w in compartments
+        ]}
+
+    def weights(client, kit):
+        medicines = client.get(f"/api/medicines/?botiquin_id={kit['id']}").get_json()
+        return {m["compartment_number"]: m["current_weight"] for m in medicines}
+
+    with app.test_client() as client:
+        kit = register_kit(client)
+
+        # No full report seen yet: the kit must start with one
+        response = client.post("/api/hardware/sensor_data", json=delta(1, 0, [(1, 40.0)]))
+        assert response.status_code == 409
+        assert response.get_json()["code"] == "RESEND_FULL"
+
+        full = dict(sensor_payload("BOT_TEST", 4, 50.0), seq=1)
+        assert client.post("/api/hardware/sensor_data", json=full).status_code == 200
+
+        response = client.post("/api/hardware/sensor_data", json=delta(2, 1, [(3, 20.0)]))
+        assert response.status_code == 200
+        assert [r["compartment"] for r in response.get_json()["results"]] == [3]
+        assert weights(client, kit) == {1: 50.0, 2: 50.0, 3: 20.0, 4: 50.0}
+
+        # Report 3 was lost: a delta on top of it is rejected and nothing changes
+        response = client.post("/api/hardware/sensor_data", json=delta(4, 3, [(1, 10.0)]))
+        assert response.status_code == 409
+        assert response.get_json() == {
+            "error": "Delta base_seq 3 does not follow the last applied report (2)",
+            "code": "RESEND_FULL",
+            "expected_base_seq": 2
+        }
+        assert weights(client, kit)[1] == 50.0
+
+        # Deltas work the same in binary frames
+        response = client.post("/api/hardware/sensor_data", content_type=BINARY_CONTENT_TYPE,
+                               data=encode_sensor_frame(delta(3, 2, [(2, 35.0)])))
+        assert response.status_code == 200
+        assert weights(client, kit) == {1: 50.0, 2: 35.0, 3: 20.0, 4: 50.0}
+
+        response = client.post("/api/hardware/sensor_data", json={"hardware_id": "BOT_TEST", "base_seq": 3, "compartments": []})
+        assert response.status_code == 400
+
+
+def test_retried_reports_are_applied_once():
+    app = make_app()
+    from ingestion.idempotency import get_response_cache
+    from models.models import HardwareLog, Medicine
+
+    def log_count():
+        with app.app_context():
+            return HardwareLog.query.count()
+
+    with app.test_client() as client:
+        register_kit(client)
+        report = dict(sensor_payload("BOT_TEST", 4, 40.0), seq=100)
+        first = client.post("/api/hardware/sensor_data", json=report)
+        assert first.status_code == 200
+        logs = log_count()
+
+        # The answer was lost and the kit retries: same response, no query
+        with count_statements(app) as statements:
+            retry = client.post("/api/hardware/sensor_data", json=report)
+        assert statements == []
+        assert retry.status_code == 200 and retry.get_json() == first.get_json()
+        assert retry.headers["Idempotent-Replayed"] == "true"
+
+        # Keys work the same, from the body or the Idempotency-Key header
+        keyed = sensor_payload("BOT_TEST", 4, 35.0)
+        first = client.post("/api/hardware/sensor_data", json=keyed, headers={"Idempotency-Key": "k-1"})
+        with count_statements(app) as statements:
+            retry = client.post("/api/hardware/sensor_data", json=dict(keyed, idempotency_key="k-1"))
+        assert statements == [] and retry.get_json() == first.get_json()
+        logs = log_count()
+
+        # Another worker (or an evicted entry): the kit's high-water marks reject the retry
+        get_response_cache(app).clear()
+        response = client.post("/api/hardware/sensor_data", json=dict(report, compartments=[
+            {"compartment": 1, "weight": 1.0}
+        ]))
+        assert response.status_code == 200
+        assert response.get_json() == {
+            "success": True, "duplicate": True, "seq": 100, "message": "Report 100 was already applied"
+        }
+        response = client.post("/api/hardware/sensor_data?ack=1", json=dict(keyed, idempotency_key="k-1"))
+        assert response.get_json() == {"ack": "duplicate", "server_seq": 2}
+        assert log_count() == logs
+
+        # A lower seq without a boot_id means the kit restarted its counter
+        response = client.post("/api/hardware/sensor_data", json=dict(sensor_payload("BOT_TEST", 4, 30.0), seq=1))
+        assert response.status_code == 200 and "duplicate" not in response.get_json()
+
+        response = client.post("/api/hardware/sensor_data", json=keyed, headers={"Idempotency-Key": "k" * 129})
+        assert response.status_code == 400
+
+    with app.app_context():
+        assert {m.current_weight for m in Medicine.query.all()} == {30.0}
+
+
+def test_kit_reboot_restarting_its_seq_is_not_taken_for_retries():
+    app = make_app()
+    from models.models import CompartmentReading, Medicine
+
+    def weights():
+        with app.app_context():
+            return {m.current_weight for m in Medicine.query.all()}
+
+    with app.test_client() as client:
+        register_kit(client)
+        for seq in range(1, 11):
+            assert client.post("/api/hardware/sensor_data", json=dict(sensor_payload("BOT_TEST", 4, 50.0 - seq), seq=seq)).status_code == 200
+
+        # Rebooted without a boot_id: a seq below the mark restarts the counter
+        response = client.post("/api/hardware/sensor_data", json=dict(sensor_payload("BOT_TEST", 4, 10.0), seq=1))
+        assert "Idempotent-Replayed" not in response.headers
+        assert {r["new_weight"] for r in response.get_json()["results"]} == {10.0}
+        response = client.post("/api/hardware/sensor_data?ack=1", json=dict(sensor_payload("BOT_TEST", 4, 9.0), seq=2))
+        assert response.get_json()["ack"] == "ok" and weights() == {9.0}
+        # ...while a repeat of the newest seq is still a retry
+        response = client.post("/api/hardware/sensor_data?ack=1", json=dict(sensor_payload("BOT_TEST", 4, 9.0), seq=2))
+        assert response.headers["Idempotent-Replayed"] == "true"
+
+        # With a boot_id, older reports of the same boot are retries and a new boot starts over
+        for boot_id, seq, weight in ((7, 5, 20.0), (7, 4, 21.0), (8, 1, 22.0), (8, 5, 23.0), (8, 1, 24.0)):
+            client.post("/api/hardware/sensor_data", json=dict(
+                sensor_payload("BOT_TEST", 4, weight), seq=seq, boot_id=boot_id
+            ))
+        assert weights() == {23.0}
+
+    with app.app_context():
+        stored = {r.weight for r in CompartmentReading.query.all()}
+        assert {10.0, 9.0, 20.0, 22.0, 23.0} <= stored and not {21.0, 24.0} & stored
+
+
+def test_ack_mode_skips_building_results(monkeypatch):
+    app = make_app()
+    import ingestion.pipeline as pipeline
+    from ingestion.idempotency import get_response_cache
+
+    with app.test_client() as client:
+        register_kit(client)
+        client.post("/api/hardware/sensor_data", json=sensor_payload("BOT_TEST", 4))
+
+        def no_status(*args, **kwargs):
+            raise AssertionError("ack responses must not compute per-compartment status")
+
+        monkeypatch.setattr(pipeline, "stock_status", no_status)
+
+        def ack(response):
+            body = response.get_json()
+            assert body.pop("next") > 0
+            return body
+
+        response = client.post("/api/hardware/sensor_data?ack=1", json=dict(sensor_payload("BOT_TEST", 4, 30.0), seq=7))
+        assert response.status_code == 200
+        assert ack(response) == {"ack": "ok", "server_seq": 2, "seq": 7}
+
+        # A retry past the response cache applies nothing, so the server's number stays
+        get_response_cache(app).clear()
+        response = client.post("/api/hardware/sensor_data?ack=1", json=dict(sensor_payload("BOT_TEST", 4, 30.0), seq=7))
+        assert response.get_json() == {"ack": "duplicate", "server_seq": 2, "seq": 7}
+
+        payload = sensor_payload("BOT_TEST", 4, 20.0)
+        payload["compartments"].append({"compartment": None, "weight": 1.0})
+        response = client.post("/api/hardware/sensor_data", json=payload, headers={"Prefer": "return=minimal"})
+        assert ack(response) == {"ack": "partial", "server_seq": 3}
+
+        app.config["HARDWARE_GROUP_COMMIT"] = True
+        response = client.post("/api/hardware/sensor_data?ack=true", json=sensor_payload("BOT_TEST", 4, 10.0))
+        assert ack(response) == {"ack": "ok", "server_seq": 4}
+
+        # Errors keep their usual bodies
+        response = client.post("/api/hardware/sensor_data?ack=1", json=sensor_payload("BOT_NOPE", 4))
+        assert response.status_code == 404 and "error" in response.get_json()
+
+    with app.app_context():
+        from models.models import Medicine
+        assert {m.current_weight for m in Medicine.query.all()} == {10.0}
+
+
+def test_report_schedule_follows_kit_activity_and_load():
+    from datetime import datetime, timedelta
+
+    app = make_app()
+    from db import db
+    from models.models import Medicine
+    app.config.update(HARDWARE_REPORT_INTERVAL=60, HARDWARE_REPORT_INTERVAL_MIN=10,
+                      HARDWARE_REPORT_INTERVAL_MAX=600, HARDWARE_REPORT_TARGET_RATE=0)
+
+    def schedule(client, hardware_id, weight, after=60):
+        # The previous reading was taken `after` seconds ago
+        with app.app_context():
+            Medicine.query.update({"last_scan_at": datetime.utcnow() - timedelta(seconds=after)})
+            db.session.commit()
+        response = client.post("/api/hardware/sensor_data", json=sensor_payload(hardware_id, 4, weight))
+        return response.get_json()["next_report"]
+
+    with app.test_client() as client:
+        for hardware_id in ("BOT_IDLE", "BOT_BUSY", "BOT_LOW", "BOT_SLOW"):
+            register_kit(client, hardware_id)
+            schedule(client, hardware_id, 100.0)
+
+        idle = schedule(client, "BOT_IDLE", 100.0)
+        busy = schedule(client, "BOT_BUSY", 80.0)
+        assert (idle["interval"], busy["interval"]) == (240.0, 15.0)
+
+        # The same movement spread over ten base intervals is a slow kit, not a busy one
+        assert schedule(client, "BOT_SLOW", 80.0, after=600)["interval"] == 30.0
+
+        # A barely moving kit close to the low-stock threshold still reports at half the base interval
+        schedule(client, "BOT_LOW", 22.0)
+        assert schedule(client, "BOT_LOW", 21.8)["interval"] == 30.0
+
+        # Stable phase per device, inside the interval, next slot at least half an interval away
+        assert schedule(client, "BOT_IDLE", 100.0)["offset"] == idle["offset"]
+        assert idle["offset"] != schedule(client, "BOT_BUSY", 80.0)["offset"]
+        assert 0 <= idle["offset"] < idle["interval"]
+        assert idle["interval"] / 2 <= idle["next_in"] <= idle["interval"] * 1.5
+
+        ping = client.post("/api/hardware/test_connection", json={"hardware_id": "BOT_IDLE"}).get_json()
+        assert ping["next_report"]["interval"] == 60.0
+
+        # More reports than the worker's target rate stretch every interval
+        app.config["HARDWARE_REPORT_TARGET_RATE"] = 0.1
+        assert client.post("/api/hardware/test_connection", json={"hardware_id": "BOT_IDLE"}).get_json()["next_report"]["interval"] > 60.0
+
+
+def test_backfill_writes_history_in_time_order_and_state_from_newest_reading():
+    from datetime import datetime, timedelta, timezone
+
+    app = make_app()
+    base = datetime.utcnow().replace(microsecond=0) - timedelta(hours=3)
+
+    def reading(minutes, weights):
+        return {
+            "timestamp": (base + timedelta(minutes=minutes)).isoformat(),
+            "compartments": [{"compartment": n, "weight": w} for n, w in weights.items()]
+        }
+
+    with app.test_client() as client:
+        kit = register_kit(client, "BOT_OFFLINE")
+        # Compartment 1 already has a live reading newer than anything buffered
+        client.post("/api/hardware/sensor_data", json=sensor_payload("BOT_OFFLINE", 1, 70.0))
+
+        response = client.post("/api/hardware/backfill", json={
+            "hardware_id": "BOT_OFFLINE",
+            "sensor_type": "weight",
+            "readings": [
+                reading(20, {1: 90.0, 2: 80.0}),
+                reading(0, {1: 100.0, 2: 100.0}),
+                reading(10, {2: 90.0}),
+                reading(60 * 24, {2: 1.0}),
+                {"timestamp": int((base + timedelta(minutes=30)).replace(tzinfo=timezone.utc).timestamp()),
+                 "compartments": [{"compartment": 2}]}
+            ]
+        })
+        body = response.get_json()
+        assert response.status_code == 200
+        assert (body["readings"], body["from"], body["to"]) == (4, base.isoformat(), (base + timedelta(minutes=30)).isoformat())
+        assert [(u["compartment"], u["old_weight"], u["new_weight"]) for u in body["updated"]] == [(2, None, 80.0)]
+        assert [s["compartment"] for s in body["skipped"]] == [1]
+        assert [e["error"] for e in body["errors"]] == ["Missing compartment or weight data", "Timestamp is in the future"]
+
+        unknown = client.post("/api/hardware/backfill", json={"hardware_id": "NOPE", "readings": [reading(0, {1: 1.0})]})
+        assert unknown.status_code == 404
+        invalid = client.post("/api/hardware/backfill", json={"hardware_id": "BOT_OFFLINE", "readings": [{"compartments": []}]})
+        assert invalid.get_json()["errors"] == [{"field": "$.readings[0].timestamp", "error": "Missing required field"}]
+
+    with app.app_context():
+        from models.models import CompartmentReading, HardwareLog, Medicine
+        history = CompartmentReading.query.filter(
+            CompartmentReading.botiquin_id == kit["id"], CompartmentReading.ts < base + timedelta(hours=1)
+        ).order_by(CompartmentReading.ts, CompartmentReading.compartment).all()
+        assert [(h.ts - base, h.compartment, h.weight) for h in history] == [
+            (timedelta(0), 1, 100.0), (timedelta(0), 2, 100.0),
+            (timedelta(minutes=10), 2, 90.0),
+            (timedelta(minutes=20), 1, 90.0), (timedelta(minutes=20), 2, 80.0)
+        ]
+        rejected = HardwareLog.query.filter(HardwareLog.compartment_number.isnot(None)).all()
+        assert [(r.created_at - base, r.compartment_number, r.error_message) for r in rejected] == [
+            (timedelta(minutes=30), 2, "Missing compartment or weight data")
+        ]
+
+        medicines = {m.compartment_number: m for m in Medicine.query.filter_by(botiquin_id=kit["id"])}
+        assert medicines[1].current_weight == 70.0
+        assert (medicines[2].current_weight, medicines[2].initial_weight) == (80.0, 100.0)
+        assert medicines[2].last_scan_at == base + timedelta(minutes=20)
+
+
+def test_backfill_answers_when_its_error_log_cannot_be_written(monkeypatch):
+    from sqlalchemy.exc import OperationalError
+
+    app = make_app()
+    outage = OperationalError("INSERT", {}, Exception("Can't connect to MySQL server"))
+    import routes.hardware
+
+    with app.test_client() as client:
+        register_kit(client, "BOT_OFFLINE")
+        monkeypatch.setattr(routes.hardware, "apply_backfill", lambda *args: (_ for _ in ()).throw(outage))
+        monkeypatch.setattr(routes.hardware, "write_hardware_logs", lambda rows: (_ for _ in ()).throw(outage))
+        response = client.post("/api/hardware/backfill", json={
+            "hardware_id": "BOT_OFFLINE",
+            "readings": [{"timestamp": 1700000000, "compartments": [{"compartment": 1, "weight": 10.0}]}]
+        })
+        assert response.status_code == 500
+        assert "Processing error" in response.get_json()["error"]
+
+        # The session was rolled back and keeps working
+        monkeypatch.undo()
+        assert client.post("/api/hardware/sensor_data", json=sensor_payload("BOT_OFFLINE", 1)).status_code == 200
+
+
+def test_rollups_follow_readings_in_any_order():
+    from datetime import datetime, timedelta
+
+    app = make_app()
+    # Two hours of one day, and the previous day
+    day = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=2)
+
+    def backfill(client, *readings):
+        response = client.post("/api/hardware/backfill", json={"hardware_id": "BOT_ROLL", "readings": [
+            {"timestamp": (day + offset).isoformat(), "compartments": [{"compartment": 1, "weight": w}]}
+            for offset, w in readings
+        ]})
+        assert response.status_code == 200
+
+    with app.test_client() as client:
+        kit = register_kit(client, "BOT_ROLL")
+        backfill(client, (timedelta(hours=10, minutes=5), 90.0), (timedelta(hours=10, minutes=50), 70.0),
+                 (timedelta(hours=11, minutes=30), 60.0), (timedelta(hours=-2), 100.0))
+        # A second upload, older readings last: first/last keep their time order
+        backfill(client, (timedelta(hours=10, minutes=30), 95.5), (timedelta(hours=10, minutes=1), 85.0),
+                 (timedelta(hours=11, minutes=45), None))
+
+        hourly = client.get(f"/api/hardware/rollups/hourly?botiquin_id={kit['id']}&compartment=1"
+                            f"&since={day.isoformat()}").get_json()
+        assert [(r["period_start"], r["min_weight"], r["max_weight"], r["first_weight"], r["last_weight"],
+                 r["samples"], r["errors"]) for r in hourly] == [
+            ((day + timedelta(hours=10)).isoformat(), 70.0, 95.5, 85.0, 70.0, 4, 0),
+            ((day + timedelta(hours=11)).isoformat(), 60.0, 60.0, 60.0, 60.0, 1, 1)
+        ]
+        assert hourly[0]["first_at"] == (day + timedelta(hours=10, minutes=1)).isoformat()
+
+        daily = client.get(f"/api/hardware/rollups/daily?botiquin_id={kit['id']}").get_json()
+        assert [(r["period_start"], r["first_weight"], r["last_weight"], r["samples"], r["errors"])
+                for r in daily] == [
+            ((day - timedelta(days=1)).isoformat(), 100.0, 100.0, 1, 0),
+            (day.isoformat(), 85.0, 60.0, 5, 1)
+        ]
+
+        # Live reports roll up in the same transaction
+        with count_statements(app, contains="reading_rollups_") as rollup_statements:
+            client.post("/api/hardware/sensor_data", json=sensor_payload("BOT_ROLL", 1, 55.0))
+        assert len(rollup_statements) == 2
+        today = client.get(f"/api/hardware/rollups/daily?botiquin_id={kit['id']}"
+                           f"&since={(day + timedelta(days=1)).isoformat()}").get_json()
+        assert [(r["samples"], r["last_weight"]) for r in today] == [(1, 55.0)]
+        assert client.get("/api/hardware/rollups/weekly?botiquin_id=1").status_code == 404
+
+
+def test_hardware_logs_are_partitioned_by_month_and_expire_whole_months():
+    from datetime import datetime
+
+    app = make_app()
+    from ingestion.log_partitions import EXTENSION_KEY, add_months, clear_logs, count_logs, maintain, month_start
+    app.config["HARDWARE_LOG_PARTITIONS"] = True
+    app.config["HARDWARE_LOG_RETENTION_MONTHS"] = 2
+    current = month_start(datetime.utcnow())
+    old = add_months(current, -3)
+
+    with app.test_client() as client:
+        kit = register_kit(client, "BOT_PART")
+        payload = sensor_payload("BOT_PART", 4)
+        payload["compartments"].append({"compartment": 9})
+        with count_statements(app, contains=f"INSERT INTO hardware_logs_{current:%Y%m}") as inserts:
+            assert client.post("/api/hardware/sensor_data", json=payload).status_code == 200
+        assert len(inserts) == 2
+
+        # A reading buffered three months ago and rejected: its row lands in
+        # that month, the payload in the current one
+        response = client.post("/api/hardware/backfill", json={"hardware_id": "BOT_PART", "readings": [
+            {"timestamp": (old.replace(day=2)).isoformat(), "compartments": [{"compartment": 1}]}
+        ]})
+        assert response.status_code == 200
+
+        logs = client.get("/api/hardware/logs").get_json()
+        assert [log["created_at"][:7] for log in logs] == [f"{current:%Y-%m}"] * 3 + [f"{old:%Y-%m}"]
+        assert all(log["id"] // 10 ** 9 == int(log["created_at"][:7].replace("-", "")) for log in logs)
+        payload_row = next(log for log in logs if log["id"] == logs[-1]["payload_log_id"])
+        assert logs[-1]["raw_data"] == payload_row["raw_data"]
+
+        # A range within one month reads only that month's table
+        with count_statements(app, contains="SELECT hardware_logs_") as selects:
+            recent = client.get(f"/api/hardware/logs?since={current.isoformat()}&botiquin_id={kit['id']}").get_json()
+        assert len(recent) == 3 and len(selects) == 1
+        older = client.get(f"/api/hardware/logs?until={add_months(old, 1).isoformat()}").get_json()
+        assert [log["compartment_number"] for log in older] == [1]
+        assert older[0]["raw_data"] == payload_row["raw_data"]
+
+    # Retention drops the expired month as a table, without DELETE statements
+    with app.app_context():
+        with count_statements(app, contains="DELETE") as deletes:
+            result = maintain()
+        assert deletes == []
+        assert result == {
+            "created": [f"hardware_logs_{add_months(current, n):%Y%m}" for n in (1, 2)],
+            "dropped": [f"hardware_logs_{old:%Y%m}"]
+        }
+        assert count_logs() == 3
+
+    with app.test_client() as client:
+        logs = client.get("/api/hardware/logs").get_json()
+        assert len(logs) == 3
+
+        # A worker that has not seen this month yet creates it again as a no-op,
+        # keeping the table's rows and id sequence
+        app.extensions[EXTENSION_KEY].clear()
+        assert client.post("/api/hardware/sensor_data", json=sensor_payload("BOT_PART", 4, 10.0)).status_code == 200
+        newest, *rest = client.get("/api/hardware/logs").get_json()
+        assert rest == logs and newest["id"] == max(log["id"] for log in logs) + 1
+
+    with app.app_context():
+        from db import db
+        clear_logs()
+        db.session.commit()
+        assert count_logs() == 0
+
+
+def test_line_protocol_listener_feeds_the_ingestion_writer():
+    import asyncio
+    import socket
+
+    app = make_app()
+    with app.test_client() as client:
+        register_kit(client, "BOT_LINE")
+
+    from ingestion.codec import PayloadDecodeError, decode_sensor_line
+    from ingestion.line_listener import LineProtocolListener
+
+    assert decode_sensor_line(b"BOT_LINE 1=45.5,2=0 1758623400") == {
+        "hardware_id": "BOT_LINE",
+        "sensor_type": "weight",
+        "compartments": [
+            {"compartment": 1, "weight": 45.5, "unit": "grams"},
+            {"compartment": 2, "weight": 0.0, "unit": "grams"}
+        ],
+        "timestamp": "2025-09-23T10:30:00"
+    }
+    for line in (b"BOT_LINE", b"BOT_LINE 1=x", b"BOT_LINE 1=nan", b"BOT_LINE 1=2 soon"):
+        try:
+            decode_sensor_line(line)
+            assert False, line
+        except PayloadDecodeError:
+            pass
+
+    async def exercise():
+        listener = LineProtocolListener(app)
+        tcp_port, udp_port = await listener.start("127.0.0.1", 0, 0)
+
+        reader, writer = await asyncio.open_connection("127.0.0.1", tcp_port)
+        writer.write(b"BOT_LINE 1=40,2=30\n\nBOT_LINE oops\nBOT_LINE 1=39.5,2=30 1758623400\n")
+        await writer.drain()
+        assert (await reader.readline()).startswith(b"ERR Invalid reading")
+        writer.close()
+
+        udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        udp.sendto(b"BOT_LINE 3=20\nBOT_UNKNOWN 1=1\n", ("127.0.0.1", udp_port))
+        udp.close()
+
+        while listener.lines < 5:
+            await asyncio.sleep(0.01)
+        await asyncio.get_running_loop().run_in_executor(None, listener.writer.drain)
+        stats = listener.stats()
+        await listener.stop()
+        return stats
+
+    stats = asyncio.run(exercise())
+    assert (stats["lines"], stats["accepted"], stats["invalid"]) == (5, 4, 1)
+    assert (stats["writer"]["processed"], stats["writer"]["failed"]) == (3, 1)
+
+    with app.app_context():
+        from models.models import Medicine
+        weights = {m.compartment_number: m.current_weight for m in Medicine.query.all()}
+        assert weights == {1: 39.5, 2: 30.0, 3: 20.0}
+
+
+def test_ingestion_gateway_serves_device_routes_on_a_bounded_pool(tmp_path):
+    import asyncio
+
+    # Pool threads need their own connections; the in-memory database has only one
+    app = make_app(f"sqlite:///{tmp_path / 'gateway.db'}")
+    from ingestion.gateway import IngestionGateway
+
+    async def request(gateway, method, path, body=b"", chunks=1, delay=0.0):
+        """One ASGI request whose body trickles in `chunks` pieces, `delay` seconds apart."""
+        pieces = [body[len(body) * i // chunks:len(body) * (i + 1) // chunks] for i in range(chunks)]
+        messages = [{"type": "http.request", "body": piece, "more_body": i < chunks - 1}
+                    for i, piece in enumerate(pieces)]
+        sent = []
+
+        async def receive():
+            if delay:
+                await asyncio.sleep(delay)
+            return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {"type": "http", "method": method, "path": path, "query_string": b"",
+                 "headers": [(b"content-type", b"application/json")]}
+        await gateway(scope, receive, send)
+        return sent[0]["status"], json.loads(sent[1]["body"])
+
+    async def exercise():
+        gateway = IngestionGateway(app, threads=2, max_pending=1000, body_timeout=5)
+        status, body = await request(gateway, "POST", "/api/hardware/register_hardware", json.dumps(
+            {"hardware_id": "BOT_GW", "name": "Gateway kit", "compartments": 4}).encode())
+        assert status == 201
+
+        # 40 kits on slow links at once: every request is served, never more than 2 on the pool
+        payload = json.dumps(sensor_payload("BOT_GW", 4, 42.0)).encode()
+        responses = await asyncio.gather(*[
+            request(gateway, "POST", "/api/hardware/sensor_data", payload, chunks=4, delay=0.02)
+            for _ in range(40)
+        ])
+        assert {status for status, _ in responses} == {200}
+        assert responses[0][1]["botiquin"]["hardware_id"] == "BOT_GW"
+
+        status, ping = await request(gateway, "POST", "/api/hardware/test_connection", b'{"hardware_id": "BOT_GW"}')
+        assert status == 200 and "next_report" in ping
+
+        status, health = await request(gateway, "GET", "/health")
+        assert (health["completed"], health["max_in_flight"], health["connections"]) == (42, 2, 0)
+
+        assert (await request(gateway, "GET", "/api/hardware/logs"))[0] == 404
+        gateway.max_body_bytes = 10
+        assert (await request(gateway, "POST", "/api/hardware/sensor_data", payload))[0] == 413
+        gateway.max_body_bytes, gateway.body_timeout = 1 << 20, 0.05
+        assert (await request(gateway, "POST", "/api/hardware/sensor_data", payload, chunks=2, delay=0.2))[0] == 408
+
+        # No room to wait for a thread: the second concurrent request is turned away
+        busy = IngestionGateway(app, threads=1, max_pending=0)
+        statuses = await asyncio.gather(*[request(busy, "POST", "/api/hardware/sensor_data", payload) for _ in range(2)])
+        assert sorted(status for status, _ in statuses) == [200, 503]
+
+    asyncio.run(exercise())
+
+
+def test_spool_journals_payloads_during_outage_and_replays_them_in_order(tmp_path, monkeypatch):
+    from datetime import datetime
+
+    from sqlalchemy.exc import OperationalError
+
+    app = make_app()
+    app.config.update(HARDWARE_SPOOL_DIR=str(tmp_path), HARDWARE_SPOOL_RETRY_INTERVAL=0.02,
+                      HARDWARE_SPOOL_SEGMENT_BYTES=1024)
+    outage = OperationalError("SELECT", {}, Exception("Can't connect to MySQL server"))
+
+    import routes.hardware
+    import ingestion.spool
+    from ingestion.spool import SensorSpool, get_spool
+
+    with app.test_client() as client:
+        register_kit(client, "BOT_SPOOL")
+
+        # The database goes away: the failing request and every later one is journaled
+        monkeypatch.setattr(routes.hardware, "find_kits", lambda ids: (_ for _ in ()).throw(outage))
+        monkeypatch.setattr(ingestion.spool, "apply_sensor_batch", lambda payloads, **kw: (_ for _ in ()).throw(outage))
+        for weight in range(30, 10, -1):
+            response = client.post("/api/hardware/sensor_data", json=sensor_payload("BOT_SPOOL", 4, float(weight)))
+            assert response.status_code == 202 and response.get_json()["status"] == "spooled"
+
+        spool = get_spool(app)
+        time.sleep(0.1)
+        status = client.get("/api/hardware/ingest/status").get_json()["spool"]
+        assert (status["engaged"], status["pending"], status["appended"]) == (True, 20, 20)
+        assert status["segments"] > 1 and status["bytes"] > 1024 and status["lag_seconds"] > 0
+        assert status["replay_failures"] >= 1 and "Can't connect" in status["reason"]
+
+        # Crash: the worker stops with a torn record at the end of the journal
+        spool.close()
+        monkeypatch.undo()
+        last_segment = sorted(p for p in os.listdir(spool.directory) if p.endswith(".seg"))[-1]
+        with open(os.path.join(spool.directory, last_segment), "ab") as f:
+            f.write(b"\x40\x00\x00\x00torn")
+
+        recovered_at = datetime.utcnow()
+        replayer = SensorSpool(app, str(tmp_path), segment_bytes=1024, retry_interval=0.02)
+        app.extensions[ingestion.spool.EXTENSION_KEY] = replayer
+        replayer.engage("restarted")
+        assert replayer.active() and replayer.pending() == 20
+        assert replayer.drain()
+
+        status = client.get("/api/hardware/ingest/status").get_json()["spool"]
+        assert (status["engaged"], status["pending"], status["replayed"], status["segments"]) == (False, 0, 20, 1)
+
+        # Healthy again: requests go straight to the database
+        assert client.post("/api/hardware/sensor_data", json=sensor_payload("BOT_SPOOL", 4, 5.0)).status_code == 200
+        replayer.close()
+
+    with app.app_context():
+        from models.models import CompartmentReading, Medicine
+        assert {m.current_weight for m in Medicine.query.all()} == {5.0}
+        replayed = CompartmentReading.query.filter_by(compartment=1).order_by(CompartmentReading.ts).all()
+        assert [r.weight for r in replayed] == [float(w) for w in range(30, 10, -1)] + [5.0]
+        # Stamped with the time they were journaled, not the time of the replay
+        assert all(r.ts < recovered_at for r in replayed[:-1])
+
+
+def test_spool_moves_payloads_the_database_rejects_to_dead_letters(tmp_path, monkeypatch):
+    app = make_app()
+    app.config.update(HARDWARE_SPOOL_DIR=str(tmp_path), HARDWARE_SPOOL_RETRY_INTERVAL=0.02)
+
+    import ingestion.pipeline as pipeline
+    from sqlalchemy.exc import OperationalError
+    from ingestion.schema import convert_sensor_payload
+    from ingestion.spool import DEAD_LETTER_FILE, get_spool
+
+    apply_sensor_payload = pipeline.apply_sensor_payload
+    lock_waits = []
+
+    # One kit of the replayed batch fails inside its own SAVEPOINT: 13 always
+    # (a bad payload), 14 once (a lock wait, to be retried)
+    def fail_some_kits(data, *args, **kwargs):
+        weight = data.compartments[0].weight
+        if weight == 13.0:
+            raise ValueError("Rejected by the database")
+        if weight == 14.0 and not lock_waits:
+            lock_waits.append(weight)
+            raise OperationalError("UPDATE medicines", {}, Exception("Lock wait timeout exceeded"))
+        return apply_sensor_payload(data, *args, **kwargs)
+
+    monkeypatch.setattr(pipeline, "apply_sensor_payload", fail_some_kits)
+
+    with app.test_client() as client:
+        register_kit(client, "BOT_DEAD")
+        spool = get_spool(app)
+        spool.engage("test")
+        for weight in (12.0, 13.0, 14.0, 15.0):
+            spool.append(convert_sensor_payload(sensor_payload("BOT_DEAD", 4, weight)))
+        assert spool.drain()
+
+        status = client.get("/api/hardware/ingest/status").get_json()["spool"]
+        assert (status["pending"], status["replayed"], status["dead_letters"]) == (0, 3, 1)
+        with open(os.path.join(spool.directory, DEAD_LETTER_FILE)) as f:
+            dead, = [json.loads(line) for line in f]
+        assert "Rejected by the database" in dead["error"]
+        assert json.loads(dead["payload"])["compartments"][0]["weight"] == 13.0
+        spool.close()
+
+    with app.app_context():
+        from models.models import CompartmentReading, Medicine
+        assert lock_waits == [14.0]
+        assert {m.current_weight for m in Medicine.query.all()} == {15.0}
+        history = CompartmentReading.query.filter_by(compartment=1).order_by(CompartmentReading.ts).all()
+        assert [h.weight for h in history] == [12.0, 14.0, 15.0]